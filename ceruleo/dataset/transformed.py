@@ -1,34 +1,87 @@
-import functools
 import gzip
+import os
 import pickle
-from multiprocessing import Pool
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
+from functools import partial
 from pathlib import Path
-from typing import Optional, Union
+from typing import List, Optional, Union
 
 import numpy as np
 import pandas as pd
+from ceruleo import CACHE_PATH
 from ceruleo.dataset.ts_dataset import AbstractTimeSeriesDataset
 from ceruleo.transformation.functional.transformers import Transformer
-from ceruleo.utils.lrucache import LRUDataCache
+from ceruleo.utils.lrucache import (CachePolicy, TwoTierCache, build_cache,
+                                    data_size)
+from ceruleo.utils.workers import process_context
 from sklearn.utils.validation import check_is_fitted
 from tqdm.auto import tqdm
 
 
-def _transform(transformer, dataset, i: int):
-    data = dataset[i]
-    return (i, transformer.transform(data))
+def _transform_cycles(transformer, dataset, indices):
+    return [(i, transformer.transform(dataset[i])) for i in indices]
+
+
+# Transformer and dataset of each worker process, set by its initializer.
+# The threads share this module, so they receive them with partial instead
+_worker_state = {}
+
+
+def _init_worker(transformer, dataset):
+    _worker_state["transformer"] = transformer
+    _worker_state["dataset"] = dataset
+
+
+def _transform_chunk(indices):
+    return _transform_cycles(
+        _worker_state["transformer"], _worker_state["dataset"], indices
+    )
 
 
 class TransformedDataset(AbstractTimeSeriesDataset):
+    """Dataset whose run-to-failure cycles are transformed on access
+
+    The transformed cycles are kept in a cache. When spill_to_disk is
+    enabled, the cycles evicted from memory are written as `.npy` files
+    under cache_path and served back memory-mapped, without transforming
+    them again.
+
+    Parameters:
+
+        dataset: The dataset to transform
+        transformer: A fitted transformer
+        cache_size: Maximum number of transformed cycles in memory,
+                    by default the number of cycles of the dataset
+        cache_max_bytes: Maximum size in bytes of the transformed cycles
+                         in memory. None for no limit
+        cache_policy: Eviction policy of the cache
+        spill_to_disk: Wether to keep the evicted cycles in an on-disk tier
+        cache_path: Where to store the on-disk tier
+    """
     def __init__(
-        self, dataset, transformer: Transformer, cache_size: Optional[int] = None
+        self,
+        dataset,
+        transformer: Transformer,
+        cache_size: Optional[int] = None,
+        cache_max_bytes: Optional[int] = None,
+        cache_policy: CachePolicy = CachePolicy.LRU,
+        spill_to_disk: bool = False,
+        cache_path: Path = CACHE_PATH,
     ):
         super().__init__()
         self.transformer = transformer
         self.dataset = dataset
         if cache_size is None:
             cache_size = len(dataset)
-        self.cache = LRUDataCache(cache_size)
+        self.cache = build_cache(
+            cache_policy,
+            cache_size,
+            cache_max_bytes,
+            spill_to_disk=spill_to_disk,
+            cache_path=cache_path,
+        )
+        self._time_series_sizes = {}
         check_is_fitted(transformer)
 
     @property
@@ -39,81 +92,334 @@ class TransformedDataset(AbstractTimeSeriesDataset):
         return self[i]
 
     def number_of_samples_of_time_series(self, i: int) -> int:
-        _, y, _ = self[i]
-        return y.shape[0]
-
-    def preload(self):
-        transform = functools.partial(_transform, self.transformer, self.dataset)
-        with Pool(6) as p:
-            values = list(
-                tqdm(
-                    p.imap(transform, range(self.n_time_series)),
-                    total=self.n_time_series,
-                    desc="Preloading",
-                )
+        if i not in self._time_series_sizes:
+            _, y, _ = self[i]
+            self._time_series_sizes[i] = y.shape[0]
+        return self._time_series_sizes[i]
+
+    def preload(
+        self,
+        n_jobs: int = -1,
+        backend: str = "process",
+        chunksize: int = 1,
+        max_memory: Optional[int] = None,
+    ):
+        """Transform the cycles in parallel and store them in the cache
+
+        The transformer and the dataset are sent once to each worker, which
+        receives chunks of cycle indices. The transformed cycles are added
+        to the cache as soon as each chunk completes.
+
+        Parameters:
+
+            n_jobs: Number of workers. -1 uses all the processors
+            backend: 'process' or 'thread'. The processes are started with
+                     forkserver, so the main module of the program must be
+                     importable without side effects
+            chunksize: Number of cycles transformed by each task
+            max_memory: Maximum size in bytes of the preloaded cycles.
+                        By default, the memory budget of the cache.
+                        When the cache spills to disk, all the cycles are preloaded.
+                        Otherwise no more cycles than the cache holds are
+                        preloaded
+        """
+        if backend not in ("process", "thread"):
+            raise ValueError(f"Invalid backend {backend}, use 'process' or 'thread'")
+        if n_jobs < 0:
+            n_jobs = os.cpu_count()
+        if max_memory is None and not isinstance(self.cache, TwoTierCache):
+            max_memory = self.cache.max_bytes
+        indices = [i for i in range(self.n_time_series) if i not in self.cache]
+        if not isinstance(self.cache, TwoTierCache) and self.cache.max_elem is not None:
+            indices = indices[: max(self.cache.max_elem - len(self.cache), 0)]
+        chunks = [
+            indices[start : start + chunksize]
+            for start in range(0, len(indices), chunksize)
+        ]
+        progress = tqdm(total=len(indices), desc="Preloading")
+        loaded_bytes = 0
+
+        def store(results):
+            nonlocal loaded_bytes
+            for i, elem in results:
+                loaded_bytes += data_size(elem)
+                self._time_series_sizes[i] = elem[1].shape[0]
+                self.cache.add(i, elem)
+            progress.update(len(results))
+
+        def within_budget():
+            return max_memory is None or loaded_bytes < max_memory
+
+        if n_jobs == 1:
+            for chunk in chunks:
+                if not within_budget():
+                    break
+                store(_transform_cycles(self.transformer, self.dataset, chunk))
+            progress.close()
+            return
+
+        if backend == "process":
+            executor = ProcessPoolExecutor(
+                max_workers=n_jobs,
+                mp_context=process_context(),
+                initializer=_init_worker,
+                initargs=(self.transformer, self.dataset),
             )
-        for i, (X, y, metadata) in values:
-            self.cache.add(i, (X, y, metadata))
+            transform_chunk = _transform_chunk
+        else:
+            executor = ThreadPoolExecutor(max_workers=n_jobs)
+            transform_chunk = partial(_transform_cycles, self.transformer, self.dataset)
+        with executor:
+            chunks = iter(chunks)
+            pending = set()
+            while True:
+                while within_budget() and len(pending) < 2 * n_jobs:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    pending.add(executor.submit(transform_chunk, chunk))
+                if len(pending) == 0:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    store(future.result())
+        progress.close()
 
     def get_time_series(self, i: int) -> pd.DataFrame:
-        if i not in self.cache.data:
+        elem = self.cache.get(i)
+        if elem is None:
             data = self.dataset[i]
-            X, y, metadata = self.transformer.transform(data)
-            self.cache.add(i, (X, y, metadata))
-        X, y, metadata = self.cache.get(i)
+            elem = self.cache.add(i, self.transformer.transform(data))
+        X, y, metadata = elem
+        self._time_series_sizes[i] = y.shape[0]
         return X, y, metadata
 
     def get_features_of_life(
         self, i: int, pandas: bool = True
     ) -> Union[np.ndarray, pd.DataFrame]:
         X, _, _ = self[i]
-        if pandas:
+        if pandas or isinstance(X, np.ndarray):
             return X
         else:
             return X.values
 
-    def save(self, output_path: Path):
-        TransformedSerializedDataset.save(self, output_path)
+    def save(self, output_path: Path, dtype=None):
+        TransformedSerializedDataset.save(self, output_path, dtype)
 
 
 class TransformedSerializedDataset(TransformedDataset):
+    """Transformed dataset stored on disk
+
+    The features and the target of all the run-to-failure cycles are stored
+    contiguously in two binary files, `X.bin` and `y.bin`. An index file keeps
+    the offset of each cycle, the column names, the original index
+    and the metadata of each cycle.
+
+    The binary files are read through `np.memmap`, so each cycle is
+    returned as a DataFrame that shares memory with the file and the
+    windowed iterators slice the windows without copying the cycle.
+    The values keep their dtype unless a dtype is passed to `save`.
+    The cycles that can not be stored in the binary files, because their
+    columns are not numeric or do not share a dtype, are stored as
+    gzip'ed pickles.
+
+    Datasets saved with the previous format, one gzip'ed pickle per cycle,
+    can still be loaded.
+
+    Parameters:
+
+        dataset_path: Directory where the dataset was saved
+        cache_size: Maximum number of cycles in memory
+        cache_max_bytes: Maximum size in bytes of the cycles in memory
+        cache_policy: Eviction policy of the cache
+    """
     @staticmethod
-    def save(dataset: TransformedDataset, output_path: Path):
+    def save(dataset: TransformedDataset, output_path: Path, dtype=None):
+        """Store a transformed dataset
+
+        Parameters:
+
+            dataset: The dataset to store
+            output_path: Directory where the dataset will be stored
+            dtype: Data type to which the features and target are cast,
+                   for instance np.float32 to halve the size of the files.
+                   By default the values are stored with their own dtype.
+                   The cycles whose columns are not numeric, or do not
+                   share the dtype of the rest, are stored as gzip'ed pickles
+        """
         if not output_path.is_dir():
             output_path.mkdir(parents=True, exist_ok=True)
-        file_list = {}
-        for i, life in enumerate(dataset):
-            file_list[i] = f"ts_{i}.pkl.gz"
-            with gzip.open(output_path / f"ts_{i}.pkl.gz", "wb") as file:
-                pickle.dump(life, file)
+        index = {
+            "X": _BlockIndex(dtype),
+            "y": _BlockIndex(dtype),
+            "metadata": [],
+            "files": {},
+        }
+        with open(output_path / "X.bin", "wb") as X_file, open(
+            output_path / "y.bin", "wb"
+        ) as y_file:
+            for i, (X, y, metadata) in enumerate(dataset):
+                if index["X"].accepts(X) and index["y"].accepts(y):
+                    index["X"].append(X, X_file)
+                    index["y"].append(y, y_file)
+                else:
+                    index["X"].skip()
+                    index["y"].skip()
+                    index["files"][i] = f"ts_{i}.pkl.gz"
+                    with gzip.open(output_path / f"ts_{i}.pkl.gz", "wb") as file:
+                        pickle.dump((X, y, metadata), file)
+                index["metadata"].append(metadata)
         with open(output_path / "transformer.pkl", "wb") as file:
             pickle.dump(dataset.transformer, file)
-        with open(output_path / "lives.pkl", "wb") as file:
-            pickle.dump(file_list, file)
+        with open(output_path / "index.pkl", "wb") as file:
+            pickle.dump(index, file)
 
-    def __init__(self, dataset_path: Path, cache_size: Optional[int] = None):
+    def __init__(
+        self,
+        dataset_path: Path,
+        cache_size: Optional[int] = None,
+        cache_max_bytes: Optional[int] = None,
+        cache_policy: CachePolicy = CachePolicy.LRU,
+    ):
         self.dataset_path = dataset_path
-        with open(dataset_path / "lives.pkl", "rb") as file:
-            self.files = pickle.load(file)
         with open(dataset_path / "transformer.pkl", "rb") as file:
             self.transformer = pickle.load(file)
+        if (dataset_path / "index.pkl").is_file():
+            self.files = None
+            with open(dataset_path / "index.pkl", "rb") as file:
+                self.index = pickle.load(file)
+            self.X = self.index["X"].memmap(dataset_path / "X.bin")
+            self.y = self.index["y"].memmap(dataset_path / "y.bin")
+        else:
+            with open(dataset_path / "lives.pkl", "rb") as file:
+                self.files = pickle.load(file)
+            self.index = None
+
         if cache_size is None:
-            cache_size = len(self.files)
-        self.cache = LRUDataCache(cache_size)
+            cache_size = self.n_time_series
+        self.cache = build_cache(cache_policy, cache_size, cache_max_bytes)
+        self._time_series_sizes = {}
 
     def _open_file(self, i: int):
-        with gzip.open(self.dataset_path / self.files[i], "rb") as file:
-            return pickle.load(file)
+        if self.index is None or i in self.index["files"]:
+            files = self.files if self.index is None else self.index["files"]
+            with gzip.open(self.dataset_path / files[i], "rb") as file:
+                return pickle.load(file)
+        return (
+            self.index["X"].get(self.X, i),
+            self.index["y"].get(self.y, i),
+            self.index["metadata"][i],
+        )
 
     def get_time_series(self, i: int) -> pd.DataFrame:
-        if i not in self.cache.data:
-            X, y, metadata = self._open_file(i)
-            self.cache.add(i, (X, y, metadata))
-        return self.cache.get(i)
+        elem = self.cache.get(i)
+        if elem is None:
+            elem = self.cache.add(i, self._open_file(i))
+        return elem
+
+    def number_of_samples_of_time_series(self, i: int) -> int:
+        if self.index is None or self.index["y"].empty or i in self.index["files"]:
+            return super().number_of_samples_of_time_series(i)
+        return self.index["y"].size(i)
+
+    def number_of_samples(self) -> List[int]:
+        if self.index is None or self.index["y"].empty:
+            return super().number_of_samples()
+        samples = np.diff(self.index["y"].offsets).tolist()
+        for i in self.index["files"]:
+            samples[i] = self.number_of_samples_of_time_series(i)
+        return samples
 
     @property
     def n_time_series(self):
-        return len(self.files)
+        if self.index is None:
+            return len(self.files)
+        return len(self.index["metadata"])
 
     def __len__(self):
         return self.n_time_series
+
+
+class _BlockIndex:
+    """Offsets, columns and original indices of the cycles stored
+    contiguously in a binary file"""
+
+    def __init__(self, dtype=None):
+        self.offsets = [0]
+        self.columns = None
+        self.n_columns = None
+        self.dtype = None if dtype is None else np.dtype(dtype)
+        self.cast = dtype is not None
+        self.indices = []
+        self.missing = set()
+        self.empty = True
+
+    def accepts(self, data) -> bool:
+        """Whether the values of data can be stored in the block
+        without changing them, or cast to the dtype of the block when
+        it was given"""
+        if data is None:
+            return True
+        if isinstance(data, pd.DataFrame):
+            dtypes = set(data.dtypes)
+        else:
+            dtypes = {data.dtype}
+        if not all(isinstance(d, np.dtype) and d.kind in "biufc" for d in dtypes):
+            return False
+        if self.cast:
+            return True
+        return len(dtypes) == 1 and self.dtype in (None, *dtypes)
+
+    def skip(self):
+        self.offsets.append(self.offsets[-1])
+        self.indices.append(None)
+
+    def append(self, data, file):
+        if data is None:
+            self.missing.add(len(self.indices))
+            self.skip()
+            return
+        self.empty = False
+        if isinstance(data, pd.Series):
+            data = data.to_frame()
+        if isinstance(data, pd.DataFrame):
+            columns = list(data.columns)
+            self.indices.append(data.index)
+            values = data.values
+        else:
+            columns = None
+            self.indices.append(None)
+            values = data
+        values = values.reshape(values.shape[0], -1)
+        if self.n_columns is None:
+            self.columns = columns
+            self.n_columns = values.shape[1]
+            if self.dtype is None:
+                self.dtype = values.dtype
+        elif columns != self.columns or values.shape[1] != self.n_columns:
+            raise ValueError(
+                "All the run-to-failure cycles should have the same columns"
+            )
+        np.ascontiguousarray(values, dtype=self.dtype).tofile(file)
+        self.offsets.append(self.offsets[-1] + values.shape[0])
+
+    def memmap(self, path: Path) -> Optional[np.ndarray]:
+        dtype = np.float64 if self.dtype is None else self.dtype
+        if self.offsets[-1] == 0:
+            return np.zeros((0, 0 if self.n_columns is None else self.n_columns), dtype)
+        return np.memmap(
+            path, dtype=dtype, mode="c", shape=(self.offsets[-1], self.n_columns)
+        )
+
+    def size(self, i: int) -> int:
+        return self.offsets[i + 1] - self.offsets[i]
+
+    def get(self, data: np.ndarray, i: int):
+        if i in self.missing:
+            return None
+        values = data[self.offsets[i] : self.offsets[i + 1]]
+        if self.columns is None:
+            return values
+        return pd.DataFrame(
+            values, columns=self.columns, index=self.indices[i], copy=False
+        )
@@ -204,10 +204,14 @@ class AbstractTimeSeriesDataset:
             )
         return self._common_features
 
-    def map(self, transformer, cache_size: int = None):
+    def map(
+        self, transformer, cache_size: int = None, cache_max_bytes: int = None
+    ):
         from ceruleo.dataset.transformed import TransformedDataset
 
-        return TransformedDataset(self, transformer, cache_size=cache_size)
+        return TransformedDataset(
+            self, transformer, cache_size=cache_size, cache_max_bytes=cache_max_bytes
+        )
 
     def numeric_features(self, show_progress: bool = False) -> List[str]:
         """Obtain the list of the common numeric features in the dataset
@@ -268,7 +272,7 @@ class FoldedDataset(AbstractTimeSeriesDataset):
         return [self._original_index(i) for i in range(len(self.indices))]
 
     def number_of_samples_of_time_series(self, i: int) -> int:
-        return self[i][0].shape[0]
+        return self.dataset.number_of_samples_of_time_series(self.indices[i])
 
     def __reduce_ex__(self, __protocol) -> Union[str, Tuple[Any, ...]]:
         return (self.__class__, (self.dataset, self.indices))
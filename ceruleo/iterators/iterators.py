@@ -58,7 +58,7 @@ def seq_to_seq_signal_generator(
     else:
         signal_X_1 = signal_X[initial : i + (1 if right_closed else 0), :]
 
-    if is_df:
+    if isinstance(signal_Y, pd.DataFrame):
         signal_y_1 = signal_Y.iloc[initial : i + (1 if right_closed else 0), :]
     else:
         signal_y_1 = signal_Y[initial : i + (1 if right_closed else 0), :]
@@ -98,6 +98,7 @@ def windowed_signal_generator(
     else:
         signal_X_1 = data[initial : i + (1 if right_closed else 0), :]
 
+    is_df = isinstance(target, (pd.DataFrame, pd.Series))
     if len(target.shape) == 1:
         if is_df:
             signal_y_1 = target.iloc[i : min(i + output_size, target.shape[0])].values
@@ -133,6 +134,66 @@ def windowed_signal_generator(
     return (signal_X_1, signal_y_1)
 
 
+def windowed_signal_batch(
+    data: Union[pd.DataFrame, np.ndarray],
+    target: Union[pd.DataFrame, pd.Series, np.ndarray],
+    timestamps: np.ndarray,
+    window_size: int,
+    output_size: int = 1,
+    right_closed: bool = True,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Return the lookback windows and the values to predict for a set of timestamps
+    of the same life.
+
+    It is the vectorized version of `windowed_signal_generator`: the windows
+    are views obtained with `sliding_window_view` over a zero-padded copy of
+    the life, and a single gather selects the requested timestamps.
+
+    Parameters:
+
+        data: Matrix of size (life_length, n_features) with the information of the life
+        target: Target feature of size (life_length) or (life_length, n_targets)
+        timestamps: Positions of the values to predict
+        window_size: Size of the lookback window
+        output_size: Number of points of the target
+        right_closed: Wether the las sample of the window should be included or not
+
+
+    Returns:
+
+        tuple (np.array, np.array): Windows of shape (len(timestamps), window_size, n_features)
+        and targets of shape (len(timestamps), output_size * n_targets)
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    data = np.asarray(data, dtype=np.float32)
+    target = np.asarray(target, dtype=np.float32)
+    if len(target.shape) == 1:
+        target = np.expand_dims(target, axis=1)
+
+    padded_data = np.concatenate(
+        (np.zeros((window_size, data.shape[1]), dtype=np.float32), data), axis=0
+    )
+    # Window j covers the rows [j - window_size, j) of the life
+    windows = np.lib.stride_tricks.sliding_window_view(
+        padded_data, window_size, axis=0
+    )
+    signal_X = windows[timestamps + (1 if right_closed else 0)].transpose(0, 2, 1)
+    if not right_closed:
+        # The scalar path only takes window_size - 1 points when the
+        # window is open at the right
+        signal_X[:, 0, :] = 0
+
+    padded_target = np.concatenate(
+        (target, np.zeros((output_size, target.shape[1]), dtype=np.float32)), axis=0
+    )
+    target_windows = np.lib.stride_tricks.sliding_window_view(
+        padded_target, output_size, axis=0
+    )
+    signal_y = target_windows[timestamps].transpose(0, 2, 1)
+    return (signal_X, signal_y.reshape(signal_y.shape[0], -1))
+
+
 class IterationType(Enum):
     """Iteration type
     
@@ -305,6 +366,7 @@ class WindowedDatasetIterator:
         self.horizon = horizon
         self.right_closed = right_closed
         self.length = None
+        self._samples_per_time_series = None
         self.padding = padding
         self.valid_sample = functools.partial(
             valid_sample, self.padding, self.window_size
@@ -316,14 +378,40 @@ class WindowedDatasetIterator:
         """
         Return the length of the iterator
 
-        If it not was iterated once, it will compute the length by iterating
-        from the entire dataset
+        When the default valid_sample is used, the length is the sum of
+        the number of samples of each run-to-failure cycle, computed in closed
+        form by the shuffler. Otherwise, it will compute the length by iterating
+        the entire dataset
         """
         if self.length is None:
-            self.length = sum(1 for _ in self)
-            self.__iter__()
+            if self._default_valid_sample():
+                self.length = int(np.sum(self.samples_per_time_series()))
+            else:
+                self.length = sum(1 for _ in self)
+                self.__iter__()
         return self.length
 
+    def _default_valid_sample(self) -> bool:
+        return (
+            isinstance(self.valid_sample, functools.partial)
+            and self.valid_sample.func is valid_sample
+        )
+
+    def samples_per_time_series(self) -> np.ndarray:
+        """Number of valid samples of each run-to-failure cycle
+
+        The index is computed once and reused by the subsequent calls
+
+        Returns:
+            samples: Array with the number of samples of each run-to-failure cycle
+        """
+        if self._samples_per_time_series is None:
+            minimum_timestamp = 0 if self.padding else self.window_size - 1
+            self._samples_per_time_series = self.shuffler.number_of_valid_samples(
+                minimum_timestamp
+            )
+        return self._samples_per_time_series
+
     def __iter__(self):
         self.i = 0
         self.shuffler.start(self)
@@ -350,17 +438,104 @@ class WindowedDatasetIterator:
         )
         return curr_X, curr_y, [self.sample_weight(y, timestamp, metadata)]
 
+    def _sample_positions(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Obtain the (life, timestamp) pairs in the order given by the shuffler
+
+        Returns:
+            lives, timestamps: Arrays with the run-to-failure cycle and the timestamp
+                               of each sample
+        """
+        lives = []
+        timestamps = []
+        self.shuffler.start(self)
+        while True:
+            try:
+                life, timestamp = self.shuffler.next_element()
+            except StopIteration:
+                break
+            lives.append(life)
+            timestamps.append(timestamp)
+        return np.array(lives, dtype=np.int64), np.array(timestamps, dtype=np.int64)
+
+    def _valid_samples_mask(
+        self, lives: np.ndarray, timestamps: np.ndarray
+    ) -> np.ndarray:
+        """Evaluate the valid_sample callable for each (life, timestamp) pair
+
+        The default valid_sample only depends on the timestamp, so it is
+        evaluated without loading the run-to-failure cycles
+        """
+        if self._default_valid_sample():
+            if self.padding:
+                return np.ones(len(timestamps), dtype=bool)
+            return timestamps >= self.window_size - 1
+
+        mask = np.zeros(len(timestamps), dtype=bool)
+        for life in np.unique(lives):
+            positions = np.where(lives == life)[0]
+            _, y, _ = self.dataset[life]
+            if isinstance(y, pd.DataFrame):
+                y = y.iloc
+            for p in positions:
+                mask[p] = self.valid_sample(timestamps[p], y[timestamps[p]])
+        return mask
+
     def get_data(self, flatten: bool = True, show_progress: bool = False):
-        """Obtain a 
+        """Obtain all the samples of the iterator
+
+        The (life, timestamp) pairs are computed up front from the shuffler
+        and the windows of each life are gathered at once into preallocated
+        arrays.
 
         Parameters:
-        
+
             flatten: Wether to flatten data
             show_progress: Wether to show progress
 
         Returns:
             X, y, sw: Data, target and sample weights
         """
+        if self.iteration_type != IterationType.FORECAST:
+            return self._get_data_iterating(flatten, show_progress)
+
+        lives, timestamps = self._sample_positions()
+        valid = self._valid_samples_mask(lives, timestamps)
+        lives = lives[valid]
+        timestamps = timestamps[valid]
+        N_points = len(timestamps)
+        self.length = N_points
+
+        X = np.zeros((N_points, self.window_size, self.n_features), dtype=np.float32)
+        y = np.zeros((N_points, self.horizon), dtype=np.float32)
+        sample_weight = np.zeros(N_points, dtype=np.float32)
+
+        unique_lives = np.unique(lives)
+        if show_progress:
+            unique_lives = tqdm(unique_lives)
+        for life in unique_lives:
+            positions = np.where(lives == life)[0]
+            life_timestamps = timestamps[positions]
+            data, target, metadata = self.dataset[life]
+            X[positions], y[positions] = windowed_signal_batch(
+                data,
+                target,
+                life_timestamps,
+                self.window_size,
+                self.horizon,
+                self.right_closed,
+            )
+            if isinstance(self.sample_weight, NotWeighted):
+                sample_weight[positions] = 1
+            else:
+                sample_weight[positions] = [
+                    self.sample_weight(target, t, metadata) for t in life_timestamps
+                ]
+
+        if flatten:
+            X = X.reshape(N_points, self.window_size * self.n_features)
+        return X, y, sample_weight
+
+    def _get_data_iterating(self, flatten: bool = True, show_progress: bool = False):
         N_points = len(self)
 
         if flatten:
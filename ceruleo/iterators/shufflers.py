@@ -17,6 +17,16 @@ import numpy as np
 import math
 
 
+def _count_from(first: int, step: int, n: int, minimum: int) -> int:
+    """Number of elements of the progression first + k * step, k in [0, n)
+    that are greater or equal than minimum"""
+    if n <= 0:
+        return 0
+    if first >= minimum:
+        return n
+    return max(n - math.ceil((minimum - first) / step), 0)
+
+
 class AbstractShuffler:
     """A Shuffler is used by the iterator to interleave samples of different run-to-fail cycles"""
 
@@ -112,19 +122,12 @@ class AbstractShuffler:
         total_length = self.wditerator.dataset.number_of_samples_of_time_series(
             time_series_index
         )
-        start_index = self.wditerator.start_index.get(total_length)
-        end_index = self.wditerator.end_index.get(total_length)
-
-        N = end_index - start_index
-        samples_per_step = N / self.wditerator.step
-        self._samples_per_time_series[time_series_index] = math.ceil(samples_per_step)
-        last_part_missing = (
-            math.ceil((N - 1) / self.wditerator.step) - ((N - 1) / self.wditerator.step)
-            > 0
+        _, n, last = self._progression(
+            self.wditerator.start_index.get(total_length),
+            self.wditerator.end_index.get(total_length),
+            self.wditerator.last_point,
         )
-        if self.wditerator.last_point and last_part_missing:
-            self._samples_per_time_series[time_series_index] += 1
-
+        self._samples_per_time_series[time_series_index] = n + (last is not None)
         self._time_series_sizes[time_series_index] = total_length
 
     def number_samples_of_time_series(self, time_series_index: int) -> int:
@@ -147,6 +150,86 @@ class AbstractShuffler:
         """Obtain a timestamp for the current run-to-failure cycle"""
         raise NotImplementedError
 
+    def timestamp_progression(
+        self, time_series_index: int
+    ) -> Tuple[int, int, Optional[int]]:
+        """Describe the timestamps that the shuffler yields for a run-to-failure cycle
+
+        The timestamps are the progression first + k * step, k in [0, n) and,
+        optionally, an additional last timestamp.
+
+        Parameters:
+
+            time_series_index: Index of the run-to-failure cycle
+
+        Returns:
+
+            first, n, last: First element and number of elements of the progression,
+                            and the additional last timestamp or None
+        """
+        start_index, end_index = self._bounds(time_series_index)
+        return self._progression(start_index, end_index, self.wditerator.last_point)
+
+    def timestamps(self, time_series_index: int) -> np.ndarray:
+        """Timestamps that the shuffler yields for a run-to-failure cycle, in order
+
+        Parameters:
+
+            time_series_index: Index of the run-to-failure cycle
+
+        Returns:
+
+            timestamps: Array with the timestamps
+        """
+        first, n, last = self.timestamp_progression(time_series_index)
+        timestamps = first + self.wditerator.step * np.arange(n, dtype=np.int64)
+        if last is not None:
+            timestamps = np.append(timestamps, last)
+        return timestamps
+
+    def _bounds(self, time_series_index: int) -> Tuple[int, int]:
+        total_length = self.time_series_size(time_series_index)
+        return (
+            self.wditerator.start_index.get(total_length),
+            self.wditerator.end_index.get(total_length),
+        )
+
+    def _progression(
+        self, start_index: int, end_index: int, last_point: bool
+    ) -> Tuple[int, int, Optional[int]]:
+        step = self.wditerator.step
+        n = max(math.ceil((end_index - start_index) / step), 0)
+        last = None
+        if last_point and n > 0 and (end_index - 1 - start_index) % step != 0:
+            last = end_index - 1
+        return start_index, n, last
+
+    def number_of_valid_samples(self, minimum_timestamp: int = 0) -> np.ndarray:
+        """Number of samples of each run-to-failure cycle whose timestamp is
+        greater or equal than minimum_timestamp
+
+        The count is computed in closed form from the timestamp progression
+        of each cycle, without iterating the samples. The size of each cycle
+        is obtained once from the dataset, which takes it from its stored
+        metadata when it has it.
+
+        Parameters:
+
+            minimum_timestamp: First valid timestamp
+
+        Returns:
+
+            samples: Array with the number of samples of each run-to-failure cycle
+        """
+        step = self.wditerator.step
+        samples = np.zeros(self.wditerator.dataset.n_time_series, dtype=np.int64)
+        for i in range(len(samples)):
+            first, n, last = self.timestamp_progression(i)
+            samples[i] = _count_from(first, step, n, minimum_timestamp)
+            if last is not None and last >= minimum_timestamp:
+                samples[i] += 1
+        return samples
+
     def time_series_size(self, time_series_index: int):
         if self._time_series_sizes[time_series_index] == np.iinfo(np.int64).max:
             self.load_time_series(time_series_index)
@@ -172,22 +255,16 @@ class IntraTimeSeriesShuffler(AbstractShuffler):
 
     def time_series_changed(self):
         self.current_timestamp_index = 0
-        if self.current_time_series == self.wditerator.dataset.n_time_series:
-            return
-        self.timestamps = np.arange(
-            start=0,
-            stop=self.current_time_series_size(),
-            step=self.wditerator.step,
-            dtype=np.int64,
-        )
-        if (
-            self.wditerator.last_point
-            and self.timestamps[-1] != self.current_time_series_size() - 1
+        n_time_series = self.wditerator.dataset.n_time_series
+        while (
+            self.current_time_series < n_time_series
+            and self.number_of_samples_of_current_time_series() == 0
         ):
-            self.timestamps = np.append(
-                self.timestamps, self.current_time_series_size() - 1
-            )
-        np.random.shuffle(self.timestamps)
+            self.current_time_series += 1
+        if self.current_time_series == n_time_series:
+            return
+        self.current_timestamps = self.timestamps(self.current_time_series)
+        np.random.shuffle(self.current_timestamps)
 
     def initialize(self, iterator: "WindowedDatasetIterator"):
         super().initialize(iterator)
@@ -197,7 +274,7 @@ class IntraTimeSeriesShuffler(AbstractShuffler):
 
     def timestamp(self) -> int:
 
-        ret = self.timestamps[self.current_timestamp_index]
+        ret = self.current_timestamps[self.current_timestamp_index]
         return ret
 
     def advance(self):
@@ -227,36 +304,33 @@ class TimeSeriesOrderShuffling(AbstractShuffler):
             iterator.dataset.n_time_series, dtype=np.int64
         )
         np.random.shuffle(self.available_time_series)
-        self.available_time_series_index = 0
-        self.current_timestamp = 0
-        self.current_time_series = self.available_time_series[
-            self.available_time_series_index
-        ]
+        self.available_time_series_index = -1
+        self.time_series_changed()
 
-    def timestamp(self) -> int:
-        ret = self.current_timestamp
+    def timestamp_progression(self, time_series_index: int):
+        start_index, end_index = self._bounds(time_series_index)
+        return self._progression(start_index, end_index, True)
 
-        return ret
+    def timestamp(self) -> int:
+        return self.current_timestamps[self.current_timestamp_index]
 
     def advance(self):
-
-        if self.current_timestamp == self.current_time_series_size() - 1:
+        self.current_timestamp_index += 1
+        if self.current_timestamp_index == len(self.current_timestamps):
             self.time_series_changed()
-        else:
-            self.current_timestamp += self.wditerator.step
-            self.current_timestamp = min(
-                self.current_timestamp, self.current_time_series_size() - 1
-            )
 
     def time_series_changed(self):
-        self.current_timestamp = 0
+        self.current_timestamp_index = 0
         self.available_time_series_index += 1
-        if self.available_time_series_index < len(self.available_time_series):
+        while self.available_time_series_index < len(self.available_time_series):
             self.current_time_series = self.available_time_series[
                 self.available_time_series_index
             ]
-        else:
-            self.current_time_series = len(self.available_time_series)
+            self.current_timestamps = self.timestamps(self.current_time_series)
+            if len(self.current_timestamps) > 0:
+                return
+            self.available_time_series_index += 1
+        self.current_time_series = len(self.available_time_series)
 
 
 class TimeSeriesOrderIntraSignalShuffling(AbstractShuffler):
@@ -278,18 +352,12 @@ class TimeSeriesOrderIntraSignalShuffling(AbstractShuffler):
             iterator.dataset.n_time_series, dtype=np.int64
         )
         np.random.shuffle(self.available_time_series)
-        self.available_time_series_index = 0
-        self.current_time_series = self.available_time_series[
-            self.available_time_series_index
-        ]
+        self.available_time_series_index = -1
+        self.time_series_changed()
 
-        self.available_time_stamps = np.arange(
-            start=0,
-            stop=self.number_of_samples_of_current_time_series(),
-            step=self.wditerator.step,
-            dtype=np.int64,
-        )
-        self.available_time_stamps_index = 0
+    def timestamp_progression(self, time_series_index: int):
+        start_index, end_index = self._bounds(time_series_index)
+        return self._progression(start_index, end_index, False)
 
     def timestamp(self) -> int:
         ret = self.available_time_stamps[self.available_time_stamps_index]
@@ -304,19 +372,15 @@ class TimeSeriesOrderIntraSignalShuffling(AbstractShuffler):
     def time_series_changed(self):
         self.available_time_stamps_index = 0
         self.available_time_series_index += 1
-        if self.available_time_series_index < len(self.available_time_series):
+        while self.available_time_series_index < len(self.available_time_series):
             self.current_time_series = self.available_time_series[
                 self.available_time_series_index
             ]
-            self.available_time_stamps = np.arange(
-                start=0,
-                stop=self.current_time_series_size(),
-                step=self.wditerator.step,
-                dtype=np.int64,
-            )
-
-        else:
-            self.current_time_series = len(self.available_time_series)
+            self.available_time_stamps = self.timestamps(self.current_time_series)
+            if len(self.available_time_stamps) > 0:
+                return
+            self.available_time_series_index += 1
+        self.current_time_series = len(self.available_time_series)
 
 
 class InverseOrder(AbstractShuffler):
@@ -329,10 +393,21 @@ class InverseOrder(AbstractShuffler):
 
     def initialize(self, iterator: "WindowedDatasetIterator"):
         super().initialize(iterator)
-        self.sizes = np.array(
-            [self.time_series_size(i) for i in range(iterator.dataset.n_time_series)],
-            dtype=np.int64,
-        )
+        # One more than the next timestamp of each cycle, 0 when it is exhausted
+        self.sizes = np.zeros(iterator.dataset.n_time_series, dtype=np.int64)
+        self.starts = np.zeros(iterator.dataset.n_time_series, dtype=np.int64)
+        for i in range(iterator.dataset.n_time_series):
+            first, n, _ = self.timestamp_progression(i)
+            if n > 0:
+                self.starts[i] = first
+                self.sizes[i] = first + (n - 1) * self.wditerator.step + 1
+        if np.sum(self.sizes) == 0:
+            self.current_time_series = len(self.sizes)
+
+    def timestamp_progression(self, time_series_index: int):
+        start_index, end_index = self._bounds(time_series_index)
+        n = max(math.ceil((end_index - start_index) / self.wditerator.step), 0)
+        return end_index - 1 - (n - 1) * self.wditerator.step, n, None
 
     def time_series(self) -> int:
         self.current_time_series = np.argmax(self.sizes)
@@ -344,11 +419,10 @@ class InverseOrder(AbstractShuffler):
         return ret
 
     def advance(self):
-        self.sizes[self.current_time_series] = np.clip(
-            np.int64(self.sizes[self.current_time_series]) - self.wditerator.step,
-            0,
-            np.inf,
-        )
+        size = self.sizes[self.current_time_series] - self.wditerator.step
+        if size <= self.starts[self.current_time_series]:
+            size = 0
+        self.sizes[self.current_time_series] = size
         if np.sum(self.sizes) == 0:
             self.current_time_series = len(self.sizes)
 
@@ -398,20 +472,9 @@ class AllShuffled(AbstractShuffler):
     def load_time_series(self, time_series_index: int):
         super().load_time_series(time_series_index)
         if self.evenly_sampled:
-            total_length = self.time_series_size(time_series_index)
-            final_index = self.wditerator.end_index.get(total_length)
-
-            self.timestamps_per_ts[time_series_index] = np.arange(
-                start=self.wditerator.start_index.get(total_length),
-                stop=final_index,
-                step=self.wditerator.step,
-                dtype=np.int64,
+            self.timestamps_per_ts[time_series_index] = self.timestamps(
+                time_series_index
             )
-            if self.timestamps_per_ts[time_series_index][-1] != final_index - 1:
-                self.timestamps_per_ts[time_series_index] = np.append(
-                    self.timestamps_per_ts[time_series_index], final_index - 1
-                )
-
         else:
             N = self.time_series_size(time_series_index)
             step = self.wditerator.step
@@ -440,6 +503,14 @@ class NotShuffled(AbstractShuffler):
             self.current_time_series_size()
         )
 
+    def timestamp_progression(self, time_series_index: int):
+        total_length = self.time_series_size(time_series_index)
+        return self._progression(
+            self.wditerator.start_index.get(total_length),
+            self.wditerator.end_index.get(total_length),
+            True,
+        )
+
     def time_series_changed(self):
         self.current_time_series += 1
         if not self.at_end():
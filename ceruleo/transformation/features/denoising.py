@@ -2,6 +2,7 @@ from typing import Optional
 
 import numpy as np
 import pandas as pd
+from numba import jit
 from scipy.signal import savgol_filter
 from sklearn.cluster import MiniBatchKMeans
 from ceruleo.transformation import TransformerStep
@@ -187,6 +188,42 @@ class MultiDimensionalKMeans(TransformerStep):
         return X
 
 
+@jit(nopython=True, error_model="numpy")
+def _ewma(X, alpha, state, out):
+    # Same recurrence as the adjusted mean of pandas ewm. The state of each
+    # column is the weighted mean, the weight of the previous observations,
+    # the number of observations and wether the first row was received
+    old_wt_factor = 1.0 - alpha
+    n_columns, n_rows = X.shape
+    for j in range(n_columns):
+        weighted, old_wt, nobs, started = state[j]
+        for i in range(n_rows):
+            cur = X[j, i]
+            is_observation = cur == cur
+            if started == 0:
+                weighted = cur
+                old_wt = 1.0
+                nobs = 1.0 if is_observation else 0.0
+                started = 1.0
+            else:
+                if is_observation:
+                    nobs += 1
+                if weighted == weighted:
+                    old_wt *= old_wt_factor
+                    if is_observation:
+                        if weighted != cur:
+                            weighted = old_wt * weighted + cur
+                            weighted /= old_wt + 1.0
+                        old_wt += 1.0
+                elif is_observation:
+                    weighted = cur
+            out[j, i] = weighted if nobs >= 1 else np.nan
+        state[j, 0] = weighted
+        state[j, 1] = old_wt
+        state[j, 2] = nobs
+        state[j, 3] = started
+
+
 class EWMAFilter(TransformerStep):
     """Filter each feature using EWM
 
@@ -202,9 +239,37 @@ class EWMAFilter(TransformerStep):
         super().__init__(name=name)
         self.span = span
 
+    online = True
+
     def transform(self, X: pd.DataFrame, y=None) -> pd.DataFrame:
         return X.ewm(span=self.span).mean(skip_na=True)
 
+    def update(self, X: pd.DataFrame) -> pd.DataFrame:
+        """Filter the new rows of a life
+
+        The weighted mean of each feature and the weight of the
+        previous rows are kept between calls
+
+        Parameters:
+
+            X: The new rows of the life
+
+        Returns:
+
+            The new rows filtered
+        """
+        if self._online_state is None:
+            self._online_state = np.zeros((X.shape[1], 4))
+        com = (self.span - 1) / 2.0
+        out = np.empty((X.shape[1], X.shape[0]))
+        _ewma(
+            np.ascontiguousarray(X.values.T, dtype=np.float64),
+            1.0 / (1.0 + com),
+            self._online_state,
+            out,
+        )
+        return pd.DataFrame(out.T, index=X.index, columns=X.columns)
+
 
 class GaussianFilter(TransformerStep):
     """Apply a gaussian filter
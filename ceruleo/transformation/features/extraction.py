@@ -1,25 +1,38 @@
+import hashlib
 import itertools
 import logging
-from typing import Dict, List, Optional
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
 
 import emd
 import mmh3
 import numpy as np
 import pandas as pd
 from numpy.lib.arraysetops import isin
-from pandas.core.window.expanding import Expanding
-from pyts.transformation import ROCKET as pyts_ROCKET
 from functools import reduce
 import pywt
+from numba import jit, prange
 
 # try:
 #    from temporis.transformation.features.hurst import hurst_exponent
 # except:
 #    pass
 from ceruleo.transformation import TransformerStep
-from ceruleo.transformation.features.rolling_windows import apply_rolling_data
+from ceruleo.transformation.features.moments import (
+    ExpandingMoments,
+    RollingMoments,
+    WindowStatistics,
+)
+from ceruleo.transformation.features.rolling_windows import (
+    apply_non_overlapping_windows,
+    non_overlapping_windows,
+)
 from ceruleo.transformation.functional.transformers import Transformer
 from ceruleo.transformation.utils import SKLearnTransformerWrapper
+from ceruleo.utils.lrucache import LRUCache
+from ceruleo.utils.workers import process_context
 
 logger = logging.getLogger(__name__)
 
@@ -88,10 +101,8 @@ class OneHotCategorical(TransformerStep):
         super().__init__(name=name)
         self.feature = feature
         self.categories = categories
-        self.fixed_categories = True
-        if self.categories is None:
-            self.categories = set()
-            self.fixed_categories = False
+        self.fixed_categories = categories is not None
+        self.categories_ = set() if categories is None else set(categories)
         self.encoder = None
 
     def partial_fit(self, X: pd.DataFrame, y=None):
@@ -99,7 +110,7 @@ class OneHotCategorical(TransformerStep):
             return self
         if self.feature is None:
             self.feature = X.columns[0]
-        self.categories.update(set(X[self.feature].unique()))
+        self.categories_.update(set(X[self.feature].unique()))
         return self
 
     def fit(self, X: pd.DataFrame, y=None):
@@ -107,11 +118,21 @@ class OneHotCategorical(TransformerStep):
             return self
         if self.feature is None:
             self.feature = X.columns[0]
-        self.categories.update(set(X[self.feature].unique()))
+        self.categories_.update(set(X[self.feature].unique()))
+        return self
+
+    mergeable = True
+
+    def merge(self, other: "OneHotCategorical"):
+        if self.fixed_categories:
+            return self
+        if self.feature is None:
+            self.feature = other.feature
+        self.categories_.update(other.categories_)
         return self
 
     def transform(self, X: pd.DataFrame, y=None) -> pd.DataFrame:
-        categories = sorted(list([c for c in self.categories if c is not None]))
+        categories = sorted(list([c for c in self.categories_ if c is not None]))
         d = pd.Categorical(X[self.feature], categories=categories)
 
         df = pd.get_dummies(d)
@@ -426,6 +447,8 @@ class RollingStatistics(TransformerStep):
 
     """
 
+    online = True
+
     def __init__(
         self,
         *,
@@ -481,68 +504,6 @@ class RollingStatistics(TransformerStep):
     def fit(self, X, y=None):
         return self
 
-    def _std_asinh(self, X, rolling, abs_rolling):
-        return (
-            X.apply(np.arcsinh).rolling(self.window, self.min_points).std(skipna=True)
-        )
-
-    def _std_acosh(self, X, rolling, abs_rolling):
-        return (
-            X.apply(np.arccosh).rolling(self.window, self.min_points).std(skipna=True)
-        )
-
-    def _energy(self, X, rolling, abs_rolling):
-        return X.pow(2).rolling(self.window, self.min_points).sum()
-
-    def _std_atan(self, X, rolling, abs_rolling):
-        return X.apply(np.arctan).rolling(self.window, self.min_points).std(skipna=True)
-
-    def _mean(self, X, rolling, abs_rolling):
-        return rolling.mean(skipna=True)
-
-    def _kurtosis(self, X, rolling, abs_rolling):
-        return rolling.kurt(skipna=True)
-
-    def _skewness(self, X, rolling, abs_rolling):
-        return rolling.skew(skipna=True)
-
-    def _max(self, X, rolling, abs_rolling):
-        return rolling.max(skipna=True)
-
-    def _min(self, X, rolling, abs_rolling):
-        return rolling.min(skipna=True)
-
-    def _std(self, X, rolling, abs_rolling):
-        return rolling.std(skipna=True)
-
-    def _peak(self, X, rolling, abs_rolling):
-        return rolling.max(skipna=True) - rolling.min(skipna=True)
-
-    def _impulse(self, X, rolling, abs_rolling):
-        return self._peak(X, rolling, abs_rolling) / abs_rolling.mean()
-
-    def _deviance(self, X, rolling, abs_rolling):
-        return (X - rolling.mean()) / rolling.std()
-
-    def _clearance(self, X, rolling, abs_rolling):
-        return self._peak(X, rolling, abs_rolling) / X.abs().pow(1.0 / 2).rolling(
-            self.window, self.min_points
-        ).mean().pow(2)
-
-    def _rms(self, X, rolling, abs_rolling):
-        return (
-            X.pow(2)
-            .rolling(self.window, self.min_points)
-            .mean(skipna=True)
-            .pow(1 / 2.0)
-        )
-
-    def _shape(self, X, rolling, abs_rolling):
-        return self._rms(X, rolling, abs_rolling) / abs_rolling.mean(skipna=True)
-
-    def _crest(self, X, rolling, abs_rolling):
-        return self._peak(X, rolling, abs_rolling) / self._rms(X, rolling, abs_rolling)
-
     def _compute_column_names(self, X:pd.DataFrame):
         columns = []
         if self.to_compute is not None:
@@ -553,34 +514,61 @@ class RollingStatistics(TransformerStep):
             for c in self.specific.keys():
                 for stats in self.specific[c]:
                     columns.append(f"{c}_{stats}")
-        return columns 
+        return columns
 
-    def _transform_all_features(self, X:pd.DataFrame, X_new:pd.DataFrame, rolling, abs_rolling):
+    def _statistics(self, X: pd.DataFrame, moments: RollingMoments) -> pd.DataFrame:
+        columns = self._compute_column_names(X)
+        # Filled by columns, the transposed block is the DataFrame storage
+        X_new = np.empty((len(columns), X.shape[0]))
+        if self.to_compute is not None:
+            statistics = WindowStatistics(X.values, moments, self.min_points)
+            n_features = X.shape[1]
+            for i, stats in enumerate(self.to_compute):
+                X_new[i * n_features : (i + 1) * n_features] = statistics.get(stats).T
+        else:
+            features = list(self.specific.keys())
+            statistics = WindowStatistics(
+                X[features].values, moments, self.min_points
+            )
+            i = 0
+            for j, c in enumerate(features):
+                for stats in self.specific[c]:
+                    X_new[i] = statistics.get(stats)[:, j]
+                    i += 1
+        return pd.DataFrame(X_new.T, index=X.index, columns=columns)
 
-        for stats in self.to_compute:
-            columns_to_assign = [f"{c}_{stats}" for c in X.columns]
-            out = getattr(self, f"_{stats}")(X, rolling, abs_rolling)
-            X_new.loc[:, columns_to_assign] = out.values
+    def transform(self, X:pd.DataFrame):
+        """Compute the statistics of the rolling windows of each feature
 
+        All the statistics are derived from accumulators computed in a
+        single pass over each feature
 
-    def _transform_specific(self,  X:pd.DataFrame, X_new:pd.DataFrame, rolling, abs_rolling):
-        for c in self.specific.keys():
-            for stats in self.specific[c]: 
-                feature = f"{c}_{stats}"
-                out = getattr(self, f"_{stats}")(X[c], rolling[c], abs_rolling[c])
-                X_new.loc[:, feature] = out.values
+        Parameters:
 
-    def transform(self, X:pd.DataFrame):
-        columns = self._compute_column_names(X)
-        
-        X_new = pd.DataFrame(index=X.index, columns=columns)
-        rolling = X.rolling(self.window, self.min_points)
-        abs_rolling = X.abs().rolling(self.window, self.min_points)
-        if self.to_compute is not None:
-            self._transform_all_features(X, X_new, rolling, abs_rolling)
-        else:
-            self._transform_specific(X, X_new, rolling, abs_rolling)
-        return X_new
+            X: The input life
+
+        Returns:
+
+            A DataFrame with a column for each feature and statistic
+        """
+        return self._statistics(X, RollingMoments(self.window))
+
+    def update(self, X: pd.DataFrame) -> pd.DataFrame:
+        """Compute the statistics of the windows ending in the new rows of a life
+
+        The accumulators of the last window and its rows are kept between calls
+
+        Parameters:
+
+            X: The new rows of the life
+
+        Returns:
+
+            A DataFrame with a column for each feature and statistic
+        """
+        if self._online_state is None:
+            self._online_state = RollingMoments(self.window)
+        return self._statistics(X, self._online_state)
 
 
 class ExpandingStatistics(TransformerStep):
@@ -618,6 +606,8 @@ class ExpandingStatistics(TransformerStep):
 
     """
 
+    online = True
+
     def __init__(
         self, *, min_points=2, to_compute: List[str] = None, specific: Optional[Dict[str, List[str]]] = None, name: Optional[str] = None
     ):
@@ -669,189 +659,6 @@ class ExpandingStatistics(TransformerStep):
     def fit(self, X, y=None):
         return self
 
-    def _std_asinh(
-        self,
-        x: pd.Series,
-        s: Expanding,
-        s_abs: Expanding,
-        s_abs_sqrt: Expanding,
-        s_sq: Expanding,
-    ):
-        return x.apply(np.arcsinh).expanding(self.min_points).std(skipna=True)
-
-    def _std_acosh(
-        self,
-        x: pd.Series,
-        s: Expanding,
-        s_abs: Expanding,
-        s_abs_sqrt: Expanding,
-        s_sq: Expanding,
-    ):
-        return x.apply(np.arccosh).expanding(self.min_points).std(skipna=True)
-
-    def _energy(
-        self,
-        x: pd.Series,
-        s: Expanding,
-        s_abs: Expanding,
-        s_abs_sqrt: Expanding,
-        s_sq: Expanding,
-    ):
-        return x.pow(2).expanding(self.min_points).sum(skipna=True)
-
-    def _std_atan(
-        self,
-        x: pd.Series,
-        s: Expanding,
-        s_abs: Expanding,
-        s_abs_sqrt: Expanding,
-        s_sq: Expanding,
-    ):
-        return x.apply(np.arctan).expanding(self.min_points).std(skipna=True)
-
-    def _kurtosis(
-        self,
-        x: pd.Series,
-        s: Expanding,
-        s_abs: Expanding,
-        s_abs_sqrt: Expanding,
-        s_sq: Expanding,
-    ):
-        return s.kurt(skipna=True)
-
-    def _skewness(
-        self,
-        x: pd.Series,
-        s: Expanding,
-        s_abs: Expanding,
-        s_abs_sqrt: Expanding,
-        s_sq: Expanding,
-    ):
-        return s.skew(skipna=True)
-
-    def _max(
-        self,
-        x: pd.Series,
-        s: Expanding,
-        s_abs: Expanding,
-        s_abs_sqrt: Expanding,
-        s_sq: Expanding,
-    ):
-        return s.max(skipna=True)
-
-    def _min(
-        self,
-        x: pd.Series,
-        s: Expanding,
-        s_abs: Expanding,
-        s_abs_sqrt: Expanding,
-        s_sq: Expanding,
-    ):
-        return s.min(skipna=True)
-
-    def _std(
-        self,
-        x: pd.Series,
-        s: Expanding,
-        s_abs: Expanding,
-        s_abs_sqrt: Expanding,
-        s_sq: Expanding,
-    ):
-        return s.std(skipna=True)
-
-    def _peak(
-        self,
-        x: pd.Series,
-        s: Expanding,
-        s_abs: Expanding,
-        s_abs_sqrt: Expanding,
-        s_sq: Expanding,
-    ):
-        return s.max(skipna=True) - s.min(skipna=True)
-
-    def _impulse(
-        self,
-        x: pd.Series,
-        s: Expanding,
-        s_abs: Expanding,
-        s_abs_sqrt: Expanding,
-        s_sq: Expanding,
-    ):
-        return self._peak(x, s, s_abs, s_abs_sqrt, s_sq) / s_abs.mean()
-
-    def _deviance(
-        self,
-        x: pd.Series,
-        s: Expanding,
-        s_abs: Expanding,
-        s_abs_sqrt: Expanding,
-        s_sq: Expanding,
-    ):
-        return (x - s.mean(skipna=True)) / (s.std(skipna=True) + 0.00000000001)
-
-    def _clearance(
-        self,
-        x: pd.Series,
-        s: Expanding,
-        s_abs: Expanding,
-        s_abs_sqrt: Expanding,
-        s_sq: Expanding,
-    ):
-        return self._peak(x, s, s_abs, s_abs_sqrt, s_sq) / s_abs_sqrt.mean().pow(2)
-
-    # def _hurst(
-    #    self,
-    #    x: pd.Series,
-    #    s: Expanding,
-    #    s_abs: Expanding,
-    #    s_abs_sqrt: Expanding,
-    #    s_sq: Expanding,
-    # ):
-    #    return s.apply(lambda s: hurst_exponent(s, method="RS"))
-
-    def _rms(
-        self,
-        x: pd.Series,
-        s: Expanding,
-        s_abs: Expanding,
-        s_abs_sqrt: Expanding,
-        s_sq: Expanding,
-    ):
-        return s_sq.mean(skipna=True).pow(1 / 2.0)
-
-    def _mean(
-        self,
-        x: pd.Series,
-        s: Expanding,
-        s_abs: Expanding,
-        s_abs_sqrt: Expanding,
-        s_sq: Expanding,
-    ):
-        return s.mean(skipna=True)
-
-    def _shape(
-        self,
-        x: pd.Series,
-        s: Expanding,
-        s_abs: Expanding,
-        s_abs_sqrt: Expanding,
-        s_sq: Expanding,
-    ):
-        return self._rms(x, s, s_abs, s_abs_sqrt, s_sq) / s_abs.mean(skipna=True)
-
-    def _crest(
-        self,
-        x: pd.Series,
-        s: Expanding,
-        s_abs: Expanding,
-        s_abs_sqrt: Expanding,
-        s_sq: Expanding,
-    ):
-        return self._peak(x, s, s_abs, s_abs_sqrt, s_sq) / self._rms(
-            x, s, s_abs, s_abs_sqrt, s_sq
-        )
-
-
     def _compute_column_names(self, X:pd.DataFrame):
         columns = []
         if self.to_compute is not None:
@@ -862,40 +669,63 @@ class ExpandingStatistics(TransformerStep):
             for c in self.specific.keys():
                 for stats in self.specific[c]:
                     columns.append(f"{c}_{stats}")
-        return columns 
+        return columns
 
-    def _transform_all_features(self, X:pd.DataFrame, X_new:pd.DataFrame, expanding, s_abs, s_abs_sqrt, s_sq):
+    def _statistics(self, X: pd.DataFrame, moments: ExpandingMoments) -> pd.DataFrame:
+        columns = self._compute_column_names(X)
+        # Filled by columns, the transposed block is the DataFrame storage
+        X_new = np.empty((len(columns), X.shape[0]))
+        if self.to_compute is not None:
+            statistics = WindowStatistics(
+                X.values, moments, self.min_points, std_offset=0.00000000001
+            )
+            n_features = X.shape[1]
+            for i, stats in enumerate(self.to_compute):
+                X_new[i * n_features : (i + 1) * n_features] = statistics.get(stats).T
+        else:
+            features = list(self.specific.keys())
+            statistics = WindowStatistics(
+                X[features].values, moments, self.min_points, std_offset=0.00000000001
+            )
+            i = 0
+            for j, c in enumerate(features):
+                for stats in self.specific[c]:
+                    X_new[i] = statistics.get(stats)[:, j]
+                    i += 1
+        return pd.DataFrame(X_new.T, index=X.index, columns=columns)
 
-        for stats in self.to_compute:
-            columns_to_assign = [f"{c}_{stats}" for c in X.columns]
-            out = getattr(self, f"_{stats}")(
-                    X, expanding, s_abs, s_abs_sqrt, s_sq
-                )
-            X_new.loc[:, columns_to_assign] = out.values
+    def transform(self, X:pd.DataFrame):
+        """Compute the statistics of the expanding windows of each feature
 
+        All the statistics are derived from the moments accumulated in a
+        single pass over each feature, as in RollingStatistics
 
-    def _transform_specific(self,  X:pd.DataFrame, X_new:pd.DataFrame, expanding, s_abs, s_abs_sqrt, s_sq):
-        for c in self.specific.keys():
-            for stats in self.specific[c]: 
-                feature = f"{c}_{stats}"
-                out = getattr(self, f"_{stats}")(
-                    X[c], expanding[c], s_abs[c], s_abs_sqrt[c], s_sq[c]
-                )
-                X_new.loc[:, feature] = out.values
+        Parameters:
 
-    def transform(self, X:pd.DataFrame):
-        columns = self._compute_column_names(X)
-        
-        X_new = pd.DataFrame(index=X.index, columns=columns)
-        expanding = X.expanding(self.min_points)
-        s_abs = X.abs().expanding(self.min_points)
-        s_abs_sqrt = X.abs().pow(1.0 / 2).expanding(self.min_points)
-        s_sq = X.pow(2).expanding(self.min_points)
-        if self.to_compute is not None:
-            self._transform_all_features(X, X_new, expanding, s_abs, s_abs_sqrt, s_sq)
-        else:
-            self._transform_specific(X, X_new, expanding, s_abs, s_abs_sqrt, s_sq)
-        return X_new
+            X: The input life
+
+        Returns:
+
+            A DataFrame with a column for each feature and statistic
+        """
+        return self._statistics(X, ExpandingMoments())
+
+    def update(self, X: pd.DataFrame) -> pd.DataFrame:
+        """Compute the statistics of the expanding windows ending in the new rows of a life
+
+        The accumulated moments are kept between calls
+
+        Parameters:
+
+            X: The new rows of the life
+
+        Returns:
+
+            A DataFrame with a column for each feature and statistic
+        """
+        if self._online_state is None:
+            self._online_state = ExpandingMoments()
+        return self._statistics(X, self._online_state)
 
 
 class Difference(TransformerStep):
@@ -935,43 +765,203 @@ class Difference(TransformerStep):
         return new_X
 
 
+def _sift(values: np.ndarray, n: int) -> Tuple[Optional[np.ndarray], float]:
+    """IMFs of a signal and the seconds spent. None when the sift fails"""
+    start = time.perf_counter()
+    try:
+        imf = emd.sift.sift(values, max_imfs=n)
+    except Exception as e:
+        logger.debug(f"EMD sift failed: {e}")
+        imf = None
+    return imf, time.perf_counter() - start
+
+
 class EMD(TransformerStep):
     """Compute the empirical mode decomposition of each feature
 
+    The features are decomposed in parallel, and the modes of each feature
+    are memoized by the content of the feature, so transforming again the
+    same run-to-failure cycle does not sift it again. The features whose
+    sift fails are filled with NaN. The workers are started on the first
+    transformation and kept until close is called. The memoized modes and
+    the workers are not pickled.
+
     Parameters
     ----------
     n : int
         Number of modes to compute
+    n_jobs : int, optional
+        Number of workers used to decompose the features, by default 1
+    backend : str, optional
+        'thread' or 'process', the kind of workers, by default 'thread'.
+        The processes are started with forkserver
+    cache_size : int, optional
+        Maximum number of decomposed features memoized, by default 128.
+        0 disables the memoization
     name : Optional[str], optional
         [description], by default 'EMD'
     """
 
-    def __init__(self, *, n: int, name: Optional[str] = "EMD"):
+    cache_attributes = ("_sift_cache", "_sift_stats", "_executor", "_lock")
+
+    def __init__(
+        self,
+        *,
+        n: int,
+        n_jobs: int = 1,
+        backend: str = "thread",
+        cache_size: int = 128,
+        name: Optional[str] = "EMD",
+    ):
         super().__init__(name=name)
+        if backend not in ("thread", "process"):
+            raise ValueError(f"Invalid backend {backend}. Valids are thread and process")
         self.n = n
+        self.n_jobs = n_jobs
+        self.backend = backend
+        self.cache_size = cache_size
+        self._start()
 
-    def transform(self, X):
-        new_X = pd.DataFrame(index=X.index)
-        for c in X.columns:
-            try:
-                imf = emd.sift.sift(X[c].values, max_imfs=self.n)
-                for j in range(self.n):
-                    if j < imf.shape[1]:
-                        new_X[f"{c}_{j}"] = imf[:, j]
-                    else:
-                        new_X[f"{c}_{j}"] = np.nan
-            except Exception as e:
-                for j in range(self.n):
-                    new_X[f"{c}_{j}"] = np.nan
+    def _start(self):
+        self._sift_cache = LRUCache(max_elem=max(self.cache_size, 1))
+        self._sift_stats = {}
+        self._executor = None
+        self._lock = threading.Lock()
 
-        return new_X
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self._start()
+
+    def __del__(self):
+        # The finalizer may run in any thread, including a worker of the pool
+        try:
+            self.close(wait=False)
+        except Exception:
+            pass
+
+    def close(self, wait: bool = True):
+        """Stop the workers
+
+        They are started again by the next transformation
+
+        Parameters
+        ----------
+        wait : bool, optional
+            Wether to wait until the workers exit, by default True
+        """
+        executor = self.__dict__.get("_executor")
+        if executor is not None:
+            executor.shutdown(wait=wait)
+            self._executor = None
+
+    def _workers(self):
+        with self._lock:
+            if self._executor is None:
+                if self.backend == "process":
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.n_jobs,
+                        mp_context=process_context(),
+                    )
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers=self.n_jobs)
+            return self._executor
+
+    def _key(self, c: str, values: np.ndarray) -> Tuple[str, str, int]:
+        digest = hashlib.sha1(np.ascontiguousarray(values).tobytes()).hexdigest()
+        return (digest, c, self.n)
+
+    def _sift_columns(self, X: pd.DataFrame) -> Dict[str, Optional[np.ndarray]]:
+        results = {}
+        pending = {}
+        keys = {c: self._key(c, X[c].values) for c in X.columns}
+        with self._lock:
+            for c in X.columns:
+                stats = self._sift_stats.setdefault(
+                    c, {"calls": 0, "hits": 0, "failures": 0, "seconds": 0.0}
+                )
+                stats["calls"] += 1
+                imf = None
+                if self.cache_size > 0:
+                    imf = self._sift_cache.get(keys[c])
+                if imf is not None:
+                    stats["hits"] += 1
+                    results[c] = imf
+                else:
+                    pending[c] = X[c].values
+
+        if self.n_jobs > 1 and len(pending) > 1:
+            executor = self._workers()
+            futures = {
+                c: executor.submit(_sift, values, self.n)
+                for c, values in pending.items()
+            }
+            sifted = {c: future.result() for c, future in futures.items()}
+        else:
+            sifted = {c: _sift(values, self.n) for c, values in pending.items()}
+
+        with self._lock:
+            for c, (imf, seconds) in sifted.items():
+                stats = self._sift_stats[c]
+                stats["seconds"] += seconds
+                if imf is None:
+                    stats["failures"] += 1
+                elif self.cache_size > 0:
+                    self._sift_cache.add(keys[c], imf)
+                results[c] = imf
+        return results
+
+    def sift_info(self) -> pd.DataFrame:
+        """Counters of the decomposition of each feature
+
+        Returns:
+
+            info: DataFrame indexed by feature with the number of calls,
+                  memoized results, failures and seconds spent sifting
+        """
+        with self._lock:
+            stats = {c: dict(s) for c, s in self._sift_stats.items()}
+        return pd.DataFrame.from_dict(
+            stats, orient="index", columns=["calls", "hits", "failures", "seconds"]
+        )
+
+    def transform(self, X):
+        imfs = self._sift_columns(X)
+        columns = [f"{c}_{j}" for c in X.columns for j in range(self.n)]
+        new_X = np.full((X.shape[0], len(columns)), np.nan)
+        for i, c in enumerate(X.columns):
+            imf = imfs[c]
+            if imf is None:
+                continue
+            k = min(self.n, imf.shape[1])
+            new_X[:, i * self.n : i * self.n + k] = imf[:, :k]
+        return pd.DataFrame(new_X, index=X.index, columns=columns)
 
 
 class SlidingNonOverlappingEMD(TransformerStep):
+    """Compute the empirical mode decomposition of non-overlapping windows of each feature
+
+    Parameters
+    ----------
+    window_size : int
+        Number of rows of each window
+    max_imfs : int
+        Number of modes to compute
+    keep : Optional[int], optional
+        Number of modes to keep, by default max_imfs
+    n_jobs : int, optional
+        Number of threads used to decompose the windows, by default 1
+    """
+
     def __init__(
-        self, *, window_size: int, max_imfs: int, keep: Optional[int] = None, **kwargs
+        self,
+        *,
+        window_size: int,
+        max_imfs: int,
+        keep: Optional[int] = None,
+        n_jobs: int = 1,
+        **kwargs,
     ):
-        super().__init__(*kwargs)
+        super().__init__(**kwargs)
         self.window_size = window_size
         self.strides = window_size
         self.max_imfs = max_imfs
@@ -979,30 +969,33 @@ class SlidingNonOverlappingEMD(TransformerStep):
             keep = self.max_imfs
         assert keep <= self.max_imfs
         self.keep = keep
+        self.n_jobs = n_jobs
+
+    def _emd(self, values: np.ndarray) -> np.ndarray:
+        out = np.zeros((values.shape[0], self.keep))
+        try:
+            v = emd.sift.sift(values, max_imfs=self.max_imfs)
+            keep = min(self.keep, v.shape[1])
+            out[:, :keep] = v[:, :keep]
+        except emd.support.EMDSiftCovergeError:
+            pass
+        return out
 
     def transform(self, X: pd.DataFrame):
-        def _emd(values: np.ndarray):
-            out = np.zeros((values.shape[0], self.keep))
-            try:
-                v = emd.sift.sift(values, max_imfs=self.max_imfs)
-                out[:, : self.keep] = v[:, : self.keep]
-            except emd.support.EMDSiftCovergeError:
-                pass
-
-            return out
-
         column_list = []
         for c in X.columns:
             for i in range(self.keep):
                 column_list.append(f"imf_{i}_{c}")
-        out = pd.DataFrame(index=X.index, columns=column_list, dtype=np.float32)
-        for c in X.columns:
-            emd_computed = apply_rolling_data(
-                X[c].values, _emd, self.window_size, self.strides
-            )
-
-            out.loc[:, [f"imf_{i}_{c}" for i in range(self.keep)]] = emd_computed
-        return out
+        out = apply_non_overlapping_windows(
+            X.values.astype(np.float64),
+            self._emd,
+            self.window_size,
+            self.keep,
+            n_jobs=self.n_jobs,
+        )
+        return pd.DataFrame(
+            out.reshape(X.shape[0], -1), index=X.index, columns=column_list
+        )
 
 
 class EMDFilter(TransformerStep):
@@ -1061,6 +1054,9 @@ class ROCKET(SKLearnTransformerWrapper):
         random_state=None,
         name: Optional[str] = "ROCKET",
     ):
+        # pyts compiles its kernels when it is imported, which takes a while
+        from pyts.transformation import ROCKET as pyts_ROCKET
+
         transformer = pyts_ROCKET(
             n_kernels=n_kernels, kernel_sizes=kernel_sizes, random_state=random_state
         )
@@ -1115,6 +1111,58 @@ def wrcoef(X, coef_type, coeffs, wavename, level):
         raise ValueError("Invalid coefficient type: {}".format(coef_type))
 
 
+@jit(nopython=True, parallel=True, error_model="numpy")
+def _upcoef(coeffs, first_filter, rec_lo, level, out):
+    # Same reconstruction as pywt.upcoef, for each row of coeffs. The first
+    # level uses first_filter and the rest the low pass filter
+    n_windows, n = out.shape
+    for w in prange(n_windows):
+        current = coeffs[w].copy()
+        for k in range(level):
+            f = first_filter if k == 0 else rec_lo
+            rec = np.zeros(2 * current.shape[0] + f.shape[0] - 2)
+            for i in range(current.shape[0]):
+                for j in range(f.shape[0]):
+                    rec[2 * i + j] += current[i] * f[j]
+            current = rec
+        m = min(n, current.shape[0])
+        out[w, :m] = current[:m]
+        out[w, m:] = 0
+
+
+def wrcoef_batch(
+    coeffs: List[np.ndarray], coef_type: str, wavename: str, level: int, N: int
+) -> np.ndarray:
+    """Reconstruct the signal of a set of coefficients of the wavelet decomposition of several windows
+
+    The batched version of wrcoef, with the windows in the first axis of
+    the coefficients returned by pywt.wavedec
+
+    Parameters:
+
+        coeffs: Coefficients of the windows, as returned by pywt.wavedec with axis=-1
+        coef_type: 'a' for the approximation, 'd' for the details
+        wavename: Name of the wavelet
+        level: Level of the coefficients
+        N: Number of rows of each window
+
+    Returns:
+
+        signals: Array of shape (windows, N)
+    """
+    wavelet = pywt.Wavelet(wavename)
+    rec_lo = np.asarray(wavelet.rec_lo)
+    if coef_type == "a":
+        c, first_filter = coeffs[0], rec_lo
+    elif coef_type == "d":
+        c, first_filter = coeffs[-level], np.asarray(wavelet.rec_hi)
+    else:
+        raise ValueError("Invalid coefficient type: {}".format(coef_type))
+    out = np.empty((c.shape[0], N))
+    _upcoef(np.ascontiguousarray(c, dtype=np.float64), first_filter, rec_lo, level, out)
+    return out
+
+
 class SlidingNonOverlappingWaveletDecomposition(TransformerStep):
     """
 
@@ -1129,6 +1177,9 @@ class SlidingNonOverlappingWaveletDecomposition(TransformerStep):
     r = A4 + D4 + D3 + D2 + D1
     assert(np.mean(r-X) < 0.00000)
 
+    The windows of all the features are decomposed together and reconstructed
+    in parallel
+
     Parameters
     ----------
     TransformerStep : [type]
@@ -1138,33 +1189,41 @@ class SlidingNonOverlappingWaveletDecomposition(TransformerStep):
     def __init__(
         self, *, window_size: int, level: int, wavelet: str, keep: List[str], **kwargs
     ):
-        super().__init__(*kwargs)
+        super().__init__(**kwargs)
         self.wavelet = wavelet
         self.level = level
         self.keep = keep
         self.window_size = window_size
         self.strides = window_size
 
-    def transform(self, X: pd.DataFrame):
-        def _wavelet(values: np.ndarray):
-            coeffs = pywt.wavedec(values, self.wavelet, level=self.level)
-            out = np.zeros((values.shape[0], len(self.keep)))
-            for i, s in enumerate(self.keep):
-                part, level = s
-                out[:, i] = wrcoef(
-                    values, part.lower(), coeffs, self.wavelet, int(level)
-                )
-            return out
+    def _decompose(self, windows: np.ndarray, out: np.ndarray):
+        # windows of shape (windows, rows of the window) and
+        # out of shape (windows, rows of the window, len(keep))
+        if windows.shape[0] == 0 or windows.shape[1] == 0:
+            return
+        coeffs = pywt.wavedec(windows, self.wavelet, level=self.level, axis=-1)
+        for i, (part, level) in enumerate(self.keep):
+            out[:, :, i] = wrcoef_batch(
+                coeffs, part.lower(), self.wavelet, int(level), windows.shape[1]
+            )
 
+    def transform(self, X: pd.DataFrame):
         column_list = []
         for c in X.columns:
             for name in self.keep:
                 column_list.append(f"wavelet_{name}_{c}")
-        out = pd.DataFrame(index=X.index, columns=column_list, dtype=np.float32)
-        for c in X.columns:
-            wv_computed = apply_rolling_data(
-                X[c].values, _wavelet, self.window_size, self.strides
-            )
-
-            out.loc[:, [f"wavelet_{name}_{c}" for name in self.keep]] = wv_computed
-        return out
+        n_rows, n_columns = X.shape
+        values = np.ascontiguousarray(X.values.T, dtype=np.float64)
+        windows, remainder = non_overlapping_windows(values, self.window_size)
+        n_windows = windows.shape[1]
+        n_full_rows = n_windows * self.window_size
+        out = np.empty((n_columns, n_rows, len(self.keep)), dtype=np.float32)
+        full = np.empty((n_columns * n_windows, self.window_size, len(self.keep)))
+        self._decompose(windows.reshape(-1, self.window_size), full)
+        out[:, :n_full_rows] = full.reshape(n_columns, n_full_rows, len(self.keep))
+        self._decompose(remainder, out[:, n_full_rows:])
+        return pd.DataFrame(
+            out.transpose(1, 0, 2).reshape(n_rows, -1),
+            index=X.index,
+            columns=column_list,
+        )
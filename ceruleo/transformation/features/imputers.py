@@ -4,7 +4,7 @@ from typing import Optional, Union
 import numpy as np
 import pandas as pd
 from ceruleo.transformation import TransformerStep
-from ceruleo.transformation.features.tdigest import TDigest
+from ceruleo.transformation.features.tdigest import TDigest, merge_columns, merge_digests
 
 logger = logging.getLogger(__name__)
            
@@ -23,6 +23,8 @@ class PerColumnImputer(TransformerStep):
         Step name, by default None
     """
 
+    online = True
+
     def __init__(self, *, name: Optional[str] = None):
         super().__init__(name=name, prefer_partial_fit=False)
         self.data_min = None
@@ -92,6 +94,8 @@ class PerColumnImputer(TransformerStep):
 class NaNtoInf(TransformerStep):
     """Replace NaN for inf"""
 
+    online = True
+
     def transform(self, X: pd.DataFrame, y=None) -> pd.DataFrame:
         """Transform the input life replacing Nan for inf
 
@@ -117,6 +121,8 @@ class MedianImputer(TransformerStep):
         The name of the step
     """
 
+    online = True
+
     def __init__(self, *, name: Optional[str] = None):
         super().__init__(name=name)
         self.tdigest_dict = None
@@ -142,13 +148,31 @@ class MedianImputer(TransformerStep):
         """
         if self.tdigest_dict is None:
             self.tdigest_dict = {c: TDigest() for c in X.columns}
-        for c in X.columns:
-            self.tdigest_dict[c].batch_update(X[c].values)
+        digests = merge_columns([self.tdigest_dict[c] for c in X.columns], X.values)
+        self.tdigest_dict.update(zip(X.columns, digests))
+        self._compute_median()
 
+    def _compute_median(self):
         self.median = {
             c: self.tdigest_dict[c].percentile(50) for c in self.tdigest_dict.keys()
         }
 
+    mergeable = True
+
+    def merge(self, other: "MedianImputer") -> "MedianImputer":
+        """Merge the digests of each column fitted by other
+
+        Parameters
+        ----------
+        other : MedianImputer
+            The step fitted with the following lives
+        """
+        if other.tdigest_dict is None:
+            return self
+        self.tdigest_dict = merge_digests(self.tdigest_dict, other.tdigest_dict)
+        self._compute_median()
+        return self
+
     def transform(self, X, y=None):
         """Return a new dataframe with the missing values replaced by the fitted median
 
@@ -175,6 +199,8 @@ class MeanImputer(TransformerStep):
         The name of the step
     """
 
+    online = True
+
     def __init__(self, *, name: Optional[str] = None):
         super().__init__(name=name)
         self.sum = None
@@ -196,6 +222,27 @@ class MeanImputer(TransformerStep):
         self.mean = (self.sum / self.counts).to_dict()
         return self
 
+    mergeable = True
+
+    def merge(self, other: "MeanImputer") -> "MeanImputer":
+        """Add the sums and counts fitted by other
+
+        Parameters
+        ----------
+        other : MeanImputer
+            The step fitted with the following lives
+        """
+        if other.sum is None:
+            return self
+        if self.sum is None:
+            self.sum = other.sum.copy()
+            self.counts = other.counts
+        else:
+            self.sum += other.sum
+            self.counts += other.counts
+        self.mean = (self.sum / self.counts).to_dict()
+        return self
+
     def fit(self, X, y=None):
         """Compute the mean value
 
@@ -330,11 +377,32 @@ class RollingMeanImputer(ApplyRollingImputer):
 class ForwardFillImputer(TransformerStep):
     """Impute forward filling the values"""
 
+    online = True
+
     def transform(self, X):
         if not isinstance(X, pd.DataFrame):
             raise ValueError("Input array must be a data frame")
         return X.ffill()
 
+    def update(self, X: pd.DataFrame) -> pd.DataFrame:
+        """Forward fill the new rows of a life, using the last filled row of the previous ones
+
+        Parameters:
+
+            X: The new rows of the life
+
+        Returns:
+
+            The new rows forward filled
+        """
+        if self._online_state is None:
+            X_new = self.transform(X)
+        else:
+            X_new = self.transform(pd.concat([self._online_state, X])).iloc[1:]
+        if X_new.shape[0] > 0:
+            self._online_state = X_new.iloc[-1:]
+        return X_new
+
 
 class BackwardFillImputer(TransformerStep):
     """Impute forward filling the values"""
@@ -346,6 +414,8 @@ class BackwardFillImputer(TransformerStep):
 
 
 class FillImputer(TransformerStep):
+    online = True
+
     def __init__(self, *, value, name: Optional[str] = None):
         super().__init__(name=name)
         self.value = value
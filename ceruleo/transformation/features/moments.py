@@ -0,0 +1,554 @@
+"""Window statistics computed from shared moment accumulators
+
+The statistics of the rolling and expanding windows of a run-to-failure
+cycle are derived from a single pass over each column. The pass keeps the
+number of observations, the mean and the central moments of order 2 to 4,
+the mean of the absolute values and of their square root, the sum of the
+squares and the minimum and maximum of each window. The missing values are
+skipped, as in pandas.
+"""
+import warnings
+from typing import Callable, Dict
+
+import numpy as np
+from numba import jit
+
+# Position of each accumulator in the first axis of the moments array
+N = 0
+MEAN = 1
+M2 = 2
+M3 = 3
+M4 = 4
+ABS_MEAN = 5
+SQRT_ABS_MEAN = 6
+SQ_SUM = 7
+MIN = 8
+MAX = 9
+CONSTANT = 10
+N_ACCUMULATORS = 11
+
+# The values of a window are shifted again by their mean when its central
+# moment M2 is below this fraction of the squares of the shifted values
+# added to and removed from the power sums since the last shift. The error
+# of the compensated sums grows with them, and would take most of the
+# digits of the moments
+RESHIFT_TOLERANCE = 1e-3
+
+
+@jit(nopython=True, error_model="numpy", inline="always")
+def _kahan(total, compensation, value):
+    """Compensated addition of value to total"""
+    t = value - compensation
+    new_total = total + t
+    return new_total, (new_total - total) - t
+
+
+@jit(nopython=True, error_model="numpy", inline="always")
+def _accumulate(sums, compensations, v, c, sign, full):
+    """Add (sign=1) or remove (sign=-1) a value from the running sums"""
+    y = v - c
+    y2 = y * y
+    s1, c1 = _kahan(sums[0], compensations[0], sign * y)
+    s2, c2 = _kahan(sums[1], compensations[1], sign * y2)
+    if not full:
+        return (
+            (s1, s2) + sums[2:],
+            (c1, c2) + compensations[2:],
+        )
+    s3, c3 = _kahan(sums[2], compensations[2], sign * y2 * y)
+    s4, c4 = _kahan(sums[3], compensations[3], sign * y2 * y2)
+    s5, c5 = _kahan(sums[4], compensations[4], sign * abs(v))
+    s6, c6 = _kahan(sums[5], compensations[5], sign * np.sqrt(abs(v)))
+    s7, c7 = _kahan(sums[6], compensations[6], sign * v * v)
+    return (s1, s2, s3, s4, s5, s6, s7), (c1, c2, c3, c4, c5, c6, c7)
+
+
+@jit(nopython=True, error_model="numpy")
+def _reshift(x, first, last, n, full):
+    """Power sums of the window x[first:last + 1] shifted by its mean"""
+    total = 0.0
+    for t in range(first, last + 1):
+        if not np.isnan(x[t]):
+            total += x[t]
+    c = total / n
+    sums = (0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+    compensations = (0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+    for t in range(first, last + 1):
+        if not np.isnan(x[t]):
+            sums, compensations = _accumulate(
+                sums, compensations, x[t], c, 1.0, full
+            )
+    return sums, compensations, c
+
+
+@jit(nopython=True, error_model="numpy")
+def _rolling_moments(X, window, start, offset, full, state, out):
+    # The first start rows of X are the tail of the rows already accumulated
+    # in state, and only rebuild the queues of the minimum and maximum. offset
+    # is the number of rows received before the first row of X.
+    n_columns, n_rows = X.shape
+    max_queue = np.empty(n_rows, dtype=np.int64)
+    min_queue = np.empty(n_rows, dtype=np.int64)
+    for j in range(n_columns):
+        x = X[j]
+        s = state[j]
+        sums = (s[0], s[1], s[2], s[3], s[4], s[5], s[6])
+        compensations = (s[7], s[8], s[9], s[10], s[11], s[12], s[13])
+        n = int(s[14])
+        run = int(s[15])
+        previous = s[16]
+        c = s[17]
+        magnitude = s[18]
+        max_head, max_tail = 0, 0
+        min_head, min_tail = 0, 0
+        for i in range(n_rows):
+            v = x[i]
+            if i >= start and not np.isnan(v):
+                if np.isnan(c):
+                    c = v
+                sums, compensations = _accumulate(sums, compensations, v, c, 1.0, full)
+                magnitude += (v - c) * (v - c)
+                n += 1
+                if v == previous:
+                    run += 1
+                else:
+                    run = 1
+                previous = v
+            if full and not np.isnan(v):
+                while max_tail > max_head and x[max_queue[max_tail - 1]] <= v:
+                    max_tail -= 1
+                max_queue[max_tail] = i
+                max_tail += 1
+                while min_tail > min_head and x[min_queue[min_tail - 1]] >= v:
+                    min_tail -= 1
+                min_queue[min_tail] = i
+                min_tail += 1
+            if i < start:
+                continue
+            if i + offset >= window:
+                w = x[i - window]
+                if not np.isnan(w):
+                    sums, compensations = _accumulate(
+                        sums, compensations, w, c, -1.0, full
+                    )
+                    magnitude += (w - c) * (w - c)
+                    n -= 1
+                if max_tail > max_head and max_queue[max_head] <= i - window:
+                    max_head += 1
+                if min_tail > min_head and min_queue[min_head] <= i - window:
+                    min_head += 1
+
+            k = i - start
+            out[N, j, k] = n
+            if n == 0:
+                out[1:, j, k] = np.nan
+                continue
+            s1, s2 = sums[0], sums[1]
+            if run < n and s2 - s1 / n * s1 < RESHIFT_TOLERANCE * magnitude:
+                sums, compensations, c = _reshift(x, max(i - window + 1, 0), i, n, full)
+                magnitude = sums[1]
+            s1, s2, s3, s4, s_abs, s_sqrt_abs, s_sq = sums
+            a = s1 / n
+            # As pandas, the mean of a constant window is its value
+            out[MEAN, j, k] = previous if run >= n else a + c
+            out[M2, j, k] = s2 - a * s1
+            out[CONSTANT, j, k] = 1 if run >= n else 0
+            if not full:
+                continue
+            out[M3, j, k] = s3 - 3 * a * s2 + 3 * a * a * s1 - n * a * a * a
+            out[M4, j, k] = (
+                s4
+                - 4 * a * s3
+                + 6 * a * a * s2
+                - 4 * a * a * a * s1
+                + n * a * a * a * a
+            )
+            out[ABS_MEAN, j, k] = s_abs / n
+            out[SQRT_ABS_MEAN, j, k] = s_sqrt_abs / n
+            out[SQ_SUM, j, k] = s_sq
+            out[MAX, j, k] = x[max_queue[max_head]]
+            out[MIN, j, k] = x[min_queue[min_head]]
+        s[0:7] = sums
+        s[7:14] = compensations
+        s[14] = n
+        s[15] = run
+        s[16] = previous
+        s[17] = c
+        s[18] = magnitude
+
+
+def _column_shift(X: np.ndarray) -> np.ndarray:
+    """Mean of each column
+
+    NaN when it is not finite, so the kernel shifts the column by its
+    first observation
+    """
+    with np.errstate(all="ignore"), warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        shift = np.nanmean(X, axis=0)
+    shift[~np.isfinite(shift)] = np.nan
+    return shift
+
+
+def _rolling_state(X: np.ndarray) -> np.ndarray:
+    state = np.zeros((X.shape[1], 19))
+    state[:, 16] = np.nan
+    state[:, 17] = _column_shift(X)
+    return state
+
+
+class RollingMoments:
+    """Accumulators of the rolling windows of a run-to-failure cycle received in chunks
+
+    Each call receives the rows that follow the ones received in the
+    previous call, and returns the accumulators of their windows. The power
+    sums are computed over the values shifted by the mean of each column
+    in the first rows received, and with compensated summation, to keep
+    the precision of the higher order moments. When the values of a window
+    are close to each other compared to their distance to the shift, the
+    shift is moved to the mean of the window. The result only depends on
+    how the cycle is split through rounding.
+
+    Parameters:
+
+        window: Number of rows of each window
+    """
+
+    def __init__(self, window: int):
+        self.window = window
+        self._states = {}
+
+    def __call__(self, X: np.ndarray, transformation: str = "identity") -> np.ndarray:
+        """Accumulators of the windows that end in each row of X
+
+        Parameters:
+
+            X: Next rows of the run-to-failure cycle, of shape (rows, columns)
+            transformation: Transformation applied to the values. A state is
+                            kept for each one. All the accumulators are only
+                            computed for the identity, for the rest only the
+                            number of observations, the mean and M2 are
+
+        Returns:
+
+            moments: Array of shape (N_ACCUMULATORS, rows, columns)
+        """
+        X = np.asarray(X, dtype=np.float64)
+        if transformation not in self._states:
+            self._states[transformation] = (
+                _rolling_state(X),
+                np.empty((X.shape[1], 0)),
+                0,
+            )
+        state, tail, n_rows = self._states[transformation]
+        values = np.ascontiguousarray(np.concatenate([tail, X.T], axis=1))
+        out = np.empty((N_ACCUMULATORS, X.shape[1], X.shape[0]))
+        _rolling_moments(
+            values,
+            self.window,
+            tail.shape[1],
+            n_rows - tail.shape[1],
+            transformation == "identity",
+            state,
+            out,
+        )
+        tail = values[:, max(values.shape[1] - self.window, 0) :].copy()
+        self._states[transformation] = (state, tail, n_rows + X.shape[0])
+        return out.transpose(0, 2, 1)
+
+
+def rolling_moments(X: np.ndarray, window: int, full: bool = True) -> np.ndarray:
+    """Accumulators of each rolling window of a run-to-failure cycle
+
+    Parameters:
+
+        X: Values of the run-to-failure cycle, of shape (rows, columns)
+        window: Number of rows of each window
+        full: Wether to compute all the accumulators. Otherwise only the
+              number of observations, the mean and M2 are computed
+
+    Returns:
+
+        moments: Array of shape (N_ACCUMULATORS, rows, columns)
+    """
+    return RollingMoments(window)(X, "identity" if full else "reduced")
+
+
+@jit(nopython=True, error_model="numpy")
+def _expanding_moments(X, full, state, out):
+    n_columns, n_rows = X.shape
+    for j in range(n_columns):
+        x = X[j]
+        s = state[j]
+        n = int(s[0])
+        run = int(s[1])
+        previous = s[2]
+        mean, m2, m3, m4 = s[3], s[4], s[5], s[6]
+        abs_mean, sqrt_abs_mean = s[7], s[8]
+        sq_sum, sq_compensation = s[9], s[10]
+        minimum, maximum = s[11], s[12]
+        for i in range(n_rows):
+            v = x[i]
+            if not np.isnan(v):
+                if v == previous:
+                    run += 1
+                else:
+                    run = 1
+                previous = v
+                # Welford and Terriberry updates of the central moments
+                n1 = n
+                n += 1
+                delta = v - mean
+                delta_n = delta / n
+                delta_n2 = delta_n * delta_n
+                term1 = delta * delta_n * n1
+                mean += delta_n
+                if full:
+                    m4 += (
+                        term1 * delta_n2 * (n * n - 3 * n + 3)
+                        + 6 * delta_n2 * m2
+                        - 4 * delta_n * m3
+                    )
+                    m3 += term1 * delta_n * (n - 2) - 3 * delta_n * m2
+                    abs_mean += (abs(v) - abs_mean) / n
+                    sqrt_abs_mean += (np.sqrt(abs(v)) - sqrt_abs_mean) / n
+                    sq_sum, sq_compensation = _kahan(sq_sum, sq_compensation, v * v)
+                    minimum = min(minimum, v)
+                    maximum = max(maximum, v)
+                m2 += term1
+
+            out[N, j, i] = n
+            if n == 0:
+                out[1:, j, i] = np.nan
+                continue
+            out[MEAN, j, i] = mean
+            out[M2, j, i] = m2
+            out[CONSTANT, j, i] = 1 if run >= n else 0
+            if not full:
+                continue
+            out[M3, j, i] = m3
+            out[M4, j, i] = m4
+            out[ABS_MEAN, j, i] = abs_mean
+            out[SQRT_ABS_MEAN, j, i] = sqrt_abs_mean
+            out[SQ_SUM, j, i] = sq_sum
+            out[MIN, j, i] = minimum
+            out[MAX, j, i] = maximum
+        s[0] = n
+        s[1] = run
+        s[2] = previous
+        s[3], s[4], s[5], s[6] = mean, m2, m3, m4
+        s[7], s[8] = abs_mean, sqrt_abs_mean
+        s[9], s[10] = sq_sum, sq_compensation
+        s[11], s[12] = minimum, maximum
+
+
+def _expanding_state(n_columns: int) -> np.ndarray:
+    state = np.zeros((n_columns, 13))
+    state[:, 2] = np.nan
+    state[:, 11] = np.inf
+    state[:, 12] = -np.inf
+    return state
+
+
+class ExpandingMoments:
+    """Accumulators of the expanding windows of a run-to-failure cycle received in chunks
+
+    Each call receives the rows that follow the ones received in the
+    previous call, and returns the accumulators of their windows. The
+    central moments are updated online with the Welford and Terriberry
+    recurrences, which are numerically stable. The result does not
+    depend on how the cycle is split.
+    """
+
+    def __init__(self):
+        self._states = {}
+
+    def __call__(self, X: np.ndarray, transformation: str = "identity") -> np.ndarray:
+        """Accumulators of the windows that end in each row of X
+
+        Parameters:
+
+            X: Next rows of the run-to-failure cycle, of shape (rows, columns)
+            transformation: Transformation applied to the values. A state is
+                            kept for each one. All the accumulators are only
+                            computed for the identity, for the rest only the
+                            number of observations, the mean and M2 are
+
+        Returns:
+
+            moments: Array of shape (N_ACCUMULATORS, rows, columns)
+        """
+        X = np.asarray(X, dtype=np.float64)
+        if transformation not in self._states:
+            self._states[transformation] = _expanding_state(X.shape[1])
+        out = np.empty((N_ACCUMULATORS, X.shape[1], X.shape[0]))
+        _expanding_moments(
+            np.ascontiguousarray(X.T),
+            transformation == "identity",
+            self._states[transformation],
+            out,
+        )
+        return out.transpose(0, 2, 1)
+
+
+def expanding_moments(X: np.ndarray, full: bool = True) -> np.ndarray:
+    """Accumulators of each expanding window of a run-to-failure cycle
+
+    Parameters:
+
+        X: Values of the run-to-failure cycle, of shape (rows, columns)
+        full: Wether to compute all the accumulators. Otherwise only the
+              number of observations, the mean and M2 are computed
+
+    Returns:
+
+        moments: Array of shape (N_ACCUMULATORS, rows, columns)
+    """
+    return ExpandingMoments()(X, "identity" if full else "reduced")
+
+
+class WindowStatistics:
+    """Statistics of the windows of a run-to-failure cycle
+
+    The statistics are derived from the moment accumulators, and are
+    computed once even when several statistics depend on them. They match
+    the definitions of the pandas window functions.
+
+    Parameters:
+
+        X: Values of the run-to-failure cycle, of shape (rows, columns)
+        moments: Function that computes the accumulators of the windows
+                 of an array. It receives the array and the name of the
+                 transformation applied to its values
+        min_points: Minimum number of observations of a window
+        std_offset: Value added to the std in the deviance
+    """
+
+    def __init__(
+        self,
+        X: np.ndarray,
+        moments: Callable[[np.ndarray, str], np.ndarray],
+        min_points: int,
+        std_offset: float = 0.0,
+    ):
+        self.X = np.asarray(X, dtype=np.float64)
+        self.moments = moments
+        self.min_points = min_points
+        self.std_offset = std_offset
+        self._accumulators = {}
+        self._computed: Dict[str, np.ndarray] = {}
+
+    def accumulators(self, transformation: str = "identity") -> np.ndarray:
+        if transformation not in self._accumulators:
+            if transformation == "identity":
+                X = self.X
+            else:
+                with np.errstate(invalid="ignore"):
+                    X = getattr(np, transformation)(self.X)
+            self._accumulators[transformation] = self.moments(X, transformation)
+        return self._accumulators[transformation]
+
+    def get(self, statistic: str) -> np.ndarray:
+        """Obtain a statistic for each window and column
+
+        Parameters:
+
+            statistic: Name of the statistic
+
+        Returns:
+
+            values: Array of shape (rows, columns)
+        """
+        if statistic not in self._computed:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                self._computed[statistic] = getattr(self, f"_{statistic}")()
+        return self._computed[statistic]
+
+    def _valid(self, acc: np.ndarray, min_points: int) -> np.ndarray:
+        return acc[N] >= max(self.min_points, min_points, 1)
+
+    def _masked(self, values: np.ndarray, acc: np.ndarray, min_points: int = 1):
+        return np.where(self._valid(acc, min_points), values, np.nan)
+
+    def _variance(self, transformation: str = "identity") -> np.ndarray:
+        acc = self.accumulators(transformation)
+        n = acc[N]
+        var = np.maximum(acc[M2] / (n - 1), 0)
+        var = np.where(acc[CONSTANT] > 0, 0, var)
+        return self._masked(var, acc, 2)
+
+    def _mean(self):
+        acc = self.accumulators()
+        return self._masked(acc[MEAN], acc)
+
+    def _max(self):
+        acc = self.accumulators()
+        return self._masked(acc[MAX], acc)
+
+    def _min(self):
+        acc = self.accumulators()
+        return self._masked(acc[MIN], acc)
+
+    def _std(self):
+        return np.sqrt(self._variance())
+
+    def _std_atan(self):
+        return np.sqrt(self._variance("arctan"))
+
+    def _std_asinh(self):
+        return np.sqrt(self._variance("arcsinh"))
+
+    def _std_acosh(self):
+        return np.sqrt(self._variance("arccosh"))
+
+    def _skewness(self):
+        acc = self.accumulators()
+        n = acc[N]
+        B = acc[M2] / n
+        C = acc[M3] / n
+        skew = np.sqrt(n * (n - 1)) * C / ((n - 2) * B * np.sqrt(B))
+        skew = np.where(B <= 1e-14, np.nan, skew)
+        skew = np.where(acc[CONSTANT] > 0, 0, skew)
+        return self._masked(skew, acc, 3)
+
+    def _kurtosis(self):
+        acc = self.accumulators()
+        n = acc[N]
+        B = acc[M2] / n
+        D = acc[M4] / n
+        K = (n * n - 1) * D / (B * B) - 3 * (n - 1) ** 2
+        kurt = K / ((n - 2) * (n - 3))
+        kurt = np.where(B <= 1e-14, np.nan, kurt)
+        kurt = np.where(acc[CONSTANT] > 0, -3, kurt)
+        return self._masked(kurt, acc, 4)
+
+    def _peak(self):
+        return self.get("max") - self.get("min")
+
+    def _abs_mean(self):
+        acc = self.accumulators()
+        return self._masked(acc[ABS_MEAN], acc)
+
+    def _energy(self):
+        acc = self.accumulators()
+        return self._masked(acc[SQ_SUM], acc)
+
+    def _rms(self):
+        acc = self.accumulators()
+        return self._masked(np.sqrt(acc[SQ_SUM] / acc[N]), acc)
+
+    def _impulse(self):
+        return self.get("peak") / self.get("abs_mean")
+
+    def _clearance(self):
+        acc = self.accumulators()
+        return self.get("peak") / self._masked(acc[SQRT_ABS_MEAN], acc) ** 2
+
+    def _shape(self):
+        return self.get("rms") / self.get("abs_mean")
+
+    def _crest(self):
+        return self.get("peak") / self.get("rms")
+
+    def _deviance(self):
+        return (self.X - self.get("mean")) / (self.get("std") + self.std_offset)
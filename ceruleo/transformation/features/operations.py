@@ -6,10 +6,14 @@ from functools import reduce
 
 
 class Sum(TransformerStep):
+    online = True
+
     def transform(self, X: List[pd.DataFrame]):
         return reduce(lambda x, y: x.add(y, fill_value=0), X)
 
 
 class Divide(TransformerStep):
+    online = True
+
     def transform(self, X: List[pd.DataFrame]):
         return reduce(lambda x, y: x.divide(y, fill_value=0), X)
\ No newline at end of file
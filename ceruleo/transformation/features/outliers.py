@@ -6,7 +6,7 @@ from ceruleo.transformation import TransformerStep
 from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.preprocessing import StandardScaler
 from sklearn.utils.validation import check_is_fitted
-from ceruleo.transformation.features.tdigest import TDigest
+from ceruleo.transformation.features.tdigest import TDigest, merge_columns, merge_digests
 from ceruleo.transformation.utils import QuantileEstimator
 from sklearn.ensemble import IsolationForest
 
@@ -58,9 +58,12 @@ class IQROutlierRemover(TransformerStep):
             X = X.iloc[sampled_points, :]
         if self.tdigest_dict is None:
             self.tdigest_dict = {c: TDigest(100) for c in X.columns}
-        for c in X.columns:
-            self.tdigest_dict[c] = self.tdigest_dict[c].merge_unsorted(X[c].values)
+        digests = merge_columns([self.tdigest_dict[c] for c in X.columns], X.values)
+        self.tdigest_dict.update(zip(X.columns, digests))
+        self._compute_quantiles()
+        return self
 
+    def _compute_quantiles(self):
         self.Q1 = {
             c: self.tdigest_dict[c].estimate_quantile(self.lower_quantile)
             for c in self.tdigest_dict.keys()
@@ -72,6 +75,14 @@ class IQROutlierRemover(TransformerStep):
         }
 
         self.IQR = {c: self.Q3[c] - self.Q1[c] for c in self.Q1.keys()}
+
+    mergeable = True
+
+    def merge(self, other: "IQROutlierRemover") -> "IQROutlierRemover":
+        if other.tdigest_dict is None:
+            return self
+        self.tdigest_dict = merge_digests(self.tdigest_dict, other.tdigest_dict)
+        self._compute_quantiles()
         return self
 
     def fit(self, X):
@@ -161,6 +172,19 @@ class BeyondQuartileOutlierRemover(TransformerStep):
         self.quantile_estimator.update(X.select_dtypes(include="number"))
         return self
 
+    mergeable = True
+
+    def merge(
+        self, other: "BeyondQuartileOutlierRemover"
+    ) -> "BeyondQuartileOutlierRemover":
+        if other.quantile_estimator is None:
+            return self
+        if self.quantile_estimator is None:
+            self.quantile_estimator = other.quantile_estimator
+        else:
+            self.quantile_estimator.merge(other.quantile_estimator)
+        return self
+
     def fit(self, X):
         if self.subsample < 1:
 
@@ -1,4 +1,7 @@
-import numpy as np 
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Tuple
+
+import numpy as np
 
 
 def _strided_app(a, L, S):  # Window len = L, Stride len/stepsize = S
@@ -12,7 +15,7 @@ def _strided_app(a, L, S):  # Window len = L, Stride len/stepsize = S
         strides=(S*n, n),
         writeable=False)
     last = r.shape[0]*r.shape[1]
-    l = r.tolist()
+    l = list(r)
     if last < len(a):
         l.append(a[last:])
     return l
@@ -44,4 +47,83 @@ def apply_rolling_data(values : np.ndarray, function, window, step=1):
     x = _strided_app(values, window, step)
 
     return np.vstack([function(np.array(b)) for b in x])
-    
+
+
+def non_overlapping_windows(
+    values: np.ndarray, window: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Split each column of a run-to-failure cycle in consecutive windows
+
+    The windows are a view of the values, no data is copied
+
+    Parameters:
+
+        values: Values of the cycle, of shape (columns, rows), contiguous by rows
+        window: Number of rows of each window
+
+    Returns:
+
+        windows: Array of shape (columns, number of windows, window)
+        remainder: The last rows that do not complete a window,
+                   of shape (columns, remaining rows)
+    """
+    n_columns, n_rows = values.shape
+    n_windows = n_rows // window
+    column_stride, row_stride = values.strides
+    windows = np.lib.stride_tricks.as_strided(
+        values,
+        shape=(n_columns, n_windows, window),
+        strides=(column_stride, window * row_stride, row_stride),
+        writeable=False,
+    )
+    return windows, values[:, n_windows * window :]
+
+
+def window_bounds(n_rows: int, window: int) -> List[Tuple[int, int]]:
+    """First and last row of each non-overlapping window, including the last incomplete one"""
+    return [(start, min(start + window, n_rows)) for start in range(0, n_rows, window)]
+
+
+def apply_non_overlapping_windows(
+    values: np.ndarray,
+    function: Callable[[np.ndarray], np.ndarray],
+    window: int,
+    n_outputs: int,
+    n_jobs: int = 1,
+) -> np.ndarray:
+    """Apply a function to the non-overlapping windows of each column
+
+    The windows of all the columns are processed in a thread pool, and
+    the results are written to a single float32 array
+
+    Parameters:
+
+        values: Values of the run-to-failure cycle, of shape (rows, columns)
+        function: Function that receives the values of a window and returns
+                  an array of shape (rows of the window, n_outputs)
+        window: Number of rows of each window
+        n_outputs: Number of values returned by the function for each row
+        n_jobs: Number of threads
+
+    Returns:
+
+        out: Array of shape (rows, columns, n_outputs)
+    """
+    columns = np.ascontiguousarray(np.asarray(values).T)
+    n_columns, n_rows = columns.shape
+    out = np.empty((n_rows, n_columns, n_outputs), dtype=np.float32)
+
+    def apply(task):
+        j, (start, end) = task
+        out[start:end, j, :] = function(columns[j, start:end])
+
+    tasks = [
+        (j, bounds) for j in range(n_columns) for bounds in window_bounds(n_rows, window)
+    ]
+    if n_jobs > 1:
+        with ThreadPoolExecutor(n_jobs) as executor:
+            list(executor.map(apply, tasks))
+    else:
+        for task in tasks:
+            apply(task)
+    return out
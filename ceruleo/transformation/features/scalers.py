@@ -1,8 +1,10 @@
-from typing import Optional, Union
+from typing import Optional, Tuple, Union
 
 import numpy as np
 import pandas as pd
 from ceruleo.transformation import TransformerStep
+from ceruleo.transformation.functional.array import aligned_values
+from ceruleo.transformation.functional.fusion import Operation
 from ceruleo.transformation.features.tdigest import TDigest
 from ceruleo.transformation.utils import QuantileComputer, QuantileEstimator
 
@@ -63,6 +65,7 @@ class RobustMinMaxScaler(TransformerStep):
         self.IQR = self.Q3 - self.Q1
 
         self.valid_mask = self.IQR.abs() > 0.000000000001
+        self.quantile_estimator.close()
 
 
     def partial_fit(self, df: pd.DataFrame, y=None):
@@ -74,6 +77,37 @@ class RobustMinMaxScaler(TransformerStep):
         self._compute_quantiles()
         return self
 
+    mergeable = True
+
+    def merge(self, other: "RobustMinMaxScaler") -> "RobustMinMaxScaler":
+        self.quantile_estimator.merge(other.quantile_estimator)
+        return self
+
+    def scaling_parameters(
+        self, columns: pd.Index
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Offset, divisor and valid mask of each column
+
+        The transformation of the valid columns is
+        (X - offset) / divisor * (range[1] - range[0]) + range[0],
+        and the rest of the columns are set to 0
+
+        Parameters:
+
+            columns: Names of the columns
+
+        Returns:
+
+            offset, divisor, valid: One value for each column
+        """
+        if self.Q1 is None:
+            self._compute_quantiles()
+        return (
+            self.Q1.reindex(columns).values,
+            self.IQR.reindex(columns).values,
+            self.valid_mask.reindex(columns, fill_value=False).values,
+        )
+
     def transform(self, X: pd.DataFrame):
         if self.Q1 is None:
             self._compute_quantiles()
@@ -125,8 +159,12 @@ class MinMaxScaler(TransformerStep):
         self.clip = clip
 
     def partial_fit(self, df, y=None):
-        partial_data_min = df.min(skipna=True)
-        partial_data_max = df.max(skipna=True)
+        self._update_range(df.min(skipna=True), df.max(skipna=True))
+        return self
+
+    def _update_range(self, partial_data_min: pd.Series, partial_data_max: pd.Series):
+        if partial_data_min is None:
+            return
         if self.data_min is None:
             self.data_min = partial_data_min
             self.data_max = partial_data_max
@@ -137,6 +175,11 @@ class MinMaxScaler(TransformerStep):
             self.data_max = pd.concat([self.data_max, partial_data_max], axis=1).max(
                 axis=1, skipna=True
             )
+
+    mergeable = True
+
+    def merge(self, other: "MinMaxScaler") -> "MinMaxScaler":
+        self._update_range(other.data_min, other.data_max)
         return self
 
     def fit(self, df, y=None):
@@ -145,6 +188,27 @@ class MinMaxScaler(TransformerStep):
 
         return self
 
+    def scaling_parameters(
+        self, columns: pd.Index
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Offset, divisor and valid mask of each column
+
+        The transformation of the valid columns is
+        (X - offset) / divisor * (max - min) + min,
+        and the rest of the columns are set to 0
+
+        Parameters:
+
+            columns: Names of the columns
+
+        Returns:
+
+            offset, divisor, valid: One value for each column
+        """
+        data_min = aligned_values(self, "data_min", columns)
+        divisor = aligned_values(self, "data_max", columns) - data_min
+        return data_min, divisor, np.abs(divisor) > 1e-25
+
     def transform(self, X):
         try:
             divisor = self.data_max - self.data_min
@@ -163,6 +227,37 @@ class MinMaxScaler(TransformerStep):
             X.clip(lower=self.min, upper=self.max, inplace=True)
         return X
 
+    array_kernel = True
+
+    def transform_array(self, X: np.ndarray, columns: pd.Index):
+        data_min = aligned_values(self, "data_min", columns)
+        data_max = aligned_values(self, "data_max", columns)
+        divisor = data_max - data_min
+        mask = np.abs(divisor) > 1e-25
+        with np.errstate(divide="ignore", invalid="ignore"):
+            new_X = (X - data_min) / divisor * (self.max - self.min) + self.min
+        new_X[:, ~mask] = 0
+        if self.clip:
+            np.clip(new_X, self.min, self.max, out=new_X)
+        return new_X, columns
+
+    elementwise = True
+
+    def elementwise_operations(self, columns: pd.Index):
+        data_min = aligned_values(self, "data_min", columns)
+        divisor = aligned_values(self, "data_max", columns) - data_min
+        constant = ~(np.abs(divisor) > 1e-25)
+        operations = [
+            (Operation.ADD, -data_min, 0),
+            (Operation.DIV, divisor, 0),
+            (Operation.MUL, self.max - self.min, 0),
+            (Operation.ADD, self.min, 0),
+            (Operation.FILL, constant, 0),
+        ]
+        if self.clip:
+            operations.append((Operation.CLIP, self.min, self.max))
+        return operations
+
     def description(self):
         data = super().description()
         return (data, {"Min": self.data_min, "Max": self.data_max})
@@ -171,6 +266,10 @@ class MinMaxScaler(TransformerStep):
 class StandardScaler(TransformerStep):
     """Standardize features by removing the mean and scaling to unit variance.
 
+    When fitted cycle by cycle, the moments of the cycles are pooled, so the
+    mean and the standard deviation are the ones of the concatenated cycles,
+    regardless of the length of each cycle.
+
     Parameters
     ----------
     name : Optional[str], optional
@@ -182,18 +281,53 @@ class StandardScaler(TransformerStep):
         super().__init__(name=name)
         self.std = None
         self.mean = None
+        self.n_ = None
+        self.mean_ = None
+        self.m2_ = None
 
     def partial_fit(self, df, y=None):
         if df.shape[0] < 15:
             return self
-        partial_data_mean = df.mean()
-        partial_data_std = df.std()
-        if self.mean is None:
-            self.mean = partial_data_mean
-            self.std = partial_data_std
+        n = df.count()
+        self._update_moments(n, df.mean(), (df.var(ddof=0) * n).where(n > 0, 0))
+        return self
+
+    def _update_moments(self, n: pd.Series, mean: pd.Series, m2: pd.Series):
+        """Combine the count, mean and sum of squared deviations of each feature
+
+        The moments of both sets of cycles are pooled, so the result does
+        not depend on the order in which the cycles are combined
+        """
+        if n is None:
+            return
+        if getattr(self, "n_", None) is None:
+            self.n_, self.mean_, self.m2_ = n, mean, m2
         else:
-            self.mean = pd.concat([self.mean, partial_data_mean], axis=1).mean(axis=1)
-            self.std = pd.concat([self.std, partial_data_std], axis=1).mean(axis=1)
+            columns = self.n_.index.union(n.index, sort=False)
+            n_a = self.n_.reindex(columns, fill_value=0)
+            n_b = n.reindex(columns, fill_value=0)
+            mean_a = self.mean_.reindex(columns).where(n_a > 0, 0)
+            mean_b = mean.reindex(columns).where(n_b > 0, 0)
+            delta = mean_b - mean_a
+            self.n_ = n_a + n_b
+            with np.errstate(divide="ignore", invalid="ignore"):
+                self.mean_ = mean_a + delta * n_b / self.n_
+                self.m2_ = (
+                    self.m2_.reindex(columns, fill_value=0)
+                    + m2.reindex(columns, fill_value=0)
+                    + delta**2 * n_a * n_b / self.n_
+                )
+        self.mean = self.mean_.where(self.n_ > 0)
+        self.std = np.sqrt(self.m2_ / (self.n_ - 1)).where(self.n_ > 1)
+
+    mergeable = True
+
+    def merge(self, other: "StandardScaler") -> "StandardScaler":
+        self._update_moments(
+            getattr(other, "n_", None),
+            getattr(other, "mean_", None),
+            getattr(other, "m2_", None),
+        )
         return self
 
     def fit(self, df, y=None):
@@ -205,19 +339,72 @@ class StandardScaler(TransformerStep):
 
         return (X - self.mean) / (self.std)
 
+    array_kernel = True
+
+    def transform_array(self, X: np.ndarray, columns: pd.Index):
+        mean = aligned_values(self, "mean", columns)
+        std = aligned_values(self, "std", columns)
+        return (X - mean) / std, columns
+
+    elementwise = True
+
+    def elementwise_operations(self, columns: pd.Index):
+        mean = aligned_values(self, "mean", columns)
+        std = aligned_values(self, "std", columns)
+        return [(Operation.ADD, -mean, 0), (Operation.DIV, std, 0)]
+
 
 class RobustStandardScaler(TransformerStep):
-    """Scale features using statistics that are robust to outliers."""
+    """Scale features using statistics that are robust to outliers.
+
+    The data is centered with the median and scaled with the range between
+    the quantiles in quantile_range. The quantiles are computed in a single
+    pass over the run-to-failure cycles, without keeping them in memory.
+    The exact backend removes the stored values once the quantiles are
+    computed, so the step can not be partial fitted after transforming.
+    The step is fitted cycle by cycle by default: fitting it with the
+    concatenated dataset needs the whole dataset in memory.
+
+    Parameters:
+
+        quantile_range: Quantiles whose difference is used to scale the data
+        quantile_backend: How the quantiles are computed.
+                          'exact' stores the values of each feature as
+                          float32 in disk and selects the exact quantiles,
+                          'tdigest' approximates them with a t-digest
+                          of each feature
+        prefer_partial_fit: Wether the step is fitted cycle by cycle
+                            instead of with the concatenated dataset
+    """
 
-    def __init__(self, *, quantile_range=(0.25, 0.75), prefer_partial_fit:bool = False, **kwargs):
-        super().__init__( **kwargs,prefer_partial_fit=prefer_partial_fit)
+    def __init__(
+        self,
+        *,
+        quantile_range=(0.25, 0.75),
+        quantile_backend: str = "exact",
+        prefer_partial_fit: bool = True,
+        **kwargs
+    ):
+        super().__init__(**kwargs, prefer_partial_fit=prefer_partial_fit)
+        if quantile_backend not in ("exact", "tdigest"):
+            raise ValueError(
+                f"Invalid quantile backend {quantile_backend}. Valids are exact and tdigest"
+            )
         self.quantile_range = quantile_range
-        self.quantile_estimator = QuantileComputer()
+        self.quantile_backend = quantile_backend
+        self.quantile_estimator = self._build_quantile_estimator()
         self.IQR = None
         self.median = None
 
+    def _build_quantile_estimator(self) -> Union[QuantileComputer, QuantileEstimator]:
+        if self.quantile_backend == "tdigest":
+            return QuantileEstimator()
+        return QuantileComputer(
+            quantiles=[self.quantile_range[0], 0.5, self.quantile_range[1]]
+        )
+
     def fit(self, X: pd.DataFrame, y=None):
-        """Compute the mean of the dataset
+        """Compute the median and the quantile range of the dataset
 
         Parameters
         ----------
@@ -227,16 +414,16 @@ class RobustStandardScaler(TransformerStep):
 
         Returns
         -------
-        MeanCentering
+        RobustStandardScaler
             self
         """
-        Q1 = X.quantile(self.quantile_range[0])
-        Q3 = X.quantile(self.quantile_range[1])
-        self.IQR = Q3 - Q1
-        self.median = X.median()
+        self.quantile_estimator = self._build_quantile_estimator()
+        self.quantile_estimator.update(X)
+        self._compute_quantiles()
+        return self
 
     def partial_fit(self, X: pd.DataFrame, y=None):
-        """Compute incrementally the mean of the dataset
+        """Update the quantiles with a life
 
         Parameters
         ----------
@@ -245,14 +432,14 @@ class RobustStandardScaler(TransformerStep):
 
         Returns
         -------
-        MeanCentering
+        RobustStandardScaler
             self
         """
         if X.shape[0] < 2:
             return self
 
         self.quantile_estimator.update(X)
-
+        self.IQR = None
         return self
 
     def _compute_quantiles(self):
@@ -262,6 +449,8 @@ class RobustStandardScaler(TransformerStep):
         self.IQR = self.Q3 - self.Q1
 
         self.median = self.quantile_estimator.quantile(0.5)
+        if isinstance(self.quantile_estimator, QuantileComputer):
+            self.quantile_estimator.close()
 
     def transform(self, X: pd.DataFrame) -> pd.DataFrame:
         """Center the input life
@@ -338,6 +527,11 @@ class PerCategoricalMinMaxScaler(TransformerStep):
     Therefore, sometimes it is useful to scale the data based on a categorical feature,
     to reflect the difference in the execution parameters.
 
+    The scaling parameters of the scalers of all the categories are stacked
+    in arrays, and each time-series is scaled with a single gather on the
+    codes of its categorical feature. Unknown categories use the scaler
+    fitted with all the data.
+
     Parameters
     ----------
     categorical_feature: str
@@ -352,6 +546,8 @@ class PerCategoricalMinMaxScaler(TransformerStep):
 
     """
 
+    cache_attributes = ("_stacked",)
+
     def __init__(
         self,
         *,
@@ -367,6 +563,7 @@ class PerCategoricalMinMaxScaler(TransformerStep):
         self.scaler_params = scaler_params
 
         self.scalers = {"default": self.scaler(**self.scaler_params)}
+        self._stacked = None
 
     def partial_fit(self, X, y=None):
         if self.categorical_feature_name is None:
@@ -379,18 +576,60 @@ class PerCategoricalMinMaxScaler(TransformerStep):
                 self.scalers[category] = self.scaler(**self.scaler_params)
             self.scalers[category].partial_fit(data)
             self.scalers["default"].partial_fit(data)
+        self._stacked = None
+        return self
 
-    def transform(self, X: pd.DataFrame):
+    def _stacked_parameters(self, columns: pd.Index) -> Optional[Tuple]:
+        """Scaling parameters of every category, stacked in arrays
 
-        X_new = X.drop(columns=[self.categorical_feature_name])
-
-        for category, data in X.groupby(self.categorical_feature_name):
+        The row i of each array holds the parameters of the i-th category,
+        and the last row the ones of the default scaler. None when the
+        scalers do not provide their scaling parameters
+        """
+        if not all(hasattr(s, "scaling_parameters") for s in self.scalers.values()):
+            return None
+        stacked = getattr(self, "_stacked", None)
+        if stacked is not None and stacked[0] == tuple(columns):
+            return stacked[1]
+        categories = [c for c in self.scalers.keys() if c != "default"]
+        parameters = [
+            self.scalers[c].scaling_parameters(columns)
+            for c in categories + ["default"]
+        ]
+        offset, divisor, valid = (
+            np.stack([p[i] for p in parameters]).astype(np.float64) for i in range(3)
+        )
+        result = (pd.Index(categories), offset, divisor, valid.astype(bool))
+        self._stacked = (tuple(columns), result)
+        return result
 
-            data = data.drop(columns=[self.categorical_feature_name])
+    def transform(self, X: pd.DataFrame):
+        X_new = X.drop(columns=[self.categorical_feature_name])
+        stacked = self._stacked_parameters(X_new.columns)
+        if stacked is None:
+            return self._transform_by_category(X, X_new)
+
+        categories, offset, divisor, valid = stacked
+        # Unknown categories get -1, the row of the default scaler
+        codes = categories.get_indexer(X[self.categorical_feature_name])
+        default = self.scalers["default"]
+        lower, upper = default.range
+        values = X_new.values.astype(np.float64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            values = (values - offset[codes]) / divisor[codes] * (upper - lower) + lower
+        values[~valid[codes]] = 0
+        if default.clip:
+            np.clip(values, lower, upper, out=values)
+        return pd.DataFrame(values, columns=X_new.columns, index=X_new.index)
+
+    def _transform_by_category(self, X: pd.DataFrame, X_new: pd.DataFrame):
+        X_new = X_new.astype(np.float64)
+        groups = X.groupby(self.categorical_feature_name).indices
+        for category, positions in groups.items():
             scaler = (
                 self.scalers[category]
                 if category in self.scalers
                 else self.scalers["default"]
-            )  # Use a defaultdict
-            X_new.loc[data.index, :] = scaler.transform(data)
+            )
+            X_new.iloc[positions, :] = scaler.transform(X_new.iloc[positions]).values
         return X_new
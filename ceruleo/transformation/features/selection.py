@@ -4,6 +4,7 @@ from typing import List, Optional, Union
 import numpy as np
 import pandas as pd
 from ceruleo.transformation import TransformerStep
+from ceruleo.transformation.functional.array import column_indexer
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +19,8 @@ class ByNameFeatureSelector(TransformerStep):
             
         features: Feature name or List of features name to select
     """
+    online = True
+
     def __init__(self, *, features:Union[str, List[str]]= [], name: Optional[str] = None):
         super().__init__(name=name)
         if isinstance(features, str):
@@ -51,6 +54,12 @@ class ByNameFeatureSelector(TransformerStep):
     def transform(self, X):
         return X.loc[:, self.features_computed_].copy()
 
+    array_kernel = True
+
+    def transform_array(self, X: np.ndarray, columns: pd.Index):
+        indexer = column_indexer(self, self.features_computed_, columns)
+        return X[:, indexer], columns[indexer]
+
     @property
     def n_features(self):
         return len(self.features_computed_)
@@ -81,6 +90,8 @@ class PositionFeatures(TransformerStep):
 
 
 class DiscardByNameFeatureSelector(TransformerStep):
+    online = True
+
     def __init__(self, *, features=[], name: Optional[str] = None):
         super().__init__(name=name)
         self.features = features
@@ -99,6 +110,8 @@ class DiscardByNameFeatureSelector(TransformerStep):
 
 
 class PandasVarianceThreshold(TransformerStep):
+    online = True
+
     def __init__(self, *, min_variance: float, name: Optional[str] = None):
         super().__init__(name=name)
         self.min_variance = min_variance
@@ -118,6 +131,10 @@ class PandasVarianceThreshold(TransformerStep):
             logger.warning(
                 f"Current: {len(self.selected_columns_)}. New ones: {len(partial_selected_columns_)}"
             )
+        self._intersect(partial_selected_columns_)
+        return self
+
+    def _intersect(self, partial_selected_columns_):
         if self.selected_columns_ is None:
             self.selected_columns_ = partial_selected_columns_
         else:
@@ -127,6 +144,12 @@ class PandasVarianceThreshold(TransformerStep):
         if len(self.selected_columns_) == 0:
             logger.warning(type(self).__name__)
             logger.warning("All features were removed")
+
+    mergeable = True
+
+    def merge(self, other):
+        if other.selected_columns_ is not None:
+            self._intersect(other.selected_columns_)
         return self
 
     def fit(self, X, y=None):
@@ -147,6 +170,8 @@ class PandasVarianceThreshold(TransformerStep):
 
 
 class NullProportionSelector(TransformerStep):
+    online = True
+
     def __init__(self, *, max_null_proportion: float, name: Optional[str] = None):
         super().__init__(name=name)
         self.max_null_proportion = max_null_proportion
@@ -164,6 +189,10 @@ class NullProportionSelector(TransformerStep):
         ):
             logger.warning(type(self).__name__)
 
+        self._intersect(partial_selected_columns_)
+        return self
+
+    def _intersect(self, partial_selected_columns_):
         if self.selected_columns_ is None:
             self.selected_columns_ = partial_selected_columns_
         else:
@@ -173,6 +202,12 @@ class NullProportionSelector(TransformerStep):
         if len(self.selected_columns_) == 0:
             logger.warning(type(self).__name__)
             logger.warning("All features were removed")
+
+    mergeable = True
+
+    def merge(self, other):
+        if other.selected_columns_ is not None:
+            self._intersect(other.selected_columns_)
         return self
 
     def fit(self, X, y=None):
@@ -196,6 +231,8 @@ class  MatchFeatureSelector(TransformerStep):
     Parameters:
         pattern: Pattern to match
     """
+    online = True
+
     def __init__(self, *, pattern:str, name: Optional[str] = None):
         super().__init__(name=name)
         self.pattern = pattern
@@ -224,6 +261,8 @@ class ByTypeFeatureSelector(TransformerStep):
             
         features: Feature name or List of features name to select, by default []
     """
+    online = True
+
     def __init__(self, *, type_:Union[str, List]= [], name: Optional[str] = None):
         super().__init__(name=name)
 
@@ -1,6 +1,7 @@
 from copy import deepcopy
 from typing import Any, List, Optional, Tuple, Union
 
+import numpy as np
 import pandas as pd
 from ceruleo.transformation.functional.graph_utils import (
     root_nodes,
@@ -11,15 +12,35 @@ from ceruleo.transformation.functional.transformerstep import TransformerStep
 
 
 class Joiner(TransformerStep):
+    """Join the outputs of the sub-pipelines of each category
+
+    The first input holds the rows not covered by the rest of the inputs.
+    When it holds every row, sorted and with unique index, and all the
+    inputs have the same float columns, the rows of the categories are
+    written in their positions, without concatenating and sorting the inputs
+    """
+
     def transform(self, X: List[pd.DataFrame]):
-        if isinstance(X, list):
-            X_default = X[0]
-            X_q = pd.concat(X[1:])
-            missing_indices = X_default.index.difference(X_q.index)
-            X_q = pd.concat((X_q, X_default.loc[missing_indices, :])).sort_index()
-            return X_q
-        else:
+        if not isinstance(X, list):
             return X
+        X_default = X[0]
+        index = X_default.index
+        if (
+            index.is_unique
+            and index.is_monotonic_increasing
+            and all(X_c.columns.equals(X_default.columns) for X_c in X[1:])
+            and all((X_c.dtypes == np.float64).all() for X_c in X)
+        ):
+            positions = [index.get_indexer(X_c.index) for X_c in X[1:]]
+            if all((p >= 0).all() for p in positions):
+                values = X_default.values.copy()
+                for X_c, p in zip(X[1:], positions):
+                    values[p] = X_c.values
+                return pd.DataFrame(values, columns=X_default.columns, index=index)
+
+        X_q = pd.concat(X[1:])
+        missing = ~X_default.index.isin(X_q.index)
+        return pd.concat((X_q, X_default.loc[missing, :])).sort_index(kind="mergesort")
 
 
 class Filter(TransformerStep):
@@ -30,27 +51,23 @@ class Filter(TransformerStep):
         columns: Union[List[str], str],
         name: Optional[str] = None,
     ):
-        def prepare_value(v):
-            if isinstance(v, str):
-                return f"'{v}'"
-            else:
-                return v
-
         super().__init__(name=name)
         self.values = values
         self.columns = columns
-        self.query = " & ".join(
-            [f"({c} == {prepare_value(v)})" for c, v in zip(self.columns, self.values)]
-        )
 
     def transform(self, X):
         if self.values == ["__category_all__"]:
             return X.drop(columns=self.columns)
-        else:
-            return X.query(self.query).drop(columns=self.columns)
+        mask = np.ones(X.shape[0], dtype=bool)
+        for c, v in zip(self.columns, self.values):
+            mask &= (X[c] == v).values
+        return X.loc[mask].drop(columns=self.columns)
 
 
 class SplitByCategory(TransformerStep):
+    # partial_fit builds a sub-pipeline for each new category
+    modifies_graph = True
+
     def __init__(
         self,
         *,
@@ -1,7 +1,15 @@
-import math
+"""Approximate quantiles with t-digest
+
+The centroids of a digest are stored in two parallel arrays, their means
+and their weights, sorted by mean. Merging new values and compressing the
+centroids is done by numba kernels, and the values of several columns can
+be merged into their digests in a single call with merge_columns. The
+kernels release the GIL, so digests can be updated from several threads.
+"""
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
 
 import numpy as np
-from typing import Iterable, List
+from numba import jit, prange
 
 
 def k_to_q(k: float, d: float) -> float:
@@ -26,24 +34,168 @@ def k_to_q(k: float, d: float) -> float:
         return 2 * k_div_d * k_div_d
 
 
-def inplace_merge(arr, start, mid, end):
-    start2 = mid + 1
-    if arr[mid] <= arr[start2]:
-        return
-    while start <= mid and start2 <= end:
-        if arr[start] <= arr[start2]:
-            start += 1
+_k_to_q = jit(nopython=True)(k_to_q)
+
+
+@jit(nopython=True, nogil=True, error_model="numpy")
+def _merge_compress(
+    c_means, c_weights, values, count, max_size, out_means, out_weights
+) -> Tuple[int, float]:
+    """Merge sorted centroids and sorted values of weight 1, and compress them
+
+    Returns the number of centroids written in out_means and out_weights
+    and the sum of the merged values
+    """
+    n_c = c_means.shape[0]
+    n_v = values.shape[0]
+    it_c = 0
+    it_v = 0
+
+    k_limit = 1
+    q_limit_times_count = _k_to_q(k_limit, max_size) * count
+    k_limit += 1
+
+    if it_c < n_c and (it_v == n_v or c_means[it_c] < values[it_v]):
+        cur_mean, cur_weight = c_means[it_c], c_weights[it_c]
+        it_c += 1
+    else:
+        cur_mean, cur_weight = values[it_v], 1.0
+        it_v += 1
+    weight_so_far = cur_weight
+
+    sums_to_merge = 0.0
+    weights_to_merge = 0.0
+    total = 0.0
+    n_out = 0
+    while it_c < n_c or it_v < n_v:
+        if it_c < n_c and (it_v == n_v or c_means[it_c] < values[it_v]):
+            next_mean, next_weight = c_means[it_c], c_weights[it_c]
+            it_c += 1
+        else:
+            next_mean, next_weight = values[it_v], 1.0
+            it_v += 1
+
+        weight_so_far += next_weight
+        # The last position of the output is kept for the current centroid
+        if weight_so_far <= q_limit_times_count or n_out >= out_means.shape[0] - 1:
+            sums_to_merge += next_mean * next_weight
+            weights_to_merge += next_weight
         else:
-            value = arr[start2]
-            index = start2
-            while index != start:
-                arr[index] = arr[index - 1]
-                index -= 1
+            cluster_sum = sums_to_merge + cur_mean * cur_weight
+            cur_weight += weights_to_merge
+            out_means[n_out] = cluster_sum / cur_weight
+            out_weights[n_out] = cur_weight
+            total += cluster_sum
+            n_out += 1
+            sums_to_merge = 0.0
+            weights_to_merge = 0.0
+            q_limit_times_count = _k_to_q(k_limit, max_size) * count
+            k_limit += 1
+            cur_mean, cur_weight = next_mean, next_weight
+
+    cluster_sum = sums_to_merge + cur_mean * cur_weight
+    cur_weight += weights_to_merge
+    out_means[n_out] = cluster_sum / cur_weight
+    out_weights[n_out] = cur_weight
+    total += cluster_sum
+    n_out += 1
+
+    # Deal with floating point precision, the centroids are almost sorted
+    for i in range(1, n_out):
+        mean, weight = out_means[i], out_weights[i]
+        j = i - 1
+        while j >= 0 and out_means[j] > mean:
+            out_means[j + 1] = out_means[j]
+            out_weights[j + 1] = out_weights[j]
+            j -= 1
+        out_means[j + 1] = mean
+        out_weights[j + 1] = weight
+    return n_out, total
+
+
+def _merge_columns(
+    c_means,
+    c_weights,
+    c_lengths,
+    values,
+    v_lengths,
+    counts,
+    max_sizes,
+    out_means,
+    out_weights,
+    out_lengths,
+    out_sums,
+):
+    for j in prange(values.shape[0]):
+        if c_lengths[j] + v_lengths[j] == 0:
+            out_lengths[j] = 0
+            out_sums[j] = 0.0
+            continue
+        n_out, total = _merge_compress(
+            c_means[j, : c_lengths[j]],
+            c_weights[j, : c_lengths[j]],
+            values[j, : v_lengths[j]],
+            counts[j],
+            max_sizes[j],
+            out_means[j],
+            out_weights[j],
+        )
+        out_lengths[j] = n_out
+        out_sums[j] = total
+
+
+_merge_columns_parallel = jit(
+    nopython=True, nogil=True, parallel=True, error_model="numpy"
+)(_merge_columns)
+# The parallel kernel can not be launched from several threads at the same time
+_merge_columns_serial = jit(nopython=True, nogil=True, error_model="numpy")(
+    _merge_columns
+)
+
+
+@jit(nopython=True, error_model="numpy")
+def _estimate_quantile(means, weights, count, min_value, max_value, q):
+    n = means.shape[0]
+    rank = q * count
+    pos = 0
+    t = 0.0
+    if q > 0.5:
+        if q >= 1.0:
+            return max_value
+        t = count
+        for i in range(n - 1, -1, -1):
+            t -= weights[i]
+            if rank >= t:
+                pos = i
+                break
+    else:
+        if q <= 0.0:
+            return min_value
+        pos = n - 1
+        t = 0.0
+        for i in range(n):
+            if rank < t + weights[i]:
+                pos = i
+                break
+            t += weights[i]
+
+    delta = 0.0
+    lower = min_value
+    upper = max_value
+    if n > 1:
+        if pos == 0:
+            delta = means[pos + 1] - means[pos]
+            upper = means[pos + 1]
+        elif pos == n - 1:
+            delta = means[pos] - means[pos - 1]
+            lower = means[pos - 1]
+        else:
+            delta = (means[pos + 1] - means[pos - 1]) / 2
+            lower = means[pos - 1]
+            upper = means[pos + 1]
 
-            arr[start] = value
-            start += 1
-            mid += 1
-            start2 += 1
+    value = means[pos] + ((rank - t) / weights[pos] - 0.5) * delta
+    return min(max(value, lower), upper)
 
 
 class Centroid:
@@ -77,14 +229,32 @@ class Centroid:
 
 
 class TDigest:
+    """Approximation of the distribution of a set of values
+
+    Parameters:
+
+        maxSize: Maximum number of centroids
+    """
+
     def __init__(self, maxSize: int = 100):
         self.maxSize = maxSize
         self.sum = 0.0
         self.count = 0.0
         self.max = np.nan
         self.min = np.nan
-        self.centroids = []
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+
+    @property
+    def centroids(self) -> List[Centroid]:
+        return [Centroid(m, w) for m, w in zip(self.means, self.weights)]
 
+    @centroids.setter
+    def centroids(self, centroids: List[Centroid]):
+        self.means = np.array([c.mean for c in centroids], dtype=np.float64)
+        self.weights = np.array([c.weight for c in centroids], dtype=np.float64)
+
+    @staticmethod
     def construct(
         centroids: List[Centroid],
         sum: float,
@@ -92,22 +262,32 @@ class TDigest:
         max_val: float,
         min_val: float,
         maxSize: int = 100,
-    ):
-        t = TDigest(maxSize)
+    ) -> "TDigest":
+        t = TDigest(len(centroids))
+        t.centroids = sorted(centroids)
         t.sum = sum
         t.count = count
         t.max = max_val
         t.min = min_val
-        if len(centroids) < maxSize:
-            t.centroids = centroids
-        # // Number of centroids is greater than maxSize, we need to compress them
-        # // When merging, resulting digest takes the maxSize of the first digest
-        sz = len(centroids)
-        digests = [
-            TDigest(maxSize),
-            TDigest.construct(centroids, sum, count, max, min, sz),
-        ]
-        return t.merge(digests)
+        if len(centroids) <= maxSize:
+            t.maxSize = maxSize
+            return t
+        # Number of centroids is greater than maxSize, we need to compress them.
+        # When merging, resulting digest takes the maxSize of the first digest
+        return TDigest(maxSize).merge([TDigest(maxSize), t])
+
+    def _with_centroids(
+        self, means: np.ndarray, weights: np.ndarray, sum: float, count: float,
+        min_value: float, max_value: float
+    ) -> "TDigest":
+        result = TDigest(self.maxSize)
+        result.means = means
+        result.weights = weights
+        result.sum = sum
+        result.count = count
+        result.min = min_value
+        result.max = max_value
+        return result
 
     def estimate_quantile(self, q: float) -> float:
         """Estimates the value of the given quantile.
@@ -122,153 +302,59 @@ class TDigest:
         float
             Value of the quantile
         """
-        if len(self.centroids) == 0:
+        if self.means.shape[0] == 0:
             return 0.0
-        rank = q * self.count
-        pos = 0
-        t = 0
-        if q > 0.5:
-            if q >= 1.0:
-                return self.max
-            pos = 0
-            t = self.count
-            for i, centroid in enumerate(self.centroids[::-1]):
-                t -= centroid.weight
-                if rank >= t:
-                    pos = len(self.centroids) - i - 1
-                    break
-
-        else:
-            if q <= 0.0:
-                return self.min
-
-            pos = len(self.centroids) - 1
-            t = 0
-            for i, centroid in enumerate(self.centroids):
-                if rank < t + centroid.weight:
-                    pos = i
-                    break
-                t += centroid.weight
-
-        delta = 0
-        min = self.min
-        max = self.max
-        if len(self.centroids) > 1:
-            if pos == 0:
-                delta = self.centroids[pos + 1].mean - self.centroids[pos].mean
-                max = self.centroids[pos + 1].mean
-            elif pos == len(self.centroids) - 1:
-                delta = self.centroids[pos].mean - self.centroids[pos - 1].mean
-                min = self.centroids[pos - 1].mean
-            else:
-                delta = (
-                    self.centroids[pos + 1].mean - self.centroids[pos - 1].mean
-                ) / 2
-                min = self.centroids[pos - 1].mean
-                max = self.centroids[pos + 1].mean
-
-        value = (
-            self.centroids[pos].mean
-            + ((rank - t) / self.centroids[pos].weight - 0.5) * delta
+        return _estimate_quantile(
+            self.means, self.weights, self.count, self.min, self.max, q
         )
-        return np.clip(value, min, max)
 
-    def merge(self, digests: List["TDigest"]):
-        nCentroids = 0
-        for digest in digests:
-            nCentroids += digest.centroids_.size()
+    def percentile(self, p: float) -> float:
+        """Estimates the value of the given percentile, between 0 and 100"""
+        return self.estimate_quantile(p / 100)
 
-        if nCentroids == 0:
-            return TDigest()
+    def merge(self, digests: List["TDigest"]) -> "TDigest":
+        """Merge a list of digests in a new one
 
-        centroids = []
-        starts = []
-
-        count = 0
-
-        # We can safely use these limits to avoid isnan checks below because we know
-        # nCentroids > 0, so at least one TDigest has a min and max.
-        min = np.inf
-        max = -np.inf
-
-        for digest in digests:
-            starts.append(len(centroids))
-            curCount = digest.count()
-            if curCount > 0:
-                assert not np.isnan(digest.min)
-                assert not np.isnan(digest.max)
-                min = min(min, digest.min)
-                max = max(max, digest.max)
-                count += curCount
-                for centroid in digest.centroids:
-                    centroids.push_back(centroid)
-
-        digestsPerBlock = 1
-        while digestsPerBlock < len(starts):
-            # Each sorted block is digestPerBlock digests big. For each step, try to
-            # merge two blocks together.
-            i = 0
-            while i < starts.size():
-                # It is possible that this block is incomplete (less than digestsPerBlock
-                # big). In that case, the rest of the block is sorted and leave it alone
-                if i + digestsPerBlock < starts.size():
-                    first = starts[i]
-                    middle = starts[i + digestsPerBlock]
-
-                    # It is possible that the next block is incomplete (less than
-                    # digestsPerBlock big). In that case, merge to end. Otherwise, merge to
-                    # the end of that block.
-                    if i + (digestsPerBlock * 2) < len(starts):
-                        last = starts[i + 2 * digestsPerBlock]
-                    else:
-                        last = len(centroids) - 1
-                    inplace_merge(centroids, first, middle, last)
-            i += digestsPerBlock * 2
-
-            digestsPerBlock *= 2
-
-        maxSize = digests[0].maxSize
-        result = TDigest(maxSize)
-
-        compressed = []
-
-        k_limit = 1
-        q_limit_times_count = k_to_q(k_limit, maxSize) * count
-
-        cur = centroids[0]
-        weightSoFar = cur.weight()
-        sumsToMerge = 0
-        weightsToMerge = 0
-        for centroid in centroids:
-            weightSoFar += centroid.weight
-            if weightSoFar <= q_limit_times_count:
-                sumsToMerge += centroid.mean * centroid.weight
-                weightsToMerge += centroid.weight
-            else:
-                result.sum_ += cur.add(sumsToMerge, weightsToMerge)
-                sumsToMerge = 0
-                weightsToMerge = 0
-                compressed.append(cur)
-                q_limit_times_count = k_to_q(k_limit, maxSize) * count
-                k_limit += 1
-                cur = centroid
+        The new digest takes the maxSize of the first digest
 
-        result.sum += cur.add(sumsToMerge, weightsToMerge)
-        compressed.append(cur)
-        compressed.shrink_to_fit()
+        Parameters:
 
-        # Deal with floating point precision
-        compressed = sorted(compressed)
+            digests: Digests to merge
 
-        result.count = count
-        result.min = min
-        result.max = max
-        result.centroids = compressed
+        Returns:
+
+            digest: The merged digest
+        """
+        digests = [d for d in digests if d.count > 0 and d.means.shape[0] > 0]
+        if len(digests) == 0:
+            return TDigest()
+        means = np.concatenate([d.means for d in digests])
+        weights = np.concatenate([d.weights for d in digests])
+        order = np.argsort(means, kind="mergesort")
+        count = sum(d.count for d in digests)
+
+        max_size = digests[0].maxSize
+        out_means = np.empty(max(min(means.shape[0], max_size + 2), 2))
+        out_weights = np.empty_like(out_means)
+        n, total = _merge_compress(
+            means[order], weights[order], np.empty(0), count, max_size,
+            out_means, out_weights
+        )
+        result = digests[0]._with_centroids(
+            out_means[:n].copy(),
+            out_weights[:n].copy(),
+            total,
+            count,
+            min(d.min for d in digests),
+            max(d.max for d in digests),
+        )
+        result.maxSize = max_size
         return result
 
     def merge_unsorted(self, unsortedValues: Iterable[float]) -> "TDigest":
         """Merge unsorted values by first sorting them.
 
+        The missing values are discarded
 
         Parameters
         ----------
@@ -280,88 +366,155 @@ class TDigest:
         TDigest
             [description]
         """
-        return self.merge_sorted(sorted(unsortedValues))
+        values = np.asarray(unsortedValues, dtype=np.float64)
+        return self.merge_sorted(np.sort(values[~np.isnan(values)]))
+
+    def merge_sorted(self, sortedValues: Iterable[float]) -> "TDigest":
+        """Merge values sorted in ascending order
+
+        Parameters:
+
+            sortedValues: Values to merge
 
-    def merge_sorted(self, sortedValues: Iterable[float]):
-        if len(sortedValues) == 0:
+        Returns:
+
+            digest: A new digest with the values merged
+        """
+        values = np.asarray(sortedValues, dtype=np.float64)
+        if values.shape[0] == 0:
             return self
+        return merge_columns([self], values.reshape(-1, 1), is_sorted=True)[0]
 
-        result = TDigest(self.maxSize)
+    def batch_update(self, values: Iterable[float]):
+        """Merge unsorted values in place
 
-        result.count = self.count + len(sortedValues)
+        Parameters:
+
+            values: Values to merge
+        """
+        result = self.merge_unsorted(values)
+        self.__dict__.update(result.__dict__)
 
-        maybeMin = sortedValues[0]
-        maybeMax = sortedValues[-1]
-        if self.count > 0:
-            # // We know that min_ and max_ are numbers
-            result.min = min(self.min, maybeMin)
-            result.max = max(self.max, maybeMax)
-        else:
-            # // We know that min_ and max_ are NaN.
-            result.min = maybeMin
-            result.max = maybeMax
 
-        compressed = []
+def merge_columns(
+    digests: List[TDigest],
+    X: np.ndarray,
+    is_sorted: bool = False,
+    parallel: bool = True,
+) -> List[TDigest]:
+    """Merge the values of each column of X in its digest
 
-        k_limit = 1
-        q_limit_times_count = k_to_q(k_limit, self.maxSize) * result.count
-        k_limit += 1
+    All the columns are merged by a single kernel call. The missing
+    values are discarded
 
-        it_centroids = 0
-        it_sortedValues = 0
+    Parameters:
 
-        cur = None
+        digests: One digest for each column of X
+        X: Values of shape (rows, columns)
+        is_sorted: Wether the columns of X are already sorted and without missing values
+        parallel: Wether the columns are merged in parallel. Must be False
+                  when merge_columns is called from several threads
 
-        if (it_centroids < len(self.centroids) - 1) and (
-            self.centroids[it_centroids].mean < sortedValues[it_sortedValues]
-        ):
-            cur = self.centroids[it_centroids]
-            it_centroids += 1
+    Returns:
+
+        digests: New digests, one for each column
+    """
+    X = np.asarray(X, dtype=np.float64)
+    if X.ndim == 1:
+        X = X.reshape(-1, 1)
+    if len(digests) != X.shape[1]:
+        raise ValueError(
+            f"Expected one digest for each of the {X.shape[1]} columns, got {len(digests)}"
+        )
+    n_columns = X.shape[1]
+    if is_sorted:
+        values = np.ascontiguousarray(X.T)
+        v_lengths = np.full(n_columns, X.shape[0], dtype=np.int64)
+    else:
+        # The missing values are sorted at the end of each column
+        values = np.sort(X.T, axis=1)
+        v_lengths = (~np.isnan(values)).sum(axis=1).astype(np.int64)
+
+    c_lengths = np.array([d.means.shape[0] for d in digests], dtype=np.int64)
+    capacity = max(int(c_lengths.max()), 1)
+    c_means = np.zeros((n_columns, capacity))
+    c_weights = np.zeros((n_columns, capacity))
+    for j, d in enumerate(digests):
+        c_means[j, : c_lengths[j]] = d.means
+        c_weights[j, : c_lengths[j]] = d.weights
+
+    counts = np.array([d.count for d in digests], dtype=np.float64) + v_lengths
+    max_sizes = np.array([d.maxSize for d in digests], dtype=np.float64)
+    out_capacity = int(min(max_sizes.max() + 2, (c_lengths + v_lengths).max()))
+    out_means = np.empty((n_columns, max(out_capacity, 2)))
+    out_weights = np.empty_like(out_means)
+    out_lengths = np.zeros(n_columns, dtype=np.int64)
+    out_sums = np.zeros(n_columns)
+
+    kernel = _merge_columns_parallel if parallel else _merge_columns_serial
+    kernel(
+        c_means,
+        c_weights,
+        c_lengths,
+        np.ascontiguousarray(values),
+        v_lengths,
+        counts,
+        max_sizes,
+        out_means,
+        out_weights,
+        out_lengths,
+        out_sums,
+    )
+
+    result = []
+    for j, d in enumerate(digests):
+        n_values = v_lengths[j]
+        if n_values == 0:
+            result.append(d)
+            continue
+        column = values[j, :n_values]
+        if d.count > 0:
+            min_value = min(d.min, column[0])
+            max_value = max(d.max, column[-1])
         else:
-            cur = Centroid(sortedValues[it_sortedValues], 1.0)
-            it_sortedValues += 1
-
-        weightSoFar = cur.weight
-
-        # Keep track of sums along the way to reduce expensive floating points
-        sumsToMerge = 0.0
-        weightsToMerge = 0.0
-
-        while (it_centroids < len(self.centroids) - 1) or (
-            it_sortedValues < len(sortedValues) - 1
-        ):
-            next = None
-
-            if (it_centroids < len(self.centroids) - 1) and (
-                (it_sortedValues == len(sortedValues) - 1)
-                or (self.centroids[it_centroids].mean < sortedValues[it_sortedValues])
-            ):
-                next = self.centroids[it_centroids]
-                it_centroids += 1
-            else:
-                next = Centroid(sortedValues[it_sortedValues], 1.0)
-                it_sortedValues += 1
+            min_value = column[0]
+            max_value = column[-1]
+        result.append(
+            d._with_centroids(
+                out_means[j, : out_lengths[j]].copy(),
+                out_weights[j, : out_lengths[j]].copy(),
+                out_sums[j],
+                counts[j],
+                min_value,
+                max_value,
+            )
+        )
+    return result
 
-            nextSum = next.mean * next.weight
-            weightSoFar += next.weight
 
-            if weightSoFar <= q_limit_times_count:
-                sumsToMerge += nextSum
-                weightsToMerge += next.weight
-            else:
-                result.sum += cur.add(sumsToMerge, weightsToMerge)
-                sumsToMerge = 0
-                weightsToMerge = 0
-                compressed.append(cur)
-                q_limit_times_count = k_to_q(k_limit, self.maxSize) * result.count
-                k_limit += 1
-                cur = next
+def merge_digests(
+    digests: Optional[Dict[Hashable, TDigest]], other: Dict[Hashable, TDigest]
+) -> Dict[Hashable, TDigest]:
+    """Merge two dictionaries with the digest of each column
 
-        result.sum += cur.add(sumsToMerge, weightsToMerge)
-        compressed.append(cur)
+    The digests of the columns present in both dictionaries are merged,
+    the rest are kept as they are
 
-        # Deal with floating point precision
-        compressed = sorted(compressed)
+    Parameters:
 
-        result.centroids = compressed
-        return result
+        digests: Digest of each column. Can be None
+        other: Digest of each column
+
+    Returns:
+
+        digests: New dictionary with the merged digest of each column
+    """
+    merged = dict(digests) if digests is not None else {}
+    for c, digest in other.items():
+        if c in merged and merged[c].count > 0:
+            if digest.count > 0:
+                digest = merged[c].merge([merged[c], digest])
+            else:
+                digest = merged[c]
+        merged[c] = digest
+    return merged
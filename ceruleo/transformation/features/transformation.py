@@ -3,7 +3,12 @@ from typing import Optional
 
 import pandas as pd
 from ceruleo.transformation import TransformerStep
-from ceruleo.transformation.features.tdigest import TDigest
+from ceruleo.transformation.features.tdigest import (
+    TDigest,
+    merge_columns,
+    merge_digests,
+)
+from ceruleo.transformation.functional.fusion import Operation
 import numpy as np
 from scipy.signal import find_peaks
 
@@ -54,6 +59,31 @@ class MeanCentering(TransformerStep):
         self.mean = self.sum / self.N
         return self
 
+    mergeable = True
+
+    def merge(self, other: "MeanCentering") -> "MeanCentering":
+        """Add the sum and number of points fitted by other
+
+        Parameters
+        ----------
+        other : MeanCentering
+            The step fitted with the following lives
+
+        Returns
+        -------
+        MeanCentering
+            self
+        """
+        if other.sum is None:
+            return self
+        if self.sum is None:
+            self.sum = other.sum.copy()
+        else:
+            self.sum += other.sum
+        self.N += other.N
+        self.mean = self.sum / self.N
+        return self
+
     def transform(self, X: pd.DataFrame) -> pd.DataFrame:
         """Center the input life
 
@@ -113,15 +143,38 @@ class MedianCentering(TransformerStep):
 
         if self.tdigest_dict is None:
             self.tdigest_dict = {c: TDigest(100) for c in X.columns}
-        for c in X.columns:
-            self.tdigest_dict[c] = self.tdigest_dict[c].merge_unsorted(X[c].values)
+        digests = merge_columns([self.tdigest_dict[c] for c in X.columns], X.values)
+        self.tdigest_dict.update(zip(X.columns, digests))
+        self._compute_median()
+        return self
 
+    def _compute_median(self):
         self.median = pd.Series(
             {
                 c: self.tdigest_dict[c].estimate_quantile(0.5)
                 for c in self.tdigest_dict.keys()
             }
         )
+
+    mergeable = True
+
+    def merge(self, other: "MedianCentering") -> "MedianCentering":
+        """Merge the digests of each column fitted by other
+
+        Parameters
+        ----------
+        other : MedianCentering
+            The step fitted with the following lives
+
+        Returns
+        -------
+        MedianCentering
+            self
+        """
+        if other.tdigest_dict is None:
+            return self
+        self.tdigest_dict = merge_digests(self.tdigest_dict, other.tdigest_dict)
+        self._compute_median()
         return self
 
     def transform(self, X: pd.DataFrame) -> pd.DataFrame:
@@ -160,6 +213,16 @@ class Square(TransformerStep):
         """
         return X.pow(2)
 
+    array_kernel = True
+
+    def transform_array(self, X: np.ndarray, columns: pd.Index):
+        return np.square(X), columns
+
+    elementwise = True
+
+    def elementwise_operations(self, columns: pd.Index):
+        return [(Operation.SQUARE, 0, 0)]
+
 
 class Sqrt(TransformerStep):
     """Compute the sqrt of the values of each feature"""
@@ -180,6 +243,17 @@ class Sqrt(TransformerStep):
         """
         return X.pow(1.0 / 2)
 
+    array_kernel = True
+
+    def transform_array(self, X: np.ndarray, columns: pd.Index):
+        with np.errstate(invalid="ignore"):
+            return np.sqrt(X), columns
+
+    elementwise = True
+
+    def elementwise_operations(self, columns: pd.Index):
+        return [(Operation.SQRT, 0, 0)]
+
 
 class Scale(TransformerStep):
     """Scale each feature by a given vaulue
@@ -193,7 +267,7 @@ class Scale(TransformerStep):
     """
 
     def __init__(self, scale_factor: float, name: Optional[str] = None):
-        super().__init__(name)
+        super().__init__(name=name)
         self.scale_factor = scale_factor
 
     def transform(self, X: pd.DataFrame) -> pd.DataFrame:
@@ -211,6 +285,16 @@ class Scale(TransformerStep):
         """
         return X * self.scale_factor
 
+    array_kernel = True
+
+    def transform_array(self, X: np.ndarray, columns: pd.Index):
+        return X * self.scale_factor, columns
+
+    elementwise = True
+
+    def elementwise_operations(self, columns: pd.Index):
+        return [(Operation.MUL, self.scale_factor, 0)]
+
 
 class ExpandingCentering(TransformerStep):
     """Center the life using an expanding window
@@ -309,6 +393,8 @@ class Accumulate(TransformerStep):
         https://ieeexplore.ieee.org/stamp/stamp.jsp?arnumber=6621413
     """
 
+    online = True
+
     def __init__(self, normalize: bool = False, *args):
         super().__init__(*args)
         self.normalize = normalize
@@ -333,6 +419,30 @@ class Accumulate(TransformerStep):
         else:
             return X1
 
+    def update(self, X: pd.DataFrame) -> pd.DataFrame:
+        """Compute the cumulated sum of the new rows of a life
+
+        The cumulated sum of the previous rows is kept between calls
+
+        Parameters:
+
+            X: The new rows of the life
+
+        Returns:
+
+            The cumulated sum of the features in the new rows
+        """
+        if self._online_state is None:
+            X1 = X.cumsum()
+        else:
+            X1 = pd.concat([self._online_state, X]).cumsum().iloc[1:]
+        if X1.shape[0] > 0:
+            self._online_state = X1.ffill().iloc[-1:]
+        if self.normalize:
+            return X1 / X1.abs().apply(np.sqrt)
+        else:
+            return X1
+
 
 class Diff(TransformerStep):
     """Compute the 1 step difference of each feature."""
@@ -353,6 +463,37 @@ class Diff(TransformerStep):
         """
         return X.diff()
 
+    online = True
+
+    def update(self, X: pd.DataFrame) -> pd.DataFrame:
+        """Compute the 1 step difference of the new rows of a life
+
+        The last row received is kept between calls
+
+        Parameters:
+
+            X: The new rows of the life
+
+        Returns:
+
+            The difference of the features in the new rows
+        """
+        if self._online_state is None:
+            X_new = X.diff()
+        else:
+            X_new = pd.concat([self._online_state, X]).diff().iloc[1:]
+        if X.shape[0] > 0:
+            self._online_state = X.iloc[-1:]
+        return X_new
+
+    array_kernel = True
+
+    def transform_array(self, X: np.ndarray, columns: pd.Index):
+        new_X = np.empty(X.shape, dtype=np.result_type(X.dtype, np.float32))
+        new_X[:1] = np.nan
+        np.subtract(X[1:], X[:-1], out=new_X[1:])
+        return new_X, columns
+
 
 class StringConcatenate(TransformerStep):
     """Compute the 1 step difference of each feature."""
@@ -418,6 +559,18 @@ class Clip(TransformerStep):
     def transform(self, X: pd.DataFrame):
         return X.clip(self.lower, self.upper)
 
+    array_kernel = True
+
+    def transform_array(self, X: np.ndarray, columns: pd.Index):
+        return np.clip(X, self.lower, self.upper), columns
+
+    elementwise = True
+
+    def elementwise_operations(self, columns: pd.Index):
+        lower = -np.inf if self.lower is None else self.lower
+        upper = np.inf if self.upper is None else self.upper
+        return [(Operation.CLIP, lower, upper)]
+
 
 class SubstractLinebase(TransformerStep):
     """SubstractLinebase"""
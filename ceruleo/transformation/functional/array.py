@@ -0,0 +1,105 @@
+"""Array execution mode of the transformation pipeline
+
+Steps that declare an array kernel, setting `array_kernel = True` and
+implementing `transform_array`, receive the run-to-failure cycle as a 2D
+array together with its column names. The pandas alignment and copies
+are avoided, and the cycle is only converted back to a DataFrame for the
+steps that need it.
+"""
+import weakref
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+# Memos of each step, kept outside of the step so they are not part of
+# its pickled state, nor of the keys of the step cache
+_aligned_values = weakref.WeakKeyDictionary()
+_column_indexer = weakref.WeakKeyDictionary()
+
+
+class LifeArray:
+    """Run-to-failure cycle represented as a 2D array
+
+    Parameters:
+
+        values: Array of shape (rows, columns)
+        columns: Name of the columns
+        index: Index of the rows
+    """
+
+    __slots__ = ("values", "columns", "index")
+
+    def __init__(self, values: np.ndarray, columns: pd.Index, index: pd.Index):
+        self.values = values
+        self.columns = columns
+        self.index = index
+
+    @staticmethod
+    def from_pandas(X: pd.DataFrame) -> Optional["LifeArray"]:
+        """Build the array representation of a DataFrame
+
+        Parameters:
+
+            X: A run-to-failure cycle
+
+        Returns:
+
+            life: The cycle as an array. None when some column is not numeric
+        """
+        if not all(pd.api.types.is_numeric_dtype(d) for d in X.dtypes):
+            return None
+        return LifeArray(X.values, X.columns, X.index)
+
+    def to_pandas(self) -> pd.DataFrame:
+        return pd.DataFrame(self.values, columns=self.columns, index=self.index)
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+
+def aligned_values(step, attribute: str, columns: pd.Index) -> np.ndarray:
+    """Values of a fitted Series of a step, in the order of the columns
+
+    The alignment is computed once for each set of columns and
+    is recomputed when the attribute changes
+
+    Parameters:
+
+        step: The fitted step
+        attribute: Name of the attribute holding a Series indexed by column
+        columns: Columns of the array being transformed
+
+    Returns:
+
+        values: The values of the Series aligned to the columns
+    """
+    series = getattr(step, attribute)
+    cache = _aligned_values.setdefault(step, {})
+    key = (attribute, tuple(columns))
+    if key in cache and cache[key][0] is series:
+        return cache[key][1]
+    values = series.reindex(columns).values
+    cache[key] = (series, values)
+    return values
+
+
+def column_indexer(step, features, columns: pd.Index) -> np.ndarray:
+    """Positions of the features in the columns, computed once for each set of columns
+
+    Parameters:
+
+        step: The step selecting the features
+        features: Names of the features to select
+        columns: Columns of the array being transformed
+
+    Returns:
+
+        positions: Position of each feature in columns
+    """
+    cache = _column_indexer.setdefault(step, {})
+    key = (tuple(features), tuple(columns))
+    if key not in cache:
+        cache[key] = columns.get_indexer(features)
+    return cache[key]
@@ -15,6 +15,10 @@ class Concatenate(TransformerStepMixin):
     add_prefix : bool, optional
         Whether to add prefix , by default True
     """
+    # The column prefixes are taken from the previous steps
+    parallel_safe = False
+    online = True
+
     def __init__(self, *, add_prefix:bool= True):
 
         super().__init__()
@@ -45,6 +49,9 @@ class Concatenate(TransformerStepMixin):
             Xs = self.merge_dataframes_by_column(Xs)
         return Xs
 
+    def update(self, Xs: List[pd.DataFrame]):
+        return self.transform(Xs)
+
     def get_params(self, deep=True):
         params = super().get_params(deep=deep)
         return params
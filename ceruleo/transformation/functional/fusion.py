@@ -0,0 +1,215 @@
+"""Fusion of consecutive elementwise steps
+
+Chains of elementwise steps, such as clipping, scaling or squaring, allocate
+a new run-to-failure cycle in each step. Before transforming, the runner
+replaces each chain by a FusedStep that applies all the operations of the
+chain in a single pass over the data. The operations are applied in the
+same order as the steps, so the result is the same.
+"""
+from enum import IntEnum
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+from ceruleo.transformation.functional.graph_utils import detached
+from ceruleo.transformation.functional.mixin import TransformerStepMixin
+from ceruleo.transformation.functional.transformerstep import TransformerStep
+from numba import jit
+
+
+class Operation(IntEnum):
+    """Elementwise operations that can be fused
+
+    The parameters a and b of each operation are:
+
+    * ADD: v + a
+    * MUL: v * a
+    * DIV: v / a
+    * CLIP: v clipped to [a, b]
+    * SQUARE: v * v
+    * SQRT: square root of v
+    * FILL: b where a is not 0
+    """
+
+    ADD = 0
+    MUL = 1
+    DIV = 2
+    CLIP = 3
+    SQUARE = 4
+    SQRT = 5
+    FILL = 6
+
+
+@jit(nopython=True, error_model="numpy")
+def _fused_kernel(X, codes, a, b, out):
+    n_rows, n_columns = X.shape
+    for j in range(n_columns):
+        for i in range(n_rows):
+            v = X[i, j]
+            for k in range(codes.shape[0]):
+                code = codes[k]
+                if code == 0:
+                    v = v + a[k, j]
+                elif code == 1:
+                    v = v * a[k, j]
+                elif code == 2:
+                    v = v / a[k, j]
+                elif code == 3:
+                    if v < a[k, j]:
+                        v = a[k, j]
+                    if v > b[k, j]:
+                        v = b[k, j]
+                elif code == 4:
+                    v = v * v
+                elif code == 5:
+                    v = np.sqrt(v)
+                elif code == 6:
+                    if a[k, j] != 0:
+                        v = b[k, j]
+            out[i, j] = v
+
+
+class FusedStep(TransformerStep):
+    """Chain of fitted elementwise steps applied in a single pass
+
+    The values are computed in float64. The steps are the ones of the
+    pipeline, so the changes of their parameters are always used. Copies
+    of them, detached from the graph, are pickled.
+
+    Parameters:
+
+        steps: The elementwise steps, in order of application
+        inplace: Wether the arrays received by transform_array
+                 can be overwritten
+    """
+
+    array_kernel = True
+
+    def __init__(self, steps: List[TransformerStep], inplace: bool = False):
+        super().__init__(name="+".join(step.name for step in steps))
+        self.steps = steps
+        self.inplace = inplace
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["steps"] = [detached(step) for step in self.steps]
+        return state
+
+    def _operations(
+        self, columns: pd.Index
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        operations = [
+            operation
+            for step in self.steps
+            for operation in step.elementwise_operations(columns)
+        ]
+        shape = (len(operations), len(columns))
+        codes = np.array([int(op) for op, _, _ in operations], dtype=np.int64)
+        a = np.empty(shape, dtype=np.float64)
+        b = np.empty(shape, dtype=np.float64)
+        for k, (_, op_a, op_b) in enumerate(operations):
+            a[k, :] = op_a
+            b[k, :] = op_b
+        return codes, a, b
+
+    def _apply(self, X: np.ndarray, columns: pd.Index, inplace: bool) -> np.ndarray:
+        codes, a, b = self._operations(columns)
+        if inplace and X.dtype == np.float64 and X.flags.writeable:
+            out = X
+        else:
+            out = np.empty_like(X, dtype=np.float64)
+        _fused_kernel(X, codes, a, b, out)
+        return out
+
+    def transform(self, X: pd.DataFrame) -> pd.DataFrame:
+        return pd.DataFrame(
+            self._apply(X.values, X.columns, False), columns=X.columns, index=X.index
+        )
+
+    def transform_array(self, X: np.ndarray, columns: pd.Index):
+        return self._apply(X, columns, self.inplace), columns
+
+    def description(self):
+        return [step.description() for step in self.steps]
+
+
+def _fusible(node: TransformerStepMixin) -> bool:
+    return isinstance(node, TransformerStep) and node.elementwise
+
+
+def fuse_steps(
+    final_step: TransformerStepMixin,
+) -> Tuple[TransformerStepMixin, Dict[TransformerStepMixin, TransformerStepMixin]]:
+    """Build a copy of the graph where the chains of elementwise steps are fused
+
+    A chain is a sequence of two or more elementwise steps where each step
+    is the only next step of the previous one. The steps of the original
+    graph are not modified. The new graph holds shallow copies of the
+    steps that are not fused, and the fused steps reference the original
+    steps of the chain.
+
+    Parameters:
+
+        final_step: Last step of the graph
+
+    Returns:
+
+        final_step: Last step of the new graph
+        origin: Original step of each copied step of the new graph
+    """
+    nodes = [final_step]
+    visited = set(nodes)
+    i = 0
+    while i < len(nodes):
+        for p in nodes[i].previous:
+            if p not in visited:
+                visited.add(p)
+                nodes.append(p)
+        i += 1
+
+    def linked(node, n) -> bool:
+        return (
+            _fusible(node)
+            and _fusible(n)
+            and node.next == [n]
+            and n.previous == [node]
+            and node is not final_step
+        )
+
+    replacement = {}
+    origin = {}
+    for node in nodes:
+        if not _fusible(node) or any(linked(p, node) for p in node.previous):
+            continue
+        chain = [node]
+        while len(chain[-1].next) == 1 and linked(chain[-1], chain[-1].next[0]):
+            chain.append(chain[-1].next[0])
+        if len(chain) < 2:
+            continue
+        previous = node.previous
+        inplace = (
+            len(previous) == 1
+            and getattr(previous[0], "array_kernel", False)
+            and len(previous[0].next) == 1
+        )
+        fused = FusedStep(chain, inplace=inplace)
+        for step in chain:
+            replacement[step] = fused
+
+    for node in nodes:
+        if node not in replacement:
+            replacement[node] = detached(node)
+            origin[replacement[node]] = node
+
+    for node in nodes:
+        new_node = replacement[node]
+        for p in node.previous:
+            new_p = replacement[p]
+            if new_p is not new_node and new_p not in new_node.previous:
+                new_node.previous.append(new_p)
+        for n in node.next:
+            new_n = replacement.get(n)
+            if new_n is None or new_n is new_node or new_n in new_node.next:
+                continue
+            new_node.next.append(new_n)
+    return replacement[final_step], origin
@@ -1,5 +1,5 @@
 from copy import copy
-from typing import Union
+from typing import List, Set, Union
 
 
 def root_nodes(step_or_pipe: Union["TemporisPipeline", "TransformerStep"]):
@@ -22,6 +22,17 @@ def root_nodes(step_or_pipe: Union["TemporisPipeline", "TransformerStep"]):
     return [n for n in visited if len(n.previous) == 0]
 
 
+def detached(node: "TransformerStep") -> "TransformerStep":
+    """Shallow copy of a step without the references to the graph
+
+    Used to send only the step, and not the whole graph, to other processes
+    """
+    node = copy(node)
+    node.previous = []
+    node.next = []
+    return node
+
+
 def dfs_iterator(step_or_pipe: Union["TemporisPipeline", "TransformerStep"]):
 
     from ceruleo.transformation.functional.pipeline.pipeline import Pipeline
@@ -103,6 +114,58 @@ class topological_sort_iterator:
         return self.current_node
 
 
+def ready_nodes(
+    step_or_pipe: Union["TemporisPipeline", "TransformerStep"],
+    processed: Set["TransformerStep"],
+) -> List["TransformerStep"]:
+    """Nodes not yet processed whose previous nodes were all processed
+
+    The nodes returned are independent of each other and can be
+    processed concurrently. Since the graph is traversed again in each
+    call, nodes added while fitting (i.e. by SplitByCategory) are found
+
+    Parameters:
+
+        step_or_pipe: Pipeline or final step of the graph
+        processed: Nodes already processed
+
+    Returns:
+
+        nodes: Nodes ready to be processed
+    """
+    return [
+        node
+        for node in dfs_iterator(step_or_pipe)
+        if node not in processed and all(p in processed for p in node.previous)
+    ]
+
+
+def topological_levels(
+    step_or_pipe: Union["TemporisPipeline", "TransformerStep"]
+) -> List[List["TransformerStep"]]:
+    """Split the graph in levels of independent nodes
+
+    Every node belongs to the level following the one of its
+    deepest previous node
+
+    Parameters:
+
+        step_or_pipe: Pipeline or final step of the graph
+
+    Returns:
+
+        levels: List of levels, each one a list of nodes
+    """
+    levels = []
+    processed = set()
+    level = ready_nodes(step_or_pipe, processed)
+    while len(level) > 0:
+        levels.append(level)
+        processed.update(level)
+        level = ready_nodes(step_or_pipe, processed)
+    return levels
+
+
 def nodes(pipe : "TemporisPipeline"):
     _nodes = set()
     for root in root_nodes(pipe):        
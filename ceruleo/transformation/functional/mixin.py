@@ -7,12 +7,21 @@ from sklearn.base import BaseEstimator
 
 
 class TransformerStepMixin(BaseEstimator):
+    # Whether the step can transform the run-to-failure cycles in worker
+    # processes, detached from the rest of the graph
+    parallel_safe = True
+
+    # Whether fitting the step adds steps to the graph. The runner never
+    # processes these steps concurrently with the rest of their level
+    modifies_graph = False
+
     def __init__(self, *, name: Optional[str] = None, prefer_partial_fit:bool =True):
         self.name_ = name
         self.previous = []
         self.next = []
         self.uuid = "".join(str(uuid.uuid4()).split("-"))
         self.prefer_partial_fit = prefer_partial_fit
+        self._online_state = None
 
 
     @property
@@ -60,6 +69,19 @@ class TransformerStepMixin(BaseEstimator):
             self.next.append(n)
             n.previous.append(self)
 
+    def mark_dirty(self):
+        """Mark the step to be fitted again by Pipeline.refit
+
+        Changes of the parameters are detected when refitting, this
+        is only needed when the step is modified in other ways
+        """
+        self.dirty_ = True
+
+    def set_params(self, **params):
+        super().set_params(**params)
+        self.mark_dirty()
+        return self
+
     def description(self):
         return self.name
 
@@ -1,73 +1,102 @@
+import pickle
 import shelve
 import shutil
 import uuid
 from enum import Enum
 from pathlib import Path
+from typing import List, Optional, Tuple
 
+import pandas as pd
+import pyarrow as pa
 from ceruleo import CACHE_PATH
+from ceruleo.transformation.functional.pipeline.utils import encode_tuple
 
 
 class GraphTraversalAbstractStore:
     """Abstract Cache for the graph traversal
+
+    The keys are tuples whose first element is the node that will consume
+    the state. An index with one bucket of keys per node is kept, so the
+    keys of a node are obtained without scanning the store.
     """
+    def __init__(self):
+        self.index = {}
+
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
         self.close()
 
+    def _register(self, k: Tuple):
+        self.index.setdefault(k[0], {})[k] = None
+
+    def _unregister(self, k: Tuple):
+        bucket = self.index[k[0]]
+        del bucket[k]
+        if len(bucket) == 0:
+            del self.index[k[0]]
+
+    def keys_of(self, node) -> List[Tuple]:
+        return list(self.index.get(node, {}).keys())
+
+    def keys(self):
+        return [k for bucket in self.index.values() for k in bucket.keys()]
+
     def close(self):
         raise NotImplementedError
 
     def reset(self):
         raise NotImplementedError
 
-    def keys(self):
-        raise NotImplementedError
-
     def pop(self, k):
         raise NotImplementedError
 
 
-class GraphTraversalCacheShelveStore:
+class GraphTraversalCacheShelveStore(GraphTraversalAbstractStore):
     """Cache all the intermediate steps in a Shelve Store
 
+    The index of the keys is kept in memory alongside the shelve file
+
     Parameters:
 
         cache_path: Path where the case is stored
     """
     def __init__(self, cache_path: Path = CACHE_PATH):
+        super().__init__()
         filename = "".join(str(uuid.uuid4()).split("-"))
         self.cache_path = cache_path / "GraphTraversalCache" / filename / "data"
         self.cache_path.parent.mkdir(exist_ok=True, parents=True)
         self.transformed_cache = shelve.open(str(self.cache_path))
 
     def __getitem__(self, k):
-        return self.transformed_cache[k]
+        return self.transformed_cache[encode_tuple(k)]
 
     def __setitem__(self, k, v):
-        self.transformed_cache[k] = v
+        self.transformed_cache[encode_tuple(k)] = v
+        self._register(k)
 
     def close(self):
         if self.cache_path.parent.is_dir():
             self.transformed_cache.close()
             shutil.rmtree(self.cache_path.parent)
+        self.index = {}
 
     def reset(self):
         self.transformed_cache.close()
-        self.transformed_cache = shelve.open(str(self.cache_path))
-
-    def keys(self):
-        return self.transformed_cache.keys()
+        self.transformed_cache = shelve.open(str(self.cache_path), flag="n")
+        self.index = {}
 
     def pop(self, k):
-        return self.transformed_cache.pop(k)
+        self._unregister(k)
+        return self.transformed_cache.pop(encode_tuple(k))
 
 
-class GraphTraversalCacheMemory:
+class GraphTraversalCacheMemory(GraphTraversalAbstractStore):
     """Cache all the intermediate steps in RAM
     """
     def __init__(self):
+        super().__init__()
         self.store = {}
 
     def __getitem__(self, k):
@@ -75,27 +104,117 @@ class GraphTraversalCacheMemory:
 
     def __setitem__(self, k, v):
         self.store[k] = v
+        self._register(k)
 
     def close(self):
         self.store = {}
+        self.index = {}
 
     def reset(self):
         self.store = {}
-
-    def keys(self):
-        return self.store.keys()
+        self.index = {}
 
     def pop(self, k):
+        self._unregister(k)
         return self.store.pop(k)
 
 
+class GraphTraversalCacheArrowStore(GraphTraversalAbstractStore):
+    """Cache all the intermediate steps as Arrow IPC files
+
+    Each state is written to its own file. DataFrames are stored as Arrow
+    tables, optionally compressed, and read memory-mapped. The states that
+    can not be represented as an Arrow table are pickled.
+
+    Parameters:
+
+        cache_path: Path where the cache is stored
+        compression: None, 'lz4' or 'zstd'
+    """
+    def __init__(
+        self, cache_path: Path = CACHE_PATH, compression: Optional[str] = None
+    ):
+        super().__init__()
+        filename = "".join(str(uuid.uuid4()).split("-"))
+        self.cache_path = cache_path / "GraphTraversalCache" / filename
+        self.cache_path.mkdir(exist_ok=True, parents=True)
+        self.options = pa.ipc.IpcWriteOptions(compression=compression)
+        self.files = {}
+        self.counter = 0
+
+    @staticmethod
+    def _is_columnar(v) -> bool:
+        return (
+            isinstance(v, pd.DataFrame)
+            and all(isinstance(c, str) for c in v.columns)
+            and v.columns.is_unique
+        )
+
+    def _write(self, v) -> Path:
+        self.counter += 1
+        if self._is_columnar(v):
+            try:
+                table = pa.Table.from_pandas(v, preserve_index=True)
+                path = self.cache_path / f"{self.counter}.arrow"
+                with pa.OSFile(str(path), "wb") as sink:
+                    with pa.ipc.new_file(
+                        sink, table.schema, options=self.options
+                    ) as writer:
+                        writer.write_table(table)
+                return path
+            except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+                pass
+        path = self.cache_path / f"{self.counter}.pkl"
+        with open(path, "wb") as file:
+            pickle.dump(v, file)
+        return path
+
+    def __getitem__(self, k):
+        path = self.files[k]
+        if path.suffix == ".arrow":
+            source = pa.memory_map(str(path), "r")
+            return pa.ipc.open_file(source).read_all().to_pandas()
+        with open(path, "rb") as file:
+            return pickle.load(file)
+
+    def __setitem__(self, k, v):
+        if k in self.files:
+            self.files.pop(k).unlink()
+        self.files[k] = self._write(v)
+        self._register(k)
+
+    def close(self):
+        if self.cache_path.is_dir():
+            shutil.rmtree(self.cache_path)
+        self.files = {}
+        self.index = {}
+
+    def reset(self):
+        for path in self.files.values():
+            path.unlink()
+        self.files = {}
+        self.index = {}
+
+    def pop(self, k):
+        v = self[k]
+        self._unregister(k)
+        self.files.pop(k).unlink()
+        return v
+
+
 class CacheStoreType(Enum):
     """Cache store modes
     
     Values:
 
         SHELVE = 1
-        MEMORY = 2    
+        MEMORY = 2
+        ARROW = 3: Arrow IPC files read memory-mapped
+        ARROW_LZ4 = 4: LZ4 compressed Arrow IPC files
+        ARROW_ZSTD = 5: Zstandard compressed Arrow IPC files
     """
     SHELVE = 1
     MEMORY = 2
+    ARROW = 3
+    ARROW_LZ4 = 4
+    ARROW_ZSTD = 5
@@ -0,0 +1,128 @@
+"""Transformation of run-to-failure cycles received in chunks
+
+The online steps, setting `online = True` and implementing `update`, keep
+the state they need from the rows already received, such as the
+accumulated moments of ExpandingStatistics or the last row of Diff. The
+transformation of the new rows of a cycle is then computed without
+transforming again the complete cycle.
+"""
+import warnings
+from typing import Dict, List, Union
+
+import pandas as pd
+from ceruleo.transformation.functional.graph_utils import (
+    detached,
+    topological_sort_iterator,
+)
+from ceruleo.transformation.functional.mixin import TransformerStepMixin
+from ceruleo.transformation.functional.transformerstep import TransformerStep
+
+StepInput = Union[pd.DataFrame, List[pd.DataFrame]]
+
+
+def is_online(node: TransformerStepMixin) -> bool:
+    """Whether a step can transform the rows of a cycle received in chunks"""
+    return getattr(node, "online", False) or getattr(node, "elementwise", False)
+
+
+def _concat(chunks: List[StepInput]) -> StepInput:
+    if isinstance(chunks[0], list):
+        return [
+            pd.concat([chunk[i] for chunk in chunks]) for i in range(len(chunks[0]))
+        ]
+    return pd.concat(chunks)
+
+
+class OnlineSession:
+    """Transform a run-to-failure cycle whose rows are received in chunks
+
+    Each call to update receives the rows that follow the ones received in
+    the previous call, and returns the same rows that the transformation of
+    the complete cycle would return for them. Appending k rows costs
+    O(k x features) in the online steps. The rest of the steps are applied
+    again over all the rows they received and only their last rows are
+    kept, so the first update warns about them. Steps that look ahead in
+    the cycle, such as BackwardFillImputer, can only use the rows received
+    so far.
+
+    The session holds copies of the fitted steps, so the pipeline and
+    other sessions are not affected by its state.
+
+    Parameters:
+
+        final_step: Last step of a fitted transformation graph
+    """
+
+    def __init__(self, final_step: TransformerStepMixin):
+        ancestors = {final_step}
+        to_process = list(final_step.previous)
+        while len(to_process) > 0:
+            node = to_process.pop()
+            if node not in ancestors:
+                ancestors.add(node)
+                to_process.extend(node.previous)
+
+        self._copies: Dict[TransformerStepMixin, TransformerStepMixin] = {}
+        self._nodes = []
+        for node in topological_sort_iterator(final_step):
+            if node not in ancestors or node in self._copies:
+                continue
+            step = detached(node)
+            if isinstance(step, TransformerStep):
+                step.reset_online()
+            self._copies[node] = step
+            self._nodes.append(node)
+        # Steps such as Concatenate use the names of their previous steps
+        for node in self._nodes:
+            self._copies[node].previous = [self._copies[p] for p in node.previous]
+            self._copies[node].next = [
+                self._copies[n] for n in node.next if n in self._copies
+            ]
+
+        self.final_step = final_step
+        self._history: Dict[TransformerStepMixin, List[StepInput]] = {
+            node: [] for node in self._nodes if not is_online(node)
+        }
+        self._emitted: Dict[TransformerStepMixin, int] = {
+            node: 0 for node in self._history
+        }
+        self.n_rows = 0
+
+    def _update_step(self, node: TransformerStepMixin, X: StepInput) -> pd.DataFrame:
+        step = self._copies[node]
+        if is_online(node):
+            return step.update(X)
+        self._history[node].append(X)
+        X_full = step.transform(_concat(self._history[node]))
+        X_new = X_full.iloc[self._emitted[node] :]
+        self._emitted[node] = X_full.shape[0]
+        return X_new
+
+    def update(self, X: pd.DataFrame) -> pd.DataFrame:
+        """Transform the next rows of the run-to-failure cycle
+
+        Parameters:
+
+            X: The next rows of the cycle
+
+        Returns:
+
+            The transformed rows
+        """
+        if self.n_rows == 0 and len(self._history) > 0:
+            warnings.warn(
+                "The steps "
+                + ", ".join(node.name for node in self._history)
+                + " are not online, each update transforms again all the rows received"
+            )
+        outputs = {}
+        for node in self._nodes:
+            if len(node.previous) == 0:
+                inputs = X
+            elif len(node.previous) == 1:
+                inputs = outputs[node.previous[0]]
+            else:
+                inputs = [outputs[p] for p in node.previous]
+            outputs[node] = self._update_step(node, inputs)
+        self.n_rows += X.shape[0]
+        return outputs[self.final_step]
@@ -3,6 +3,7 @@ import uuid
 from pathlib import Path
 from typing import Iterable, List, Optional, Tuple, Union
 
+import numpy as np
 import pandas as pd
 from ceruleo import CACHE_PATH
 from ceruleo.dataset.ts_dataset import AbstractTimeSeriesDataset
@@ -11,7 +12,9 @@ from ceruleo.transformation.functional.graph_utils import (
     topological_sort_iterator,
 )
 from ceruleo.transformation.functional.pipeline.cache_store import CacheStoreType
+from ceruleo.transformation.functional.pipeline.online import OnlineSession
 from ceruleo.transformation.functional.pipeline.runner import CachedPipelineRunner
+from ceruleo.transformation.functional.pipeline.step_cache import StepCache
 from ceruleo.transformation.functional.transformerstep import TransformerStep
 from sklearn.base import BaseEstimator, TransformerMixin
 
@@ -22,13 +25,36 @@ class Pipeline(BaseEstimator, TransformerMixin):
     Parameters:
         final_step: The final step of the transformation
         cache_type: Cache storage mode
+        n_jobs: Number of processes used to transform the run-to-failure cycles.
+                Steps that can not be sent to another process are run serially
+        step_cache: Persistent cache where the fitted steps and the transformed
+                    cycles are reused across fits, processes and sessions
+        fuse_steps: Wether the chains of elementwise steps, such as Clip,
+                    Scale or the scalers, are applied in a single pass
+                    when transforming
     """
 
-    def __init__(self, final_step, cache_type: CacheStoreType = CacheStoreType.MEMORY):
+    def __init__(
+        self,
+        final_step,
+        cache_type: CacheStoreType = CacheStoreType.MEMORY,
+        n_jobs: int = 1,
+        step_cache: Optional[StepCache] = None,
+        fuse_steps: bool = False,
+    ):
         self.final_step = final_step
         self.fitted_ = False
         self.cache_type = cache_type
-        self.runner = CachedPipelineRunner(final_step, cache_type)
+        self.n_jobs = n_jobs
+        self.step_cache = step_cache
+        self.fuse_steps = fuse_steps
+        self.runner = CachedPipelineRunner(
+            final_step,
+            cache_type,
+            n_jobs=n_jobs,
+            step_cache=step_cache,
+            fuse_steps=fuse_steps,
+        )
 
     def find_node(
         self, name: str
@@ -59,6 +85,7 @@ class Pipeline(BaseEstimator, TransformerMixin):
         self,
         dataset: Union[AbstractTimeSeriesDataset, pd.DataFrame],
         show_progress: bool = False,
+        streaming: bool = False,
     ):
         """Fit a pipeline using a dataset
 
@@ -68,13 +95,43 @@ class Pipeline(BaseEstimator, TransformerMixin):
 
             dataset: A dataset of a run-to-failure cycle
             show_progress: Wether to show the progress when fitting
+            streaming: Wether to avoid storing the dataset transformed up to
+                       each step. Each cycle is transformed again through the
+                       fitted steps when it is needed, using less memory
+
+        Returns:
+            s : Pipeline
+        """
+        if isinstance(dataset, pd.DataFrame):
+            dataset = [dataset]
+        c = self.runner.fit(dataset, show_progress=show_progress, streaming=streaming)
+        self.column_names = c.columns
+        self.fitted_ = True
+
+        return self
+
+    def refit(
+        self,
+        dataset: Union[AbstractTimeSeriesDataset, pd.DataFrame],
+        show_progress: bool = False,
+    ):
+        """Fit again only the steps whose parameters changed and their descendants
+
+        The steps whose parameters did not change keep their fitted state.
+        Their outputs are reused from the step cache, when the pipeline has
+        one, or transformed again otherwise.
+
+        Parameters:
+
+            dataset: The dataset used to fit the pipeline
+            show_progress: Wether to show the progress when fitting
 
         Returns:
             s : Pipeline
         """
         if isinstance(dataset, pd.DataFrame):
             dataset = [dataset]
-        c = self.runner.fit(dataset, show_progress=show_progress)
+        c = self.runner.refit(dataset, show_progress=show_progress)
         self.column_names = c.columns
         self.fitted_ = True
 
@@ -101,6 +158,34 @@ class Pipeline(BaseEstimator, TransformerMixin):
         """
         return self.runner.transform(df)
 
+    def transform_array(self, life: pd.DataFrame) -> np.ndarray:
+        """Transform a run-to-failure cycle without building the intermediate DataFrames
+
+        The steps that implement an array kernel operate directly over the
+        values of the cycle. The DataFrame is only built for the steps
+        that need it
+
+        Parameters:
+
+            life: A run-to-failure cycle
+
+        Returns:
+            X: The values of the transformed cycle
+        """
+        return self.runner.transform_array(life)
+
+    def online(self) -> OnlineSession:
+        """Start the transformation of a run-to-failure cycle received in chunks
+
+        Each call to the update method of the session receives the next
+        rows of the cycle and returns their transformation. The result is
+        the same as the transformation of the complete cycle
+
+        Returns:
+            session: A new session, independent of the rest
+        """
+        return OnlineSession(self.final_step)
+
     def description(self):
         data = []
         for node in topological_sort_iterator(self):
@@ -108,7 +193,13 @@ class Pipeline(BaseEstimator, TransformerMixin):
         return data
 
     def get_params(self, deep: bool = False):
-        params = {"cache_type": self.cache_type, "final_step": self.final_step}
+        params = {
+            "cache_type": self.cache_type,
+            "final_step": self.final_step,
+            "n_jobs": self.n_jobs,
+            "step_cache": self.step_cache,
+            "fuse_steps": self.fuse_steps,
+        }
         if deep:
             for node in topological_sort_iterator(self):
                 p = node.get_params(deep)
@@ -116,9 +207,46 @@ class Pipeline(BaseEstimator, TransformerMixin):
                     params[f"{node.name}__{k}"] = p[k]
         return params
 
+    def set_params(self, **params):
+        """Set the parameters of the pipeline or of its steps
+
+        The parameters of the steps are given as {step name}__{parameter}.
+        The steps modified are marked to be fitted again by refit.
+        The parameters of the pipeline are also set in its runner.
+        """
+        for key, value in params.items():
+            node_name, delim, param = key.partition("__")
+            if not delim:
+                setattr(self, key, value)
+                if key == "final_step":
+                    self.runner.close()
+                    self.runner = CachedPipelineRunner(
+                        self.final_step,
+                        self.cache_type,
+                        n_jobs=self.n_jobs,
+                        step_cache=self.step_cache,
+                        fuse_steps=self.fuse_steps,
+                    )
+                elif hasattr(self.runner, key):
+                    setattr(self.runner, key, value)
+                continue
+            nodes = self.find_node(node_name)
+            if nodes is None:
+                raise ValueError(f"Invalid step {node_name} for pipeline")
+            if not isinstance(nodes, list):
+                nodes = [nodes]
+            for node in nodes:
+                node.set_params(**{param: value})
+        self.runner.invalidate_execution_graph()
+        return self
+
 
 def make_pipeline(
-    *steps, cache_type: CacheStoreType = CacheStoreType.MEMORY
+    *steps,
+    cache_type: CacheStoreType = CacheStoreType.MEMORY,
+    n_jobs: int = 1,
+    step_cache: Optional[StepCache] = None,
+    fuse_steps: bool = False,
 ) -> Pipeline:
     """Build a pipeline
 
@@ -134,6 +262,9 @@ def make_pipeline(
 
         steps: List of steps
         cache_type: Where to store the pipeline intermediate steps
+        n_jobs: Number of processes used to transform the run-to-failure cycles
+        step_cache: Persistent cache of fitted steps and transformed cycles
+        fuse_steps: Wether the chains of elementwise steps are applied in a single pass
 
     Returns:
 
@@ -143,4 +274,10 @@ def make_pipeline(
     for next_step in steps[1:]:
         step = next_step(step)
 
-    return Pipeline(step, cache_type=cache_type)
+    return Pipeline(
+        step,
+        cache_type=cache_type,
+        n_jobs=n_jobs,
+        step_cache=step_cache,
+        fuse_steps=fuse_steps,
+    )
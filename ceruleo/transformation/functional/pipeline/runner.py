@@ -1,23 +1,156 @@
+import copy
 import logging
-from multiprocessing import JoinableQueue, Manager, Process, Queue
-from typing import Iterable, Union
+import math
+import os
+import pickle
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
+from typing import Iterable, List, Optional, Set, Tuple, Union
 
+import numpy as np
 import pandas as pd
+from ceruleo.transformation.functional.array import LifeArray
+from ceruleo.transformation.functional.fusion import fuse_steps
 from ceruleo.transformation.functional.graph_utils import (
+    detached,
+    dfs_iterator,
+    ready_nodes,
     root_nodes,
-    topological_sort_iterator,
 )
 from ceruleo.transformation.functional.pipeline.cache_store import CacheStoreType
+from ceruleo.transformation.functional.pipeline.step_cache import (
+    GRAPH_ATTRIBUTES, StepCache, dataset_fingerprint, life_fingerprint,
+    params_fingerprint, step_fingerprint, step_state)
 from ceruleo.transformation.functional.pipeline.traversal import CachedGraphTraversal
 from ceruleo.transformation.functional.transformerstep import TransformerStep
+from ceruleo.utils.workers import process_context
 from tqdm.auto import tqdm
 
 logger = logging.getLogger(__name__)
 
 
-def _transform(node, old_element, dataset_element, queue):
-    n = node.transform(old_element)
-    queue.put((dataset_element, n))
+def _as_pandas(X):
+    if isinstance(X, LifeArray):
+        return X.to_pandas()
+    return X
+
+
+def _transform_batch(node, elements):
+    return [node.transform(element) for element in elements]
+
+
+def _partial_fit_batch(node, elements):
+    for element in elements:
+        node.partial_fit(element)
+    return node
+
+
+def _tree_merge(steps: List[TransformerStep]) -> TransformerStep:
+    """Merge consecutive pairs of fitted steps until only one is left
+
+    The order of the steps is preserved, each step is merged with the one
+    fitted with the cycles that follow its own
+    """
+    while len(steps) > 1:
+        merged = [steps[i].merge(steps[i + 1]) for i in range(0, len(steps) - 1, 2)]
+        if len(steps) % 2 == 1:
+            merged.append(steps[-1])
+        steps = merged
+    return steps[0]
+
+
+def _is_outdated_copy(copied, node) -> bool:
+    """Whether an attribute of node was set after copied was copied from it"""
+    return any(
+        copied.__dict__.get(k, copied) is not v
+        for k, v in node.__getstate__().items()
+        if k not in GRAPH_ATTRIBUTES
+    )
+
+
+def _mark_clean(node):
+    node.dirty_ = False
+    node.params_key_ = params_fingerprint(node)
+
+
+def _is_dirty(node) -> bool:
+    """Whether the step was marked, never fitted or its parameters changed
+
+    Changes of parameters that can not be hashed are not detected, those
+    steps must be marked with mark_dirty
+    """
+    if getattr(node, "dirty_", True):
+        return True
+    key = params_fingerprint(node)
+    return key is not None and key != getattr(node, "params_key_", None)
+
+
+# Attributes used by the runner to track the fitted state of a step
+_BOOKKEEPING_ATTRIBUTES = ("dirty_", "params_key_", "unfitted_state_")
+
+
+def _parameters_of(node) -> dict:
+    try:
+        return node.get_params(deep=False)
+    except Exception:
+        return {}
+
+
+def _remember_unfitted_state(node):
+    """Record the state of a step before being fitted
+
+    The parameters are not recorded, the current ones are always used
+    when the step is reset
+    """
+    state = step_state(node)
+    if state is None:
+        return
+    excluded = set(_parameters_of(node)) | set(_BOOKKEEPING_ATTRIBUTES)
+    node.unfitted_state_ = copy.deepcopy(
+        {k: v for k, v in state.items() if k not in excluded}
+    )
+
+
+def _reset_step(node) -> bool:
+    """Discard the fitted state of a step, keeping its place in the graph
+
+    The step is built again from its current parameters. When it can not
+    be built from them, the state recorded before it was fitted is
+    restored and the parameters are kept. Steps that hold references to
+    other steps are left as they are
+
+    Returns:
+
+        reset: Whether the fitted state was discarded
+    """
+    if not isinstance(node, TransformerStep) or step_state(node) is None:
+        return False
+    params = _parameters_of(node)
+    try:
+        state = type(node)(**params).__dict__
+        params = {}
+    except Exception:
+        if "unfitted_state_" not in node.__dict__:
+            return False
+        state = copy.deepcopy(node.unfitted_state_)
+    kept = {
+        k: node.__dict__[k]
+        for k in GRAPH_ATTRIBUTES + _BOOKKEEPING_ATTRIBUTES
+        if k in node.__dict__
+    }
+    node.__dict__.clear()
+    node.__dict__.update(state)
+    node.__dict__.update(kept)
+    for k, v in params.items():
+        setattr(node, k, v)
+    return True
+
+
+def _prepare_fit(node):
+    """Reset a step fitted before and record its unfitted state"""
+    if "params_key_" in node.__dict__:
+        _reset_step(node)
+    _remember_unfitted_state(node)
 
 
 class CachedPipelineRunner:
@@ -27,17 +160,118 @@ class CachedPipelineRunner:
 
         final_step: Last step of the graph
         cache_type: Mode for storing the cache
+        n_jobs: Number of worker processes used to transform the
+                run-to-failure cycles, and to partial fit the mergeable
+                steps. 1 transforms them serially, -1 uses all the
+                processors
+        batch_size: Number of run-to-failure cycles sent to a worker in
+                    each task. By default the cycles are split in four
+                    batches per worker
+        step_cache: Persistent cache of fitted steps and transformed cycles
+        fuse_steps: Wether the chains of elementwise steps are fused in a
+                    single step when transforming
+
+    The worker pools are created the first time they are needed and
+    reused by the following fits and transformations, until close is
+    called or n_jobs changes. The worker processes are started with
+    forkserver, so the main module of the program must be importable
+    without side effects.
     """
 
     def __init__(
         self,
         final_step: TransformerStep,
         cache_type: CacheStoreType = CacheStoreType.SHELVE,
+        n_jobs: int = 1,
+        batch_size: Optional[int] = None,
+        step_cache: Optional[StepCache] = None,
+        fuse_steps: bool = False,
     ):
 
         self.final_step = final_step
         self.root_nodes = root_nodes(final_step)
         self.cache_type = cache_type
+        self.n_jobs = n_jobs
+        self.batch_size = batch_size
+        self.step_cache = step_cache
+        self.fit_keys = {}
+        self._life_keys = None
+        self.fuse_steps = fuse_steps
+        self._executor = None
+        self._branch_executor = None
+        self._pool_size = None
+        self.invalidate_execution_graph()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_executor"] = None
+        state["_branch_executor"] = None
+        state["_pool_size"] = None
+        return state
+
+    def close(self, wait: bool = True):
+        """Shut down the worker pools
+
+        They are created again by the next fit or transformation
+
+        Parameters:
+
+            wait: Wether to wait until the workers exit
+        """
+        executor = self.__dict__.get("_executor")
+        if executor is not None:
+            executor.shutdown(wait=wait)
+            self._branch_executor.shutdown(wait=wait)
+        self._executor = None
+        self._branch_executor = None
+        self._pool_size = None
+
+    def __del__(self):
+        # The finalizer may run in any thread, including a worker of the pools
+        try:
+            self.close(wait=False)
+        except Exception:
+            pass
+
+    def _executors(
+        self, n_workers: int
+    ) -> Tuple[Optional[ProcessPoolExecutor], Optional[ThreadPoolExecutor]]:
+        """Process pool of the cycles and thread pool of the nodes of a level"""
+        if n_workers <= 1:
+            return None, None
+        pool_size = os.cpu_count() if self.n_jobs < 0 else self.n_jobs
+        if self._pool_size != pool_size:
+            self.close()
+            self._executor = ProcessPoolExecutor(
+                pool_size, mp_context=process_context()
+            )
+            self._branch_executor = ThreadPoolExecutor(pool_size)
+            self._pool_size = pool_size
+        return self._executor, self._branch_executor
+
+    def invalidate_execution_graph(self):
+        """Discard the fused graph, it is built again in the next transformation"""
+        self._execution_final_step = None
+        self._origin = {}
+
+    def _execution_graph(self):
+        """Final step of the graph used to transform
+
+        When fuse_steps is set, the chains of elementwise steps are fused.
+        The fused graph is built again when an attribute of one of its
+        steps was set, for example by set_params
+        """
+        if not self.fuse_steps:
+            return self.final_step
+        if self._execution_final_step is None or any(
+            _is_outdated_copy(copied, node) for copied, node in self._origin.items()
+        ):
+            self._execution_final_step, self._origin = fuse_steps(self.final_step)
+        return self._execution_final_step
+
+    def _number_of_workers(self, dataset_size: int) -> int:
+        n_jobs = os.cpu_count() if self.n_jobs < 0 else self.n_jobs
+        return max(min(n_jobs, dataset_size), 1)
 
     def _run(
         self,
@@ -45,39 +279,306 @@ class CachedPipelineRunner:
         fit: bool = True,
         show_progress: bool = False,
     ):
+        final_step = self.final_step if fit else self._execution_graph()
         dataset_size = len(dataset)
+        n_workers = self._number_of_workers(dataset_size)
+        executor, branch_executor = self._executors(n_workers)
+        if self.step_cache is not None:
+            self._life_keys = [life_fingerprint(life) for life in dataset]
+            if fit:
+                data_key = dataset_fingerprint(self._life_keys)
+                self.fit_keys = {}
+                memo = {}
 
-        with CachedGraphTraversal(
-            self.root_nodes, dataset, cache_type=self.cache_type
-        ) as cache:
-            for node in topological_sort_iterator(self.final_step):
-                if isinstance(node, TransformerStep) and fit:
-                    if node.prefer_partial_fit:
-                        for dataset_element in range(dataset_size):
-                            d = cache.state_up_to(node, dataset_element)
-                            node.partial_fit(d)
-                    else:
-                        data = pd.concat(
-                            [
-                                cache.state_up_to(node, dataset_element)
-                                for dataset_element in range(dataset_size)
-                            ]
+        try:
+            with CachedGraphTraversal(
+                root_nodes(final_step), dataset, cache_type=self.cache_type
+            ) as cache:
+                processed = set()
+                level = ready_nodes(final_step, processed)
+                while len(level) > 0:
+                    if self.step_cache is not None and fit:
+                        for node in level:
+                            self.fit_keys[node] = step_fingerprint(
+                                node, data_key, memo
+                            )
+                    # The steps that modify the graph run alone, after the
+                    # rest of the level
+                    concurrent = [node for node in level if not node.modifies_graph]
+                    serial = level
+                    if branch_executor is not None and len(concurrent) > 1:
+                        futures = [
+                            branch_executor.submit(
+                                self._process_node,
+                                cache,
+                                node,
+                                dataset_size,
+                                fit,
+                                show_progress,
+                                executor,
+                            )
+                            for node in concurrent
+                        ]
+                        for future in futures:
+                            future.result()
+                        serial = [node for node in level if node.modifies_graph]
+                    for node in serial:
+                        self._process_node(
+                            cache, node, dataset_size, fit, show_progress, executor
                         )
-                        node.fit(data)
+                    processed.update(level)
+                    level = ready_nodes(final_step, processed)
 
-                dataset_size = len(dataset)
-                # if dataset_size > 1:
-                # self._parallel_transform_step(cache, node, dataset_size, show_progress)
-                # else:
-                self._transform_step(cache, node, dataset_size, show_progress)
+                last_state_key = min(cache.get_keys_of(None), key=lambda k: k[2])
+                return cache.transformed_cache[last_state_key]
+        finally:
+            self._life_keys = None
 
-            last_state_key = cache.get_keys_of(None)[0]
-            return cache.transformed_cache[last_state_key]
+    def _process_node(
+        self,
+        cache: CachedGraphTraversal,
+        node,
+        dataset_size: int,
+        fit: bool,
+        show_progress: bool,
+        executor: Optional[ProcessPoolExecutor],
+    ):
+        """Fit the node and transform all the run-to-failure cycles with it
+
+        The nodes of the same level are processed concurrently, except the
+        ones that modify the graph when fitted, which are processed after
+        the rest of the level. The fit of a node always completes before
+        its output is stored, so the nodes of the next level read the
+        output of fitted nodes.
+
+        When a step cache is used, the fitted state of the node and the
+        transformed cycles found in it are reused.
+        """
+        key = self._cache_key(node)
+        if isinstance(node, TransformerStep) and fit and not self._load_step(node):
+            if node.prefer_partial_fit:
+                if (
+                    executor is not None
+                    and dataset_size > 1
+                    and self._parallel_fit_safe(node)
+                ):
+                    self._parallel_partial_fit(
+                        cache, node, dataset_size, show_progress, executor
+                    )
+                else:
+                    for dataset_element in range(dataset_size):
+                        d = cache.state_up_to(node, dataset_element)
+                        node.partial_fit(d)
+            else:
+                data = pd.concat(
+                    [
+                        cache.state_up_to(node, dataset_element)
+                        for dataset_element in range(dataset_size)
+                    ]
+                )
+                node.fit(data)
+            if key is not None:
+                self.step_cache.store_step(node, key)
+        if fit:
+            _mark_clean(node)
 
-    def fit(self, dataset: Iterable[pd.DataFrame], show_progress: bool = False):
+        elements = list(range(dataset_size))
+        if key is not None:
+            elements = []
+            for dataset_element in range(dataset_size):
+                new_element = self.step_cache.get_output(
+                    key, self._life_keys[dataset_element]
+                )
+                if new_element is None:
+                    elements.append(dataset_element)
+                else:
+                    self._store_state(cache, node, dataset_element, new_element)
+        if len(elements) == 0:
+            return
+
+        if executor is not None and len(elements) > 1 and self._parallel_safe(node):
+            self._parallel_transform_step(
+                cache, node, elements, show_progress, executor
+            )
+        else:
+            self._transform_step(cache, node, elements, show_progress)
+
+    def _cache_key(self, node) -> Optional[str]:
+        if self.step_cache is None or self._life_keys is None:
+            return None
+        return self.fit_keys.get(self._origin.get(node, node))
+
+    def _load_step(self, node) -> bool:
+        key = self._cache_key(node)
+        return key is not None and self.step_cache.load_step(node, key)
+
+    def fit(
+        self,
+        dataset: Iterable[pd.DataFrame],
+        show_progress: bool = False,
+        streaming: bool = False,
+    ):
+        self.invalidate_execution_graph()
+        for node in dfs_iterator(self.final_step):
+            if isinstance(node, TransformerStep):
+                _prepare_fit(node)
+        if streaming:
+            return self._streaming_fit(dataset, show_progress=show_progress)
         return self._run(dataset, fit=True, show_progress=show_progress)
 
+    def _output_of(self, node, life: pd.DataFrame, outputs: dict, life_key=None):
+        """Transform a run-to-failure cycle up to node
+
+        The outputs of the nodes are memoized in outputs, which
+        only lives while the cycle is processed
+        """
+        if node not in outputs:
+            output = None
+            key = self._cache_key(node)
+            if key is not None:
+                output = self.step_cache.get_output(key, life_key)
+            if output is None:
+                output = node.transform(
+                    self._input_of(node, life, outputs, life_key)
+                )
+            outputs[node] = output
+        return outputs[node]
+
+    def _input_of(self, node, life: pd.DataFrame, outputs: dict, life_key=None):
+        if len(node.previous) == 0:
+            return life
+        if len(node.previous) == 1:
+            return self._output_of(node.previous[0], life, outputs, life_key)
+        return [self._output_of(p, life, outputs, life_key) for p in node.previous]
+
+    def _streaming_fit(
+        self,
+        dataset: Iterable[pd.DataFrame],
+        show_progress: bool,
+        processed: Optional[Set] = None,
+    ):
+        """Fit the graph level by level without storing the intermediate states
+
+        For each level, every run-to-failure cycle is transformed through the
+        already fitted nodes, and only the inputs of the nodes of the level
+        are kept while the cycle is used to fit them. The nodes before the
+        level are transformed again for every level, trading computation
+        for memory.
+
+        Parameters:
+
+            dataset: The run-to-failure cycles
+            show_progress: Wether to show the progress
+            processed: Nodes already fitted. By default the whole graph is fitted
+        """
+        dataset_size = len(dataset)
+        if processed is None:
+            processed = set()
+            self.fit_keys = {}
+        life_keys = [None] * dataset_size
+        if self.step_cache is not None:
+            life_keys = [life_fingerprint(life) for life in dataset]
+            self._life_keys = life_keys
+            data_key = dataset_fingerprint(life_keys)
+            memo = {}
+
+        try:
+            level = ready_nodes(self.final_step, processed)
+            while len(level) > 0:
+                if self.step_cache is not None:
+                    for node in level:
+                        self.fit_keys[node] = step_fingerprint(node, data_key, memo)
+                to_fit = [
+                    node
+                    for node in level
+                    if isinstance(node, TransformerStep) and not self._load_step(node)
+                ]
+                partial_fit_nodes = [node for node in to_fit if node.prefer_partial_fit]
+                fit_nodes = [node for node in to_fit if not node.prefer_partial_fit]
+                if len(to_fit) > 0:
+                    fit_data = {node: [] for node in fit_nodes}
+                    bar = range(dataset_size)
+                    if show_progress:
+                        bar = tqdm(bar)
+                        bar.set_description(", ".join(node.name for node in to_fit))
+                    for dataset_element in bar:
+                        life = dataset[dataset_element]
+                        life_key = life_keys[dataset_element]
+                        outputs = {}
+                        for node in partial_fit_nodes:
+                            node.partial_fit(
+                                self._input_of(node, life, outputs, life_key)
+                            )
+                        for node in fit_nodes:
+                            fit_data[node].append(
+                                self._input_of(node, life, outputs, life_key)
+                            )
+                    for node in fit_nodes:
+                        node.fit(pd.concat(fit_data.pop(node)))
+                    for node in to_fit:
+                        key = self._cache_key(node)
+                        if key is not None:
+                            self.step_cache.store_step(node, key)
+
+                for node in level:
+                    _mark_clean(node)
+                processed.update(level)
+                level = ready_nodes(self.final_step, processed)
+
+            return self._output_of(self.final_step, dataset[0], {}, life_keys[0])
+        finally:
+            self._life_keys = None
+
+    def dirty_nodes(self) -> Set:
+        """Nodes that must be fitted again
+
+        A node is dirty when it was never fitted, when it was marked with
+        mark_dirty or set_params, when its parameters changed since it was
+        fitted, or when one of its ancestors is dirty.
+
+        Returns:
+
+            nodes: The dirty nodes
+        """
+        dirty = set(n for n in dfs_iterator(self.final_step) if _is_dirty(n))
+        Q = list(dirty)
+        while len(Q) > 0:
+            for n in Q.pop().next:
+                if n not in dirty:
+                    dirty.add(n)
+                    Q.append(n)
+        return dirty
+
+    def refit(self, dataset: Iterable[pd.DataFrame], show_progress: bool = False):
+        """Fit again only the dirty nodes of the graph
+
+        The clean nodes are not fitted again. Their outputs are taken from
+        the step cache when available, or transformed again otherwise. The
+        dataset should be the one used to fit the clean nodes.
+
+        Parameters:
+
+            dataset: The run-to-failure cycles
+            show_progress: Wether to show the progress
+        """
+        self.invalidate_execution_graph()
+        dirty = self.dirty_nodes()
+        for node in dirty:
+            _reset_step(node)
+            if isinstance(node, TransformerStep):
+                _remember_unfitted_state(node)
+        clean = set(dfs_iterator(self.final_step)) - dirty
+        return self._streaming_fit(dataset, show_progress, processed=clean)
+
     def _update_step(self, cache, node, dataset_element, new_element):
+        key = self._cache_key(node)
+        if key is not None:
+            self.step_cache.store_output(
+                key, self._life_keys[dataset_element], new_element
+            )
+        self._store_state(cache, node, dataset_element, new_element)
+
+    def _store_state(self, cache, node, dataset_element, new_element):
         cache.clean_state_up_to(node, dataset_element)
 
         if len(node.next) > 0:
@@ -86,48 +587,164 @@ class CachedPipelineRunner:
         else:
             cache.store(None, node, dataset_element, new_element)
 
+    def _parallel_safe(self, node) -> bool:
+        if not node.parallel_safe:
+            return False
+        try:
+            pickle.dumps(detached(node))
+        except Exception:
+            logger.debug(f"{node.name} can not be pickled, transforming serially")
+            return False
+        return True
+
+    def _parallel_fit_safe(self, node) -> bool:
+        """Whether the step can be partial fitted in shards by the worker processes
+
+        The step must implement merge, and it must be possible to reset
+        a copy of it to start the fit of each shard
+        """
+        return (
+            node.mergeable
+            and step_state(node) is not None
+            and "unfitted_state_" in node.__dict__
+            and self._parallel_safe(node)
+        )
+
+    def _parallel_partial_fit(
+        self,
+        cache: CachedGraphTraversal,
+        node,
+        dataset_size: int,
+        show_progress: bool,
+        executor: ProcessPoolExecutor,
+    ):
+        """Partial fit copies of the step with batches of cycles in the process pool
+
+        Every copy starts from a reset copy of the step, built from its
+        current parameters. The fitted copies are merged in the order of
+        the batches, and the result is stored in the step. At most two
+        batches per worker are pending.
+        """
+        n_workers = self._number_of_workers(dataset_size)
+        batch_size = self.batch_size
+        if batch_size is None:
+            batch_size = math.ceil(dataset_size / (4 * n_workers))
+        batches = [
+            list(range(start, min(start + batch_size, dataset_size)))
+            for start in range(0, dataset_size, batch_size)
+        ]
+        bar = None
+        if show_progress:
+            bar = tqdm(total=dataset_size)
+            bar.set_description(f"Fitting {node.name}")
+
+        unfitted_node = detached(node)
+        _reset_step(unfitted_node)
+
+        fitted = [None] * len(batches)
+        pending = {}
+        next_batch = 0
+        try:
+            while True:
+                while len(pending) < 2 * n_workers and next_batch < len(batches):
+                    worker_node = copy.deepcopy(unfitted_node)
+                    elements = [
+                        cache.state_up_to(node, dataset_element)
+                        for dataset_element in batches[next_batch]
+                    ]
+                    future = executor.submit(_partial_fit_batch, worker_node, elements)
+                    pending[future] = next_batch
+                    next_batch += 1
+                if len(pending) == 0:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i = pending.pop(future)
+                    fitted[i] = future.result()
+                    if bar is not None:
+                        bar.update(len(batches[i]))
+        except Exception as e:
+            logger.error(f"There was an error when fitting {node.name}")
+            raise
+        finally:
+            if bar is not None:
+                bar.close()
+
+        merged = _tree_merge(fitted)
+        node.__dict__.update(
+            {k: v for k, v in merged.__dict__.items() if k not in GRAPH_ATTRIBUTES}
+        )
+
     def _parallel_transform_step(
-        self, cache: CachedGraphTraversal, node, dataset_size: int, show_progress: bool
+        self,
+        cache: CachedGraphTraversal,
+        node,
+        elements: List[int],
+        show_progress: bool,
+        executor: ProcessPoolExecutor,
     ):
+        """Transform the run-to-failure cycles in batches using the process pool
+
+        At most two batches per worker are pending, so the memory used by
+        the cycles in flight is bounded.
+        """
+        n_workers = self._number_of_workers(len(elements))
+        batch_size = self.batch_size
+        if batch_size is None:
+            batch_size = math.ceil(len(elements) / (4 * n_workers))
+        batches = (
+            elements[start : start + batch_size]
+            for start in range(0, len(elements), batch_size)
+        )
+        worker_node = detached(node)
+        bar = None
         if show_progress:
-            bar = tqdm(range(dataset_size))
+            bar = tqdm(total=len(elements))
             bar.set_description(node.name)
-        else:
-            bar = range(dataset_size)
-
-        producers = []
 
-        queue = JoinableQueue(dataset_size)
-        for dataset_element in range(dataset_size):
-            old_element = cache.state_up_to(
-                node,
-                dataset_element,
-            )
-            producers.append(
-                Process(
-                    target=_transform, args=(node, old_element, dataset_element, queue)
-                )
-            )
-        for p in producers:
-            p.start()
-
-        for _ in bar:
-            dataset_element, new_element = queue.get()
-            queue.task_done()
-            self._update_step(cache, node, dataset_element, new_element)
-        cache.remove_state(node)
-        for p in producers:
-            p.join()
-        queue.join()
+        pending = {}
+        try:
+            while True:
+                while len(pending) < 2 * n_workers:
+                    batch = next(batches, None)
+                    if batch is None:
+                        break
+                    old_elements = [
+                        cache.state_up_to(node, dataset_element)
+                        for dataset_element in batch
+                    ]
+                    future = executor.submit(
+                        _transform_batch, worker_node, old_elements
+                    )
+                    pending[future] = batch
+                if len(pending) == 0:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch = pending.pop(future)
+                    for dataset_element, new_element in zip(batch, future.result()):
+                        self._update_step(cache, node, dataset_element, new_element)
+                    if bar is not None:
+                        bar.update(len(batch))
+        except Exception as e:
+            logger.error(f"There was an error when transforming with {node.name}")
+            raise
+        finally:
+            if bar is not None:
+                bar.close()
 
     def _transform_step(
-        self, cache: CachedGraphTraversal, node, dataset_size: int, show_progress: bool
+        self,
+        cache: CachedGraphTraversal,
+        node,
+        elements: List[int],
+        show_progress: bool,
     ):
         if show_progress:
-            bar = tqdm(range(dataset_size))
+            bar = tqdm(elements)
             bar.set_description(node.name)
         else:
-            bar = range(dataset_size)
+            bar = elements
         try:
             for dataset_element in bar:
                 old_element = cache.state_up_to(node, dataset_element)
@@ -137,6 +754,52 @@ class CachedPipelineRunner:
             logger.error(f"There was an error when transforming with {node.name}")
             raise
 
+    def _array_output_of(self, node, life: pd.DataFrame, outputs: dict):
+        """Transform a run-to-failure cycle up to node in array mode
+
+        The steps that declare an array kernel receive the values of the
+        cycle and its columns. The rest of the steps, and the steps with
+        several inputs, receive a DataFrame
+        """
+        if node in outputs:
+            return outputs[node]
+        if len(node.previous) == 0:
+            X = life
+        elif len(node.previous) == 1:
+            X = self._array_output_of(node.previous[0], life, outputs)
+        else:
+            X = [
+                _as_pandas(self._array_output_of(p, life, outputs))
+                for p in node.previous
+            ]
+        if getattr(node, "array_kernel", False) and not isinstance(X, list):
+            if isinstance(X, pd.DataFrame):
+                X = LifeArray.from_pandas(X) or X
+            if isinstance(X, LifeArray):
+                values, columns = node.transform_array(X.values, X.columns)
+                outputs[node] = LifeArray(values, columns, X.index)
+                return outputs[node]
+        outputs[node] = node.transform(_as_pandas(X))
+        return outputs[node]
+
+    def transform_array(self, life: pd.DataFrame) -> np.ndarray:
+        """Transform a run-to-failure cycle in array mode
+
+        The intermediate results are not stored in the traversal cache
+
+        Parameters:
+
+            life: A run-to-failure cycle
+
+        Returns:
+
+            X: The values of the transformed cycle
+        """
+        output = self._array_output_of(self._execution_graph(), life, {})
+        if isinstance(output, (LifeArray, pd.DataFrame)):
+            return output.values
+        return np.asarray(output)
+
     def transform(self, df: Union[pd.DataFrame, Iterable[pd.DataFrame]]):
         if isinstance(df, pd.DataFrame):
             return self._run([df], fit=False)
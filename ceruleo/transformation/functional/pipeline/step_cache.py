@@ -0,0 +1,365 @@
+"""Persistent cache of fitted steps and transformed run-to-failure cycles
+
+The entries are content-addressed. The key of a step is a hash of its
+class, its parameters, the keys of its previous steps and the identity of
+the dataset used to fit it. The key of a transformed cycle combines the key
+of the step with a hash of the cycle. Since the keys only depend on the
+content, the entries can be shared between processes and sessions.
+"""
+import hashlib
+import logging
+import os
+import pickle
+import threading
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+import joblib
+import pandas as pd
+from ceruleo import CACHE_PATH
+from ceruleo.transformation.functional.mixin import TransformerStepMixin
+
+logger = logging.getLogger(__name__)
+
+# Attributes that tie a step to the graph it belongs to
+GRAPH_ATTRIBUTES = ("previous", "next", "uuid")
+
+
+def _hash(*values) -> str:
+    h = hashlib.sha1()
+    for v in values:
+        h.update(str(v).encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def life_fingerprint(life: Any) -> str:
+    """Hash of the content of a run-to-failure cycle
+
+    Parameters:
+
+        life: A run-to-failure cycle
+
+    Returns:
+
+        key: Hash of the cycle
+    """
+    if isinstance(life, pd.DataFrame):
+        try:
+            return _hash(
+                joblib.hash(list(life.columns)),
+                joblib.hash([str(d) for d in life.dtypes]),
+                joblib.hash(pd.util.hash_pandas_object(life, index=True).values),
+            )
+        except TypeError:
+            pass
+    return joblib.hash(life)
+
+
+def dataset_fingerprint(life_keys: Iterable[str]) -> str:
+    """Hash of a dataset given the hashes of its cycles"""
+    return _hash(*life_keys)
+
+
+def _param_fingerprint(value: Any) -> str:
+    from ceruleo.transformation.functional.pipeline.pipeline import Pipeline
+
+    if isinstance(value, Pipeline):
+        value = value.final_step
+    if isinstance(value, TransformerStepMixin):
+        key = step_fingerprint(value, "")
+        if key is None:
+            raise TypeError(f"{value.name} can not be hashed")
+        return key
+    if isinstance(value, (list, tuple)):
+        return _hash(type(value).__name__, *[_param_fingerprint(v) for v in value])
+    if isinstance(value, dict):
+        return _hash(
+            *[
+                f"{k}:{_param_fingerprint(v)}"
+                for k, v in sorted(value.items(), key=lambda item: str(item[0]))
+            ]
+        )
+    return joblib.hash(value)
+
+
+def params_fingerprint(node: TransformerStepMixin) -> Optional[str]:
+    """Hash of the parameters of a step
+
+    Parameters:
+
+        node: The step
+
+    Returns:
+
+        key: Hash of the parameters. None if they can not be hashed
+    """
+    try:
+        params = node.get_params(deep=False)
+        return _hash(
+            *[f"{k}:{_param_fingerprint(v)}" for k, v in sorted(params.items())]
+        )
+    except Exception:
+        return None
+
+
+def step_fingerprint(
+    node: TransformerStepMixin, data_key: str, memo: Optional[Dict] = None
+) -> Optional[str]:
+    """Hash of a step, its upstream subgraph and the data that reaches it
+
+    Parameters:
+
+        node: The step
+        data_key: Hash of the dataset used to fit the graph
+        memo: Keys already computed
+
+    Returns:
+
+        key: Hash of the step. None if its parameters, or the
+             parameters of a previous step, can not be hashed
+    """
+    if memo is None:
+        memo = {}
+    if node in memo:
+        return memo[node]
+    params_key = params_fingerprint(node)
+    if params_key is None:
+        key = None
+    else:
+        if len(node.previous) == 0:
+            upstream = [data_key]
+        else:
+            upstream = [step_fingerprint(p, data_key, memo) for p in node.previous]
+        if any(u is None for u in upstream):
+            key = None
+        else:
+            key = _hash(
+                type(node).__module__, type(node).__qualname__, params_key, *upstream
+            )
+    memo[node] = key
+    return key
+
+
+def step_state(node: TransformerStepMixin) -> Optional[dict]:
+    """Attributes of a step that are not related to the graph
+
+    The attributes excluded from its pickled state are not included
+
+    Parameters:
+
+        node: The step
+
+    Returns:
+
+        state: The attributes of the step. None when it references other
+               steps, since its state can not be separated from the graph
+    """
+    from ceruleo.transformation.functional.pipeline.pipeline import Pipeline
+
+    state = {
+        k: v for k, v in node.__getstate__().items() if k not in GRAPH_ATTRIBUTES
+    }
+    if any(isinstance(v, (TransformerStepMixin, Pipeline)) for v in state.values()):
+        return None
+    return state
+
+
+class StepCache:
+    """Persistent content-addressed cache of fitted steps and transformed cycles
+
+    Each entry is a pickle file under cache_path. Files are written atomically,
+    so several processes can share the same cache. When the cache grows
+    beyond max_bytes, the least recently used entries are removed.
+
+    Parameters:
+
+        cache_path: Directory of the cache
+        max_bytes: Maximum size in bytes of the cache. None for no limit
+    """
+
+    def __init__(
+        self,
+        cache_path: Path = CACHE_PATH / "StepCache",
+        max_bytes: Optional[int] = None,
+    ):
+        self.cache_path = Path(cache_path)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._index = None
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return {"cache_path": self.cache_path, "max_bytes": self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _path(self, kind: str, key: str) -> Path:
+        return self.cache_path / kind / key[:2] / f"{key}.pkl"
+
+    def _files(self) -> List[Path]:
+        return list(self.cache_path.glob("*/*/*.pkl"))
+
+    def _entries(self) -> "OrderedDict[Path, int]":
+        """Size of each entry, from the least to the most recently used
+
+        Built from the files of the cache the first time it is needed, and
+        updated by the reads and writes of this instance. The entries
+        written by other processes are added when they are read
+        """
+        if self._index is None:
+            sizes = {}
+            mtimes = {}
+            for f in self._files():
+                try:
+                    stat = f.stat()
+                except FileNotFoundError:
+                    continue
+                sizes[f] = stat.st_size
+                mtimes[f] = stat.st_mtime
+            self._index = OrderedDict(
+                (f, sizes[f]) for f in sorted(sizes, key=mtimes.get)
+            )
+            self._nbytes = sum(sizes.values())
+        return self._index
+
+    def _tracked(self) -> bool:
+        """Whether the reads and writes must update the index of entries"""
+        return self.max_bytes is not None or self._index is not None
+
+    def _touch(self, path: Path, size: Optional[int] = None):
+        entries = self._entries()
+        if path in entries:
+            if size is None:
+                entries.move_to_end(path)
+                return
+            self._nbytes -= entries.pop(path)
+        elif size is None:
+            size = self._file_size(path)
+        entries[path] = size
+        self._nbytes += size
+
+    @property
+    def nbytes(self) -> int:
+        with self._lock:
+            self._entries()
+            return self._nbytes
+
+    @staticmethod
+    def _file_size(path: Path) -> int:
+        try:
+            return path.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def _read(self, path: Path) -> Any:
+        try:
+            with open(path, "rb") as file:
+                value = pickle.load(file)
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except (EOFError, pickle.UnpicklingError):
+            logger.warning(f"Corrupted entry {path} in the step cache")
+            self.misses += 1
+            return None
+        self.hits += 1
+        if self._tracked():
+            with self._lock:
+                self._touch(path)
+        return value
+
+    def _write(self, path: Path, value: Any):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, "wb") as file:
+            pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        if not self._tracked():
+            return
+        with self._lock:
+            self._touch(path, self._file_size(path))
+            if self.max_bytes is not None and self._nbytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Remove the least recently used entries until the cache fits in max_bytes"""
+        entries = self._entries()
+        while self._nbytes > self.max_bytes and len(entries) > 0:
+            f, size = entries.popitem(last=False)
+            try:
+                f.unlink()
+            except FileNotFoundError:
+                pass
+            self._nbytes -= size
+
+    def load_step(self, node: TransformerStepMixin, key: str) -> bool:
+        """Restore the fitted state of a step
+
+        Parameters:
+
+            node: Step to restore
+            key: Key of the step
+
+        Returns:
+
+            found: Whether the step was found in the cache
+        """
+        state = self._read(self._path("steps", key))
+        if state is None:
+            return False
+        node.__dict__.update(state)
+        return True
+
+    def store_step(self, node: TransformerStepMixin, key: str):
+        """Store the fitted state of a step
+
+        Steps that keep references to other steps, such as the ones
+        that modify the graph when fitted, are not stored
+
+        Parameters:
+
+            node: Fitted step
+            key: Key of the step
+        """
+        state = step_state(node)
+        if state is not None:
+            self._write(self._path("steps", key), state)
+
+    def get_output(self, key: str, life_key: str) -> Any:
+        """Obtain a cycle transformed by a step
+
+        Parameters:
+
+            key: Key of the step
+            life_key: Key of the cycle
+
+        Returns:
+
+            output: The transformed cycle, None if it is not in the cache
+        """
+        return self._read(self._path("outputs", _hash(key, life_key)))
+
+    def store_output(self, key: str, life_key: str, value: Any):
+        """Store a cycle transformed by a step
+
+        Parameters:
+
+            key: Key of the step
+            life_key: Key of the cycle
+            value: The transformed cycle
+        """
+        self._write(self._path("outputs", _hash(key, life_key)), value)
+
+    def clear(self):
+        with self._lock:
+            for f in self._files():
+                f.unlink()
+            self._index = OrderedDict()
+            self._nbytes = 0
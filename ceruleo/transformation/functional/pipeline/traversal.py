@@ -1,12 +1,12 @@
+import threading
 from pathlib import Path
 from typing import List, Optional, Union
 
 import pandas as pd
 from ceruleo import CACHE_PATH
 from ceruleo.transformation.functional.pipeline.cache_store import (
-    CacheStoreType, GraphTraversalCacheMemory, GraphTraversalCacheShelveStore)
-from ceruleo.transformation.functional.pipeline.utils import (decode_tuple,
-                                                              encode_tuple)
+    CacheStoreType, GraphTraversalCacheArrowStore, GraphTraversalCacheMemory,
+    GraphTraversalCacheShelveStore)
 from ceruleo.transformation.functional.transformerstep import TransformerStep
 
 
@@ -23,6 +23,13 @@ class CachedGraphTraversal:
         A list with each element of the dataset transformed in
         up to n.previous[0]
 
+    The keys of the store are the tuples (n, n.previous[i], dataset_element),
+    and the store keeps one bucket of keys per node.
+
+    The states are released as soon as the node consuming them transforms
+    them. The access to the store is guarded by a lock, so nodes of
+    independent branches can be processed from different threads.
+
 
     Parameters:
         
@@ -43,10 +50,21 @@ class CachedGraphTraversal:
             self.transformed_cache = GraphTraversalCacheShelveStore(cache_path)
         elif cache_type == CacheStoreType.MEMORY:
             self.transformed_cache = GraphTraversalCacheMemory()
+        elif cache_type == CacheStoreType.ARROW:
+            self.transformed_cache = GraphTraversalCacheArrowStore(cache_path)
+        elif cache_type == CacheStoreType.ARROW_LZ4:
+            self.transformed_cache = GraphTraversalCacheArrowStore(
+                cache_path, compression="lz4"
+            )
+        elif cache_type == CacheStoreType.ARROW_ZSTD:
+            self.transformed_cache = GraphTraversalCacheArrowStore(
+                cache_path, compression="zstd"
+            )
+        self.lock = threading.RLock()
 
         for r in root_nodes:
             for i, df in enumerate(dataset):
-                self.transformed_cache[encode_tuple((r, None, i))] = df
+                self.transformed_cache[(r, None, i)] = df
 
     def __enter__(self):
         return self
@@ -55,34 +73,36 @@ class CachedGraphTraversal:
         self.transformed_cache.close()
 
     def clear_cache(self):
-        self.transformed_cache.claer()
+        self.transformed_cache.reset()
 
     def state_up_to(self, current_node: TransformerStep, dataset_element: int):
 
         previous_node = current_node.previous
 
-        if len(previous_node) > 1:
-            return [
-                self.transformed_cache[encode_tuple((current_node, p, dataset_element))]
-                for p in previous_node
-            ]
-        else:
-            if len(previous_node) == 1:
-                previous_node = previous_node[0]
+        with self.lock:
+            if len(previous_node) > 1:
+                return [
+                    self.transformed_cache[(current_node, p, dataset_element)]
+                    for p in previous_node
+                ]
             else:
-                previous_node = None
+                if len(previous_node) == 1:
+                    previous_node = previous_node[0]
+                else:
+                    previous_node = None
 
-            return self.transformed_cache[
-                encode_tuple((current_node, previous_node, dataset_element))
-            ]
+                return self.transformed_cache[
+                    (current_node, previous_node, dataset_element)
+                ]
 
     def clean_state_up_to(self, current_node: TransformerStep, dataset_element: int):
 
         previous_node = current_node.previous
-        for p in previous_node:
-            self.transformed_cache[
-                encode_tuple((current_node, p, dataset_element))
-            ] = None
+        if len(previous_node) == 0:
+            previous_node = [None]
+        with self.lock:
+            for p in previous_node:
+                self.transformed_cache.pop((current_node, p, dataset_element))
 
     def store(
         self,
@@ -91,21 +111,18 @@ class CachedGraphTraversal:
         dataset_element: int,
         new_element: pd.DataFrame,
     ):
-        self.transformed_cache[
-            encode_tuple((next_node, node, dataset_element))
-        ] = new_element
+        with self.lock:
+            self.transformed_cache[(next_node, node, dataset_element)] = new_element
 
     def remove_state(self, nodes: Union[TransformerStep, List[TransformerStep]]):
         if not isinstance(nodes, list):
             nodes = [nodes]
-        for n in nodes:
-            keys_to_remove = self.get_keys_of(n)
-            for k in keys_to_remove:
-                self.transformed_cache.pop(k)
+        with self.lock:
+            for n in nodes:
+                keys_to_remove = self.get_keys_of(n)
+                for k in keys_to_remove:
+                    self.transformed_cache.pop(k)
 
     def get_keys_of(self, n):
-        return [
-            k
-            for k in self.transformed_cache.keys()
-            if decode_tuple(k)[0] == str(hash(n))
-        ]
+        with self.lock:
+            return self.transformed_cache.keys_of(n)
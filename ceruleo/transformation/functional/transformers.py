@@ -19,6 +19,7 @@ from sklearn.utils.validation import check_is_fitted
 from ceruleo.transformation.functional.graph_utils import topological_sort_iterator
 from ceruleo.transformation.functional.pipeline.cache_store import CacheStoreType
 from ceruleo.transformation.functional.pipeline.pipeline import Pipeline
+from ceruleo.transformation.functional.pipeline.step_cache import StepCache
 from ceruleo.transformation.functional.transformerstep import TransformerStep
 
 logger = logging.getLogger(__name__)
@@ -63,6 +64,14 @@ class Transformer:
         pipelineY: Pipeline that will be applied to the target.
         pipelineMetadata: Pipeline that will be used to extract additional
                             data from the lives information, by default None
+        cache_type: Cache storage mode of the pipelines built from steps
+        n_jobs: Number of processes used by the pipelines built from steps
+        step_cache: Persistent cache used by the pipelines built from steps
+        fuse_steps: Wether the pipelines built from steps fuse the chains
+                    of elementwise steps
+        array_mode: Wether transformX returns the values of the transformed
+                    cycle as an array, computed by the array kernels of
+                    the steps when available
     """
 
     def __init__(
@@ -71,25 +80,42 @@ class Transformer:
         pipelineY: Optional[Union[Pipeline, TransformerStep]] = None,
         pipelineMetadata: Optional[Union[Pipeline, TransformerStep]] = None,
         cache_type: CacheStoreType = CacheStoreType.MEMORY,
+        n_jobs: int = 1,
+        step_cache: Optional[StepCache] = None,
+        fuse_steps: bool = False,
+        array_mode: bool = False,
     ):
-        def ensure_pipeline(x, cache_type: CacheStoreType):
-            if isinstance(x, Pipeline):
-                return x
-            return Pipeline(x, cache_type=cache_type)
         self.cache_type = cache_type
-        self.pipelineX = ensure_pipeline(pipelineX, cache_type)
-        if pipelineY is not None:
-            self.pipelineY = ensure_pipeline(pipelineY, cache_type)
-        else:
-            self.pipelineY = None
-        self.pipelineMetadata = (
-            ensure_pipeline(pipelineMetadata, cache_type)
-            if pipelineMetadata is not None
-            else None
-        )
+        self.n_jobs = n_jobs
+        self.step_cache = step_cache
+        self.fuse_steps = fuse_steps
+        self.array_mode = array_mode
+        self.pipelineX = self._ensure_pipeline(pipelineX)
+        self.pipelineY = self._ensure_pipeline(pipelineY)
+        self.pipelineMetadata = self._ensure_pipeline(pipelineMetadata)
         self.features = None
         self.fitted_ = False
 
+    def _ensure_pipeline(
+        self, x: Optional[Union[Pipeline, TransformerStep]]
+    ) -> Optional[Pipeline]:
+        if x is None or isinstance(x, Pipeline):
+            return x
+        return Pipeline(
+            x,
+            cache_type=self.cache_type,
+            n_jobs=self.n_jobs,
+            step_cache=self.step_cache,
+            fuse_steps=self.fuse_steps,
+        )
+
+    def _pipelines(self) -> List[Pipeline]:
+        return [
+            p
+            for p in [self.pipelineX, self.pipelineY, self.pipelineMetadata]
+            if p is not None
+        ]
+
     def _process_selected_features(self):
         if self.pipelineX["selector"] is not None:
             selected_columns = self.pipelineX["selector"].get_support(indices=True)
@@ -98,7 +124,7 @@ class Transformer:
     def clone(self):
         return copy.deepcopy(self)
 
-    def fit(self, dataset, show_progress: bool = False):
+    def fit(self, dataset, show_progress: bool = False, streaming: bool = False):
         """Fit the transformer with a given dataset.
 
         The transformer will fit the X transformer,
@@ -106,16 +132,38 @@ class Transformer:
 
         Parameters:
             dataset:
+            show_progress: Wether to show the progress when fitting
+            streaming: Wether to fit the pipelines without storing the
+                       intermediate transformations of the dataset
 
         """
         logger.debug("Fitting Transformer")
 
-        self.pipelineX.fit(dataset, show_progress=show_progress)
+        self.pipelineX.fit(dataset, show_progress=show_progress, streaming=streaming)
         if self.pipelineY is not None:
-            self.pipelineY.fit(dataset, show_progress=show_progress)
+            self.pipelineY.fit(
+                dataset, show_progress=show_progress, streaming=streaming
+            )
         if self.pipelineMetadata is not None:
-            self.pipelineMetadata.fit(dataset)
+            self.pipelineMetadata.fit(dataset, streaming=streaming)
 
+        return self._fitted(dataset)
+
+    def refit(self, dataset, show_progress: bool = False):
+        """Fit again only the steps modified since the last fit
+
+        Parameters:
+            dataset: The dataset used to fit the transformer
+            show_progress: Wether to show the progress when fitting
+        """
+        self.pipelineX.refit(dataset, show_progress=show_progress)
+        if self.pipelineY is not None:
+            self.pipelineY.refit(dataset, show_progress=show_progress)
+        if self.pipelineMetadata is not None:
+            self.pipelineMetadata.refit(dataset)
+        return self._fitted(dataset)
+
+    def _fitted(self, dataset):
         if not isinstance(dataset, pd.DataFrame):
             self.minimal_df = dataset[0].head(n=20)
         else:
@@ -182,6 +230,8 @@ class Transformer:
 
             t: Input data transformed
         """
+        if self.array_mode:
+            return self.pipelineX.transform_array(life)
         return self.pipelineX.transform(life)
 
     def columns(self) -> List[str]:
@@ -222,6 +272,10 @@ class Transformer:
             "pipelineY": self.pipelineY,
             "pipelineMetadata": self.pipelineMetadata,
             "cache_type": self.cache_type,
+            "n_jobs": self.n_jobs,
+            "step_cache": self.step_cache,
+            "fuse_steps": self.fuse_steps,
+            "array_mode": self.array_mode,
         }
         if deep:
             paramsX = self.pipelineX.get_params(deep)
@@ -234,17 +288,43 @@ class Transformer:
         return params
 
     def set_params(self, **params):
+        """Set the parameters of the transformer or of its pipelines
+
+        The parameters of the pipelines are given as pipeline_X__{parameter}
+        and pipeline_Y__{parameter}. cache_type, n_jobs, step_cache and
+        fuse_steps are also set in every pipeline of the transformer,
+        and through them in their runners.
+
+        Raises:
+
+            ValueError: If a parameter is not a parameter of the transformer
+        """
+        valid_params = self.get_params()
         pipeline_X_params = {}
         pipeline_Y_params = {}
+        pipelines_params = {}
         for k in params.keys():
-            if k.starts_with("pipeline_X__"):
+            if k.startswith("pipeline_X__"):
                 new_key = "__".join(k.split("__")[1:])
                 pipeline_X_params[new_key] = params[k]
-            elif k.starts_with("pipeline_Y__"):
+            elif k.startswith("pipeline_Y__"):
                 new_key = "__".join(k.split("__")[1:])
                 pipeline_Y_params[new_key] = params[k]
-        self.pipelineX = self.pipelineX.set_params(pipeline_X_params)
-        self.pipelineY = self.pipelineY.set_params(pipeline_Y_params)
+            elif k in valid_params:
+                setattr(self, k, params[k])
+                if k in ("cache_type", "n_jobs", "step_cache", "fuse_steps"):
+                    pipelines_params[k] = params[k]
+            else:
+                raise ValueError(f"Invalid parameter {k} for transformer")
+        self.pipelineX = self._ensure_pipeline(self.pipelineX)
+        self.pipelineY = self._ensure_pipeline(self.pipelineY)
+        self.pipelineMetadata = self._ensure_pipeline(self.pipelineMetadata)
+        if len(pipelines_params) > 0:
+            for pipeline in self._pipelines():
+                pipeline.set_params(**pipelines_params)
+        self.pipelineX = self.pipelineX.set_params(**pipeline_X_params)
+        if self.pipelineY is not None:
+            self.pipelineY = self.pipelineY.set_params(**pipeline_Y_params)
         return self
 
 
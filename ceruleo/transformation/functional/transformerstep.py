@@ -4,8 +4,9 @@ The pipeline will use the steps to fit and transform the run-to-failure
 cycles
 """
 from copy import copy
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
+import numpy as np
 import pandas as pd
 from ceruleo.transformation.functional.mixin import TransformerStepMixin
 from sklearn.base import TransformerMixin
@@ -15,6 +16,106 @@ class TransformerStep(TransformerStepMixin, TransformerMixin):
     """Base class of all transformation step
 
     """
+    # Whether the step implements transform_array
+    array_kernel = False
+
+    def transform_array(
+        self, X: np.ndarray, columns: pd.Index
+    ) -> Tuple[np.ndarray, pd.Index]:
+        """Transform a run-to-failure cycle represented as an array
+
+        Only used when array_kernel is True. The rows of the
+        cycle must be preserved
+
+        Parameters:
+
+            X: Values of the run-to-failure cycle
+            columns: Names of the columns of X
+
+        Returns:
+            The transformed values and the names of their columns
+        """
+        raise NotImplementedError
+
+    # Whether the step transforms each value independently of the rest
+    elementwise = False
+
+    def elementwise_operations(self, columns: pd.Index) -> List[Tuple]:
+        """Operations applied by the step to each value
+
+        Only used when elementwise is True. Consecutive elementwise steps
+        are fused in a single pass over the data
+
+        Parameters:
+
+            columns: Names of the columns of the run-to-failure cycle
+
+        Returns:
+            List of (Operation, a, b) tuples, where a and b are the
+            parameters of the operation, scalars or one value per column
+        """
+        raise NotImplementedError
+
+    # Whether the step implements update. Elementwise steps are always online.
+    # The state kept by update between the chunks of a run-to-failure cycle
+    # is stored in _online_state
+    online = False
+
+    def update(self, X: pd.DataFrame) -> pd.DataFrame:
+        """Transform the next rows of a run-to-failure cycle received in chunks
+
+        Only used when online is True. The step keeps the state it needs
+        from the previous rows, so the result is the same as the last rows
+        of the transformation of the complete cycle. The default
+        implementation is valid for steps that transform each row
+        independently of the rest
+
+        Parameters:
+
+            X: The next rows of the run-to-failure cycle
+
+        Returns:
+            The transformed rows
+        """
+        return self.transform(X)
+
+    def reset_online(self):
+        """Discard the state kept by update to start a new run-to-failure cycle"""
+        self._online_state = None
+
+    # Whether the step implements merge
+    mergeable = False
+
+    def merge(self, other: "TransformerStep") -> "TransformerStep":
+        """Combine the state fitted by other in this step
+
+        Only used when mergeable is True. The runner partial fits copies
+        of the step with disjoint, consecutive subsets of the run-to-failure
+        cycles in parallel, and merges them in order. Merging the step
+        fitted with the first cycles and the step fitted with the following
+        ones must give the same state as partial fitting the step with all
+        of them
+
+        Parameters:
+
+            other: The same step, partial fitted with the cycles that
+                   follow the ones used to fit this step
+
+        Returns:
+            TransformerStep: The same step
+        """
+        raise NotImplementedError
+
+    # Attributes that only memoize results or hold resources, such as
+    # workers. They are not pickled nor stored in the step cache
+    cache_attributes = ()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for k in self.cache_attributes:
+            state.pop(k, None)
+        return state
+
     def partial_fit(self, X:pd.DataFrame, y=None) -> "TransformerStep":
         """Fit a single run-to-failure cycle
 
@@ -1,10 +1,20 @@
-from concurrent.futures import ProcessPoolExecutor
-from typing import List, Optional, Union
+import multiprocessing
+import shutil
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Union
 
 import numpy as np
 import pandas as pd
+from ceruleo import CACHE_PATH
 from ceruleo.transformation import TransformerStep
-from ceruleo.transformation.features.tdigest import TDigest
+from ceruleo.transformation.features.tdigest import (
+    TDigest,
+    merge_columns,
+    merge_digests,
+)
+from numba import jit
 from sklearn.pipeline import FeatureUnion, _transform_one
 
 
@@ -15,7 +25,7 @@ class PandasToNumpy(TransformerStep):
 
 class TransformerLambda(TransformerStep):
     def __init__(self, f, name: Optional[str] = None):
-        super().__init__(name)
+        super().__init__(name=name)
         self.f = f
 
     def transform(self, X, y=None):
@@ -87,48 +97,252 @@ def build_tdigest(tdigest, values, column):
     return column, tdigest.merge_sorted(values)
 
 
+def _digest_worker(connection, tdigest_size: int):
+    """Keep the digests of a subset of the columns in a worker process"""
+    digests = {}
+    while True:
+        message = connection.recv()
+        if message[0] == "update":
+            _, columns, values = message
+            current = [digests.get(c, TDigest(tdigest_size)) for c in columns]
+            digests.update(zip(columns, merge_columns(current, values, parallel=False)))
+        elif message[0] == "load":
+            digests.update(message[1])
+        elif message[0] == "digests":
+            connection.send(digests)
+        else:
+            connection.close()
+            return
+
+
+class DigestPool:
+    """Workers that keep the digests of the columns between updates
+
+    Each column is assigned to a worker the first time it is seen, and
+    its digest stays in that worker. Updating only sends the values of
+    the columns to the workers. With the thread backend the digests are
+    updated in threads of the current process, which run in parallel
+    since the digest kernels release the GIL. The process backend starts
+    the workers with spawn, so the main module of the program must be
+    importable without side effects.
+
+    The pool must be closed with close when it is no longer needed.
+
+    Parameters:
+
+        tdigest_size: Size of the digests
+        max_workers: Number of workers
+        backend: 'thread' or 'process'
+    """
+
+    def __init__(self, tdigest_size: int, max_workers: int, backend: str = "thread"):
+        if backend not in ("thread", "process"):
+            raise ValueError(f"Invalid backend {backend}. Valids are thread and process")
+        self.tdigest_size = tdigest_size
+        self.max_workers = max_workers
+        self.backend = backend
+        self._worker_of = {}
+        if backend == "thread":
+            # One thread per worker keeps the updates of each column in order
+            self._executors = [ThreadPoolExecutor(1) for _ in range(max_workers)]
+            self._digests = {}
+            self._pending = []
+        else:
+            self._connections = []
+            self._processes = []
+            # Forking a process that already started the numba threads is not safe
+            context = multiprocessing.get_context("spawn")
+            for _ in range(max_workers):
+                parent, child = context.Pipe()
+                process = context.Process(
+                    target=_digest_worker, args=(child, tdigest_size), daemon=True
+                )
+                process.start()
+                self._connections.append(parent)
+                self._processes.append(process)
+
+    def _shards(self, columns: List) -> Dict[int, List[int]]:
+        shards = {}
+        for i, c in enumerate(columns):
+            if c not in self._worker_of:
+                self._worker_of[c] = len(self._worker_of) % self.max_workers
+            shards.setdefault(self._worker_of[c], []).append(i)
+        return shards
+
+    def _merge_shard(self, columns: List, values: np.ndarray):
+        current = [self._digests.get(c, TDigest(self.tdigest_size)) for c in columns]
+        self._digests.update(
+            zip(columns, merge_columns(current, values, parallel=False))
+        )
+
+    def update(self, columns: List, values: np.ndarray):
+        """Merge the values of each column in its digest
+
+        The update is asynchronous, it is completed before the digests are read
+
+        Parameters:
+
+            columns: Names of the columns
+            values: Array of shape (rows, columns)
+        """
+        for worker, positions in self._shards(list(columns)).items():
+            shard_columns = [columns[i] for i in positions]
+            shard_values = np.ascontiguousarray(values[:, positions])
+            if self.backend == "thread":
+                self._pending.append(
+                    self._executors[worker].submit(
+                        self._merge_shard, shard_columns, shard_values
+                    )
+                )
+            else:
+                self._connections[worker].send(("update", shard_columns, shard_values))
+
+    def load(self, digests: Dict):
+        """Start from the given digest of each column
+
+        Parameters:
+
+            digests: Digest of each column
+        """
+        columns = list(digests.keys())
+        for worker, positions in self._shards(columns).items():
+            shard = {columns[i]: digests[columns[i]] for i in positions}
+            if self.backend == "thread":
+                self._digests.update(shard)
+            else:
+                self._connections[worker].send(("load", shard))
+
+    def digests(self) -> Dict:
+        """Digest of each column, after all the updates were merged"""
+        if self.backend == "thread":
+            for future in self._pending:
+                future.result()
+            self._pending = []
+            digests = self._digests
+        else:
+            digests = {}
+            for connection in self._connections:
+                connection.send(("digests",))
+            for connection in self._connections:
+                digests.update(connection.recv())
+        # In the order in which the columns were first seen
+        return {c: digests[c] for c in self._worker_of if c in digests}
+
+    def close(self):
+        """Stop the workers"""
+        if self.backend == "thread":
+            for executor in self._executors:
+                executor.shutdown()
+            return
+        for connection, process in zip(self._connections, self._processes):
+            connection.send(("close",))
+            process.join()
+            connection.close()
+        self._connections = []
+        self._processes = []
+
+
 class QuantileEstimator:
     """Approximate the quantile of each feature in the dataframe
        using t-digest
+
+    With max_workers greater than 1 the digests are kept in a DigestPool,
+    started on the first update, and the values of each cycle are sent
+    to the workers. The pool is stopped with close, or when the estimator
+    is pickled, and started again on the next update.
+
+    Parameters:
+
+        tdigest_size: Size of the digest of each feature
+        max_workers: Number of workers
+        subsample: Number of points, or proportion, sampled from each cycle
+        backend: 'thread' or 'process', the kind of workers of the pool
     """
-    def __init__(self, tdigest_size:int = 200, max_workers:int = 1, subsample:Optional[Union[int, float]] = None):
+    def __init__(
+        self,
+        tdigest_size: int = 200,
+        max_workers: int = 1,
+        subsample: Optional[Union[int, float]] = None,
+        backend: str = "thread",
+    ):
         self.tdigest_dict = None
         self.tdigest_size = tdigest_size
         self.max_workers = max_workers
         self.subsample = subsample
+        self.backend = backend
+        self._pool = None
+
+    def __getstate__(self):
+        self._sync()
+        state = self.__dict__.copy()
+        state["_pool"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._pool = None
 
     def update(self, X: pd.DataFrame):
         if X.shape[0] < 2:
             return self
 
-        columns = X.columns
-        
-        if self.tdigest_dict is None:
-            self.tdigest_dict = {c: TDigest(self.tdigest_size) for c in columns}
+        values = X.values
+        if self.subsample is not None:
+            if isinstance(self.subsample, int):
+                points_to_sample = self.subsample
+            else:
+                points_to_sample = self.subsample * X.shape[0]
+            step = max(int(X.shape[0] / float(points_to_sample)), 1)
+            values = values[::step]
+
+        if self.max_workers <= 1:
+            if self.tdigest_dict is None:
+                self.tdigest_dict = {c: TDigest(self.tdigest_size) for c in X.columns}
+            digests = merge_columns(
+                [self.tdigest_dict.get(c, TDigest(self.tdigest_size)) for c in X.columns],
+                values,
+            )
+            self.tdigest_dict.update(zip(X.columns, digests))
+            return self
 
-        
-        results = []
-        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
-            for i, c in enumerate(columns):
-
-                x = X.iloc[:, i].dropna()
-                if self.subsample is not None:
-
-                    if isinstance( self.subsample, int):
-                        points_to_sample = self.subsample
-                    else:
-                        points_to_sample = self.subsample * X.shape[0]
-                    step = max(int(X.shape[0] / float(points_to_sample)), 1)
-                    x = x.iloc[::step]
-                x = x.sort_values().values
-                t_digest = self.tdigest_dict[c]
-                results.append(executor.submit(build_tdigest, t_digest, x, c))
-
-        for r in results:
-            c, tdigest = r.result()
-            self.tdigest_dict[c] = tdigest
+        if getattr(self, "_pool", None) is None:
+            self._pool = DigestPool(self.tdigest_size, self.max_workers, self.backend)
+            if self.tdigest_dict is not None:
+                self._pool.load(self.tdigest_dict)
+        self._pool.update(list(X.columns), np.asarray(values, dtype=np.float64))
+        return self
+
+    def merge(self, other: "QuantileEstimator") -> "QuantileEstimator":
+        """Merge the digests of the features estimated by other
+
+        Parameters:
+
+            other: Estimator updated with other data
+        """
+        other._sync()
+        if other.tdigest_dict is None:
+            return self
+        self.close()
+        self.tdigest_dict = merge_digests(self.tdigest_dict, other.tdigest_dict)
         return self
 
+    def _sync(self):
+        if getattr(self, "_pool", None) is not None:
+            self.tdigest_dict = self._pool.digests()
+
+    def close(self):
+        """Stop the workers of the pool, keeping the digests"""
+        if getattr(self, "_pool", None) is not None:
+            self._sync()
+            self._pool.close()
+            self._pool = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
     def estimate_quantile(self, *args, **kwargs):
         return self.quantile(*args, **kwargs)
         
@@ -142,6 +356,7 @@ class QuantileEstimator:
         q:float
           The quantile to estimate
         feature:Optional[Str] """
+        self._sync()
         if feature is not None:
             return self.tdigest_dict[feature].estimate_quantile(q)
         else:
@@ -152,35 +367,253 @@ class QuantileEstimator:
                 }
             )
 
+@jit(nopython=True, nogil=True)
+def _histogram_pass(values, lo, hi, counts, mins, maxs):
+    """Count the finite values in each bin of [lo, hi], and the ones below lo
+
+    lo and hi must be finite. The minimum and maximum value of each bin
+    are kept, so the range of the next pass only contains the values of
+    the selected bins
+    """
+    n_bins = counts.shape[0]
+    scale = n_bins / (hi - lo)
+    below = 0
+    for v in values:
+        if np.isinf(v):
+            continue
+        if v < lo:
+            below += 1
+        elif v <= hi:
+            b = min(int((v - lo) * scale), n_bins - 1)
+            counts[b] += 1
+            if v < mins[b]:
+                mins[b] = v
+            if v > maxs[b]:
+                maxs[b] = v
+    return below
+
+
 class QuantileComputer:
-    """Approximate the quantile of each feature in the dataframe
-       using t-digest
+    """Compute the exact quantile of each feature in the dataframe
+
+    The values of each feature are appended as float32 to a file in
+    cache_path, so the memory used does not depend on the size of the
+    dataset. To select the value of a given rank, each pass over the
+    file counts the values in the bins of the current range, and the
+    range is narrowed to the bin that contains the rank. When the values
+    of the range fit in max_values_in_memory they are loaded and sorted.
+    The quantiles are interpolated linearly between the float32 values,
+    as pandas does.
+
+    Infinite values are not stored, only counted, so the range of the
+    passes is always finite.
+
+    The files are removed with close, or when the computer is deleted.
+    Copies of the computer, such as the pickled ones, keep the values of
+    the quantiles listed in quantiles, computed before copying, and can
+    not be updated. Neither can a closed computer, which only keeps the
+    quantiles already computed.
+
+    Parameters:
+
+        quantiles: Quantiles computed before copying the computer
+        max_values_in_memory: Maximum number of values of a feature
+                              loaded in memory at once
+        n_bins: Number of bins of each pass
+        cache_path: Directory where the values are stored
     """
-    def __init__(self, subsample_rate:float = 1):
-        self.values = None
-        self.tdigest_size = subsample_rate
+
+    def __init__(
+        self,
+        quantiles: Optional[List[float]] = None,
+        max_values_in_memory: int = 2**22,
+        n_bins: int = 4096,
+        cache_path: Path = CACHE_PATH,
+    ):
+        self.quantiles = list(quantiles) if quantiles is not None else []
+        self.max_values_in_memory = max_values_in_memory
+        self.n_bins = n_bins
+        self.cache_path = cache_path
+        self._path = None
+        self._owner = True
+        self._closed = False
+        self._files = {}
+        self._counts = {}
+        self._n_neg_inf = {}
+        self._n_pos_inf = {}
+        self._mins = {}
+        self._maxs = {}
+        self._memo = {}
+
+    def __getstate__(self):
+        if self._path is not None:
+            for q in self.quantiles:
+                self.quantile(q)
+        state = self.__dict__.copy()
+        state["_owner"] = False
+        return state
 
     def update(self, X: pd.DataFrame):
+        if self._closed:
+            raise ValueError(
+                "The values of a closed QuantileComputer were removed, it can not be updated"
+            )
         if X.shape[0] < 2:
             return self
-
-        columns = X.columns
-        
-        if self.values_dict is None:
-            self.values = X.copy()
-        else:
-            self.values = pd.concat(self.values, X)
-
-        
+        if self._path is None:
+            self._path = (
+                Path(self.cache_path)
+                / "QuantileComputer"
+                / "".join(str(uuid.uuid4()).split("-"))
+            )
+            self._path.mkdir(parents=True, exist_ok=True)
+            self._owner = True
+            self._files = {}
+            self._counts = {}
+            self._n_neg_inf = {}
+            self._n_pos_inf = {}
+            self._mins = {}
+            self._maxs = {}
+        elif not self._owner:
+            raise ValueError("A copy of a QuantileComputer can not be updated")
+
+        for c in X.select_dtypes(include="number").columns:
+            values = X[c].to_numpy(dtype=np.float32, na_value=np.nan)
+            values = values[~np.isnan(values)]
+            if c not in self._files:
+                self._files[c] = self._path / f"{len(self._files)}.f32"
+                self._counts[c] = 0
+                self._n_neg_inf[c] = 0
+                self._n_pos_inf[c] = 0
+                self._mins[c] = np.inf
+                self._maxs[c] = -np.inf
+            infinite = np.isinf(values)
+            n_neg_inf = int(np.count_nonzero(values[infinite] < 0))
+            self._n_neg_inf[c] += n_neg_inf
+            self._n_pos_inf[c] += int(np.count_nonzero(infinite)) - n_neg_inf
+            self._counts[c] += int(np.count_nonzero(infinite))
+            values = values[~infinite]
+            if values.shape[0] == 0:
+                continue
+            with open(self._files[c], "ab") as file:
+                values.tofile(file)
+            self._counts[c] += values.shape[0]
+            self._mins[c] = min(self._mins[c], float(values.min()))
+            self._maxs[c] = max(self._maxs[c], float(values.max()))
+        self._memo = {}
         return self
 
+    def _chunks(self, feature):
+        values = np.memmap(self._files[feature], dtype=np.float32, mode="r")
+        for start in range(0, values.shape[0], self.max_values_in_memory):
+            yield np.asarray(values[start : start + self.max_values_in_memory])
+
+    def _select(self, feature, k: int):
+        """Narrow the range of finite values of the feature until it contains the rank k
+
+        Returns:
+
+            below: Number of values below the range
+            count: Number of values in the range
+            values: The sorted values of the range, or its only value
+                    when all of them are equal
+        """
+        lo, hi = self._mins[feature], self._maxs[feature]
+        below = 0
+        count = (
+            self._counts[feature]
+            - self._n_neg_inf[feature]
+            - self._n_pos_inf[feature]
+        )
+        while count > self.max_values_in_memory and lo < hi:
+            counts = np.zeros(self.n_bins, dtype=np.int64)
+            mins = np.full(self.n_bins, np.inf)
+            maxs = np.full(self.n_bins, -np.inf)
+            below = 0
+            for chunk in self._chunks(feature):
+                below += _histogram_pass(chunk, lo, hi, counts, mins, maxs)
+            cumulated = below + np.cumsum(counts)
+            b = int(np.searchsorted(cumulated, k, side="right"))
+            below = int(cumulated[b] - counts[b])
+            count = int(counts[b])
+            lo, hi = mins[b], maxs[b]
+        if lo == hi:
+            return below, count, np.array([lo])
+        values = np.concatenate(
+            [chunk[(chunk >= lo) & (chunk <= hi)] for chunk in self._chunks(feature)]
+        )
+        return below, count, np.sort(values)
+
+    def _quantile(self, feature, q: float) -> float:
+        if (feature, q) in self._memo:
+            return self._memo[(feature, q)]
+        n = self._counts[feature]
+        if n == 0:
+            return np.nan
+        if self._closed:
+            raise ValueError(
+                f"The quantile {q} was not computed before closing the QuantileComputer"
+            )
+        h = (n - 1) * q
+        k = int(np.floor(h))
+        k2 = min(k + 1, n - 1)
+        n_neg_inf = self._n_neg_inf[feature]
+        n_finite = n - n_neg_inf - self._n_pos_inf[feature]
+        selection = None
+
+        def value_at(rank):
+            nonlocal selection
+            if rank < n_neg_inf:
+                return -np.inf
+            if rank >= n_neg_inf + n_finite:
+                return np.inf
+            rank -= n_neg_inf
+            if selection is None or not (
+                selection[0] <= rank < selection[0] + selection[1]
+            ):
+                selection = self._select(feature, rank)
+            below, count, values = selection
+            if values.shape[0] < count:
+                return float(values[0])
+            return float(values[rank - below])
+
+        a = value_at(k)
+        b = value_at(k2)
+        self._memo[(feature, q)] = a if h == k else a + (b - a) * (h - k)
+        return self._memo[(feature, q)]
+
     def quantile(
         self, q: float, feature: Optional[str] = None
     ) -> Union[pd.Series, float]:
+        """Compute the quantile for a set of features
+
+        Parameters:
+
+            q: The quantile to compute
+            feature: The feature. By default all of them
+
+        Returns:
+
+            The quantile of the feature, or of each feature
+        """
         if feature is not None:
-            return self.values.quantile(q)
-        else:
-            return self.values[feature].quantile(q)
+            return self._quantile(feature, q)
+        return pd.Series(
+            {c: self._quantile(c, q) for c in self._counts.keys()}, dtype=np.float64
+        )
+
+    def close(self):
+        """Remove the stored values, keeping the quantiles already computed"""
+        if self._path is not None and self._owner:
+            shutil.rmtree(self._path, ignore_errors=True)
+            self._closed = True
+        self._path = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
 
 
 class Literal(TransformerStep):
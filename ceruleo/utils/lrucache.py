@@ -1,26 +1,486 @@
+"""Caches for the transformed run-to-failure cycles
+
+Two eviction policies are provided, both with O(1) insertion, access and eviction:
+
+- LRUCache: evicts the least recently used element
+- LFUCache: evicts the least frequently used element. Ties are broken
+  evicting the least recently used element among the least frequently used
+
+The capacity of the caches can be bounded by number of elements, by
+the size in bytes of the elements stored, or both.
+
+The TwoTierCache adds an on-disk tier to a memory cache: the elements
+evicted from memory are written as `.npy` files and served back
+memory-mapped.
+"""
+import pickle
+import shutil
+import sys
+import uuid
+import weakref
+from collections import OrderedDict
+from enum import Enum
+from pathlib import Path
+from typing import Any, Callable, Hashable, Optional
+
 import numpy as np
+import pandas as pd
+from ceruleo import CACHE_PATH
+
+
+def data_size(elem: Any) -> int:
+    """Approximate size in bytes of a cached element
+
+    The size of arrays, DataFrames and Series is computed from their
+    underlying buffers. Tuples, lists and dicts are traversed recursively.
+
+    Parameters:
+
+        elem: Element to measure
+
+    Returns:
+
+        size: Size in bytes
+    """
+    if elem is None:
+        return 0
+    if isinstance(elem, np.ndarray):
+        return elem.nbytes
+    if isinstance(elem, pd.DataFrame):
+        return int(elem.memory_usage(index=True).sum())
+    if isinstance(elem, pd.Series):
+        return int(elem.memory_usage(index=True))
+    if isinstance(elem, (tuple, list)):
+        return sum(data_size(e) for e in elem)
+    if isinstance(elem, dict):
+        return sum(data_size(e) for e in elem.values())
+    return sys.getsizeof(elem)
+
+
+class CachePolicy(Enum):
+    """Cache eviction policies
+
+    Values:
 
+        LRU = 1
+        LFU = 2
+    """
 
-class LRUDataCache:
-    def __init__(self, max_elem):
+    LRU = 1
+    LFU = 2
+
+
+class DataCache:
+    """Base class of the caches
+
+    Each element is stored in `data` as a dict with the keys
+    `elem`, `hit` and `size`.
+
+    Parameters:
+
+        max_elem: Maximum number of elements stored. None for no limit
+        max_bytes: Maximum size in bytes of the elements stored. None for no limit
+    """
+
+    def __init__(self, max_elem: Optional[int] = None, max_bytes: Optional[int] = None):
         self.max_elem = max_elem
-        self.data = {}
+        self.max_bytes = max_bytes
+        self.eviction_callback: Optional[Callable[[Hashable, Any], None]] = None
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
 
-    def get(self, key):
-        self.data[key]['hit'] += 1
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.data
 
-        return self.data[key]['elem']
+    def __len__(self):
+        return len(self.data)
 
-    def add(self, key, elem):
-        if len(self.data) == self.max_elem:
-            keys = list(self.data.keys())
-            key_to_remove = np.argmin([self.data[k]['hit'] for k in keys])
-            del self.data[keys[key_to_remove]]
-        self.data[key] = {
-            'elem':  elem,
-            'hit': 0
-        }
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Obtain an element of the cache
+
+        Parameters:
+
+            key: Key of the element
+            default: Value returned when the key is not present
+
+        Returns:
+
+            elem: The element stored, or default if it is not present
+        """
+        entry = self.data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        entry["hit"] += 1
+        self._touch(key, entry)
+        return entry["elem"]
+
+    def add(self, key: Hashable, elem: Any) -> Any:
+        """Store an element, evicting others if the cache is full
+
+        The new element is always stored, even if by itself it exceeds
+        the byte budget.
+
+        Parameters:
+
+            key: Key of the element
+            elem: Element to store
+
+        Returns:
+
+            elem: The element stored
+        """
+        if key in self.data:
+            self.pop(key)
+        size = data_size(elem)
+        while len(self.data) > 0 and self._full(size):
+            self._evict()
+        self._insert(key, {"elem": elem, "hit": 0, "size": size})
+        self.nbytes += size
         return elem
 
+    def pop(self, key: Hashable) -> Any:
+        """Remove an element from the cache
+
+        Parameters:
+
+            key: Key of the element
+
+        Returns:
+
+            elem: The removed element
+        """
+        entry = self._remove(key)
+        self.nbytes -= entry["size"]
+        return entry["elem"]
+
+    def clear(self):
+        for key in list(self.data.keys()):
+            self.pop(key)
+
+    def info(self) -> dict:
+        """Counters of the cache
+
+        Returns:
+
+            info: Dictionary with the hits, misses, evictions, number of
+                  elements and size in bytes of the cache
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "elements": len(self),
+            "nbytes": self.nbytes,
+        }
+
+    def _full(self, size: int) -> bool:
+        if self.max_elem is not None and len(self.data) >= self.max_elem:
+            return True
+        if self.max_bytes is not None and self.nbytes + size > self.max_bytes:
+            return True
+        return False
+
+    def _evict(self):
+        key = self._victim()
+        elem = self.pop(key)
+        self.evictions += 1
+        if self.eviction_callback is not None:
+            self.eviction_callback(key, elem)
+        return key, elem
+
+    def _insert(self, key: Hashable, entry: dict):
+        raise NotImplementedError
+
+    def _remove(self, key: Hashable) -> dict:
+        raise NotImplementedError
+
+    def _touch(self, key: Hashable, entry: dict):
+        raise NotImplementedError
+
+    def _victim(self) -> Hashable:
+        raise NotImplementedError
+
+
+class LRUCache(DataCache):
+    """Least recently used cache
+
+    Parameters:
+
+        max_elem: Maximum number of elements stored. None for no limit
+        max_bytes: Maximum size in bytes of the elements stored. None for no limit
+    """
+
+    def __init__(self, max_elem: Optional[int] = None, max_bytes: Optional[int] = None):
+        super().__init__(max_elem, max_bytes)
+        self.data = OrderedDict()
+
+    def _insert(self, key: Hashable, entry: dict):
+        self.data[key] = entry
+
+    def _remove(self, key: Hashable) -> dict:
+        return self.data.pop(key)
+
+    def _touch(self, key: Hashable, entry: dict):
+        self.data.move_to_end(key)
+
+    def _victim(self) -> Hashable:
+        return next(iter(self.data))
+
+
+class LFUCache(DataCache):
+    """Least frequently used cache
+
+    The keys are grouped in buckets by number of hits. Each bucket keeps
+    the keys in order of arrival, so the least recently used key is evicted
+    among the ones with less hits.
+
+    Parameters:
+
+        max_elem: Maximum number of elements stored. None for no limit
+        max_bytes: Maximum size in bytes of the elements stored. None for no limit
+    """
+
+    def __init__(self, max_elem: Optional[int] = None, max_bytes: Optional[int] = None):
+        super().__init__(max_elem, max_bytes)
+        self.data = {}
+        self._buckets = {}
+        self._min_hit = 0
+
+    def _insert(self, key: Hashable, entry: dict):
+        self.data[key] = entry
+        self._buckets.setdefault(entry["hit"], OrderedDict())[key] = None
+        self._min_hit = entry["hit"]
+
+    def _remove_from_bucket(self, key: Hashable, hit: int):
+        bucket = self._buckets[hit]
+        del bucket[key]
+        if len(bucket) == 0:
+            del self._buckets[hit]
+            if self._min_hit == hit:
+                self._min_hit = hit + 1
+
+    def _remove(self, key: Hashable) -> dict:
+        entry = self.data.pop(key)
+        self._remove_from_bucket(key, entry["hit"])
+        return entry
+
+    def _touch(self, key: Hashable, entry: dict):
+        self._remove_from_bucket(key, entry["hit"] - 1)
+        self._buckets.setdefault(entry["hit"], OrderedDict())[key] = None
+
+    def _victim(self) -> Hashable:
+        if self._min_hit not in self._buckets:
+            # Only happens after removing an element that was not the least used
+            self._min_hit = min(self._buckets.keys())
+        return next(iter(self._buckets[self._min_hit]))
+
+
+class DiskStore:
+    """Store elements in a directory, one `.npy` file per array
+
+    Numeric arrays, and DataFrames and Series with a single numeric dtype,
+    are saved as `.npy` files and loaded memory-mapped in copy-on-write mode.
+    The index and columns of the DataFrames, and any other object, are
+    pickled to files in the same directory, so the index of the store
+    only keeps the paths of the files.
+
+    The directory is removed when the store is closed or garbage collected.
+
+    Parameters:
+
+        cache_path: Directory where the store directory is created
+    """
+
+    def __init__(self, cache_path: Path = CACHE_PATH):
+        filename = "".join(str(uuid.uuid4()).split("-"))
+        self.path = Path(cache_path) / "DiskStore" / filename
+        self.path.mkdir(exist_ok=True, parents=True)
+        self.index = {}
+        self._n_files = 0
+        self._finalizer = weakref.finalize(self, shutil.rmtree, self.path, True)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.index
+
     def __len__(self):
-        return len(self.data)
+        return len(self.index)
+
+    def _file(self, suffix: str = ".npy") -> Path:
+        self._n_files += 1
+        return self.path / f"{self._n_files}{suffix}"
+
+    def _pickle(self, obj: Any) -> Path:
+        file = self._file(".pkl")
+        with open(file, "wb") as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        return file
+
+    def _unpickle(self, file: Path) -> Any:
+        with open(file, "rb") as f:
+            return pickle.load(f)
+
+    def _save_component(self, obj: Any) -> tuple:
+        if isinstance(obj, np.ndarray) and obj.dtype.kind in "biuf":
+            file = self._file()
+            np.save(file, obj)
+            return ("ndarray", file)
+        if (
+            isinstance(obj, pd.DataFrame)
+            and obj.dtypes.nunique() == 1
+            and obj.dtypes.iloc[0].kind in "biuf"
+        ) or (isinstance(obj, pd.Series) and obj.dtype.kind in "biuf"):
+            file = self._file()
+            np.save(file, obj.values)
+            axes = (obj.index, obj.columns if isinstance(obj, pd.DataFrame) else obj.name)
+            return (type(obj).__name__, file, self._pickle(axes))
+        return ("pickle", self._pickle(obj))
+
+    def _load_component(self, descriptor: tuple) -> Any:
+        kind = descriptor[0]
+        if kind == "pickle":
+            return self._unpickle(descriptor[1])
+        values = np.load(descriptor[1], mmap_mode="c")
+        if kind == "ndarray":
+            return values
+        index, columns = self._unpickle(descriptor[2])
+        if kind == "DataFrame":
+            return pd.DataFrame(values, index=index, columns=columns, copy=False)
+        return pd.Series(values, index=index, name=columns, copy=False)
+
+    def add(self, key: Hashable, elem: Any):
+        """Write an element
+
+        Tuples are stored component-wise, so each array of a
+        (X, y, metadata) tuple is memory-mapped independently
+
+        Parameters:
+
+            key: Key of the element
+            elem: Element to store
+        """
+        if isinstance(elem, tuple):
+            descriptor = ("tuple", [self._save_component(e) for e in elem])
+        else:
+            descriptor = self._save_component(elem)
+        self.index[key] = descriptor
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        descriptor = self.index.get(key)
+        if descriptor is None:
+            return default
+        if descriptor[0] == "tuple":
+            return tuple(self._load_component(d) for d in descriptor[1])
+        return self._load_component(descriptor)
+
+    def close(self):
+        self.index = {}
+        self._finalizer()
+
+
+class TwoTierCache:
+    """Memory cache backed by an on-disk tier
+
+    The elements evicted from the memory tier are written to a DiskStore.
+    Accessing an element present only in the disk tier loads it
+    memory-mapped and promotes it to the memory tier.
+
+    Parameters:
+
+        memory: Memory tier
+        disk: Disk tier
+    """
+
+    def __init__(self, memory: DataCache, disk: DiskStore):
+        self.memory = memory
+        self.disk = disk
+        self.memory.eviction_callback = self._spill
+        self.disk_hits = 0
+        self.spills = 0
+
+    def _spill(self, key: Hashable, elem: Any):
+        if key not in self.disk:
+            self.disk.add(key, elem)
+            self.spills += 1
+
+    @property
+    def hits(self) -> int:
+        return self.memory.hits
+
+    @property
+    def misses(self) -> int:
+        return self.memory.misses - self.disk_hits
+
+    @property
+    def evictions(self) -> int:
+        return self.memory.evictions
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.memory or key in self.disk
+
+    def __len__(self):
+        return len(set(self.memory.data.keys()).union(self.disk.index.keys()))
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        elem = self.memory.get(key)
+        if elem is not None:
+            return elem
+        elem = self.disk.get(key)
+        if elem is None:
+            return default
+        self.disk_hits += 1
+        return self.memory.add(key, elem)
+
+    def add(self, key: Hashable, elem: Any) -> Any:
+        return self.memory.add(key, elem)
+
+    def clear(self):
+        self.memory.clear()
+        self.disk.close()
+
+    def info(self) -> dict:
+        info = self.memory.info()
+        info["misses"] = self.misses
+        info["disk_hits"] = self.disk_hits
+        info["spills"] = self.spills
+        info["disk_elements"] = len(self.disk)
+        return info
+
+
+def build_cache(
+    policy: CachePolicy = CachePolicy.LRU,
+    max_elem: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+    spill_to_disk: bool = False,
+    cache_path: Path = CACHE_PATH,
+):
+    """Build a cache given its eviction policy
+
+    Parameters:
+
+        policy: Eviction policy
+        max_elem: Maximum number of elements stored in memory. None for no limit
+        max_bytes: Maximum size in bytes of the elements stored in memory. None for no limit
+        spill_to_disk: Wether to write the evicted elements in an on-disk tier
+        cache_path: Where to store the on-disk tier
+
+    Returns:
+
+        cache: The cache
+    """
+    if policy == CachePolicy.LRU:
+        cache = LRUCache(max_elem, max_bytes)
+    elif policy == CachePolicy.LFU:
+        cache = LFUCache(max_elem, max_bytes)
+    else:
+        raise ValueError(f"Invalid cache policy {policy}")
+    if spill_to_disk:
+        return TwoTierCache(cache, DiskStore(cache_path))
+    return cache
+
+
+# The previous cache evicted the element with less hits
+LRUDataCache = LFUCache
@@ -0,0 +1,14 @@
+import multiprocessing
+
+
+def process_context():
+    """Context used to start the worker processes
+
+    Forking a process that already started the numba threads is not
+    safe, so the workers are forked from a server process that imports
+    ceruleo once. As with spawn, the main module of the program must be
+    importable without side effects.
+    """
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["__main__", "ceruleo.transformation"])
+    return context
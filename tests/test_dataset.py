@@ -1,11 +1,14 @@
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
 from ceruleo.dataset.catalog.CMAPSS import CMAPSSDataset, sensor_indices
-from ceruleo.dataset.transformed import TransformedSerializedDataset
+from ceruleo.dataset.transformed import (TransformedDataset,
+                                         TransformedSerializedDataset)
 from ceruleo.dataset.ts_dataset import (AbstractTimeSeriesDataset,
                                          FoldedDataset)
+from ceruleo.iterators.iterators import WindowedDatasetIterator
 from ceruleo.transformation import Transformer
 from ceruleo.transformation.features.scalers import MinMaxScaler
 from ceruleo.transformation.features.selection import ByNameFeatureSelector
@@ -82,7 +85,7 @@ class TestDataset:
         life = ds[0]
         assert len(life.columns) == 28
 
-    def test_transformed_dataset(self):
+    def test_transformed_dataset(self, tmp_path):
         dataset = MockDataset(nlives=5)
 
         pipe = ByNameFeatureSelector(features=["feature1"])
@@ -104,7 +107,7 @@ class TestDataset:
         X = transformed_dataset.get_features_of_life(0, pandas=False)
         assert isinstance(X, np.ndarray)
 
-        path = Path('./saved_dataset').resolve()
+        path = tmp_path
         transformed_dataset.save(path)
 
         transformed_serialized_dataset = TransformedSerializedDataset(path)
@@ -130,9 +133,9 @@ class TestDataset:
 
         transformer.fit(train_ds)
 
-        train_path = Path('./saved_dataset/train/').resolve()
-        val_path = Path('./saved_dataset/val/').resolve()
-        test_path = Path('./saved_dataset/test/').resolve()
+        train_path = tmp_path / 'train'
+        val_path = tmp_path / 'val'
+        test_path = tmp_path / 'test'
         train_ds.map(transformer).save(train_path)
         val_ds.map(transformer).save(val_path)
         test_ds.map(transformer).save(test_path)
@@ -152,7 +155,158 @@ class TestDataset:
         assert len(transformed_serialized_dataset) == len_test_ds
 
 
+    def test_transformed_serialized_dataset_memmap(self, tmp_path):
+        dataset = MockDataset(nlives=5)
+        pipe = ByNameFeatureSelector(features=["feature1", "feature2"])
+        target_pipe = ByNameFeatureSelector(features=["RUL"])
+        transformer = Transformer(pipelineX=pipe, pipelineY=target_pipe)
+        transformer.fit(dataset)
+        transformed_dataset = dataset.map(transformer)
+
+        path = tmp_path / 'memmap'
+        transformed_dataset.save(path)
+        serialized = TransformedSerializedDataset(path)
+        assert isinstance(serialized.X, np.memmap)
+        for i in range(len(transformed_dataset)):
+            X, y, metadata = serialized[i]
+            X_true, y_true, _ = transformed_dataset[i]
+            assert X.equals(X_true)
+            assert np.all(y.values == y_true.values)
+            assert np.shares_memory(X.values, serialized.X)
+            assert serialized.number_of_samples_of_time_series(i) == y_true.shape[0]
+
+        path = tmp_path / 'memmap_float32'
+        transformed_dataset.save(path, dtype=np.float32)
+        serialized = TransformedSerializedDataset(path)
+        for i in range(len(transformed_dataset)):
+            X, y, _ = serialized[i]
+            X_true, y_true, _ = transformed_dataset[i]
+            assert np.all(X.dtypes == np.float32)
+            assert np.allclose(X, X_true)
+            assert np.allclose(y, y_true)
+
+    def test_transformed_serialized_dataset_mixed_dtypes(self, tmp_path):
+        dataset = MockDataset(nlives=4)
+        dataset.lives[1]["feature1"] = dataset.lives[1]["feature1"].astype(np.float32)
+        dataset.lives[2]["feature1"] = "category"
+        pipe = ByNameFeatureSelector(features=["feature1", "feature2"])
+        target_pipe = ByNameFeatureSelector(features=["RUL"])
+        transformer = Transformer(pipelineX=pipe, pipelineY=target_pipe)
+        transformer.fit(dataset[[0]])
+        transformed_dataset = dataset.map(transformer)
+
+        for dtype in [None, np.float32]:
+            path = tmp_path / f'mixed_{dtype is None}'
+            transformed_dataset.save(path, dtype=dtype)
+            serialized = TransformedSerializedDataset(path)
+            assert serialized.number_of_samples() == [50, 50, 50, 50]
+            X, _, _ = serialized[2]
+            assert X.equals(transformed_dataset[2][0])
+            X, _, _ = serialized[1]
+            if dtype is None:
+                assert X.equals(transformed_dataset[1][0])
+            else:
+                assert np.shares_memory(X.values, serialized.X)
+
+    def test_number_of_samples_from_metadata(self, tmp_path, monkeypatch):
+        dataset = MockDataset(nlives=6)
+        pipe = ByNameFeatureSelector(features=["feature1", "feature2"])
+        target_pipe = ByNameFeatureSelector(features=["RUL"])
+        transformer = Transformer(pipelineX=pipe, pipelineY=target_pipe)
+        transformer.fit(dataset)
+        transformed_dataset = dataset.map(transformer)
 
+        path = tmp_path / 'lengths'
+        transformed_dataset.save(path)
+        serialized = TransformedSerializedDataset(path)
+        expected = [transformed_dataset[i][1].shape[0] for i in range(len(dataset))]
+        iterator = WindowedDatasetIterator(serialized[[4, 1, 2]], window_size=5, step=2)
+        n_windows = len([e for e in iterator.shuffler.iterator(iterator) if e[1] >= 4])
+        serialized = TransformedSerializedDataset(path)
+
+        def fail(i):
+            raise AssertionError("The cycle should not be read")
+
+        monkeypatch.setattr(serialized, "_open_file", fail)
+        assert serialized.number_of_samples() == expected
+        folded = serialized[[4, 1, 2]]
+        assert folded.number_of_samples() == [expected[4], expected[1], expected[2]]
+        iterator = WindowedDatasetIterator(folded, window_size=5, step=2)
+        assert len(iterator) == n_windows
+
+        transformed_dataset = dataset.map(transformer, cache_size=1)
+        for _ in transformed_dataset:
+            pass
+        monkeypatch.setattr(transformed_dataset.transformer, "transform", fail)
+        assert transformed_dataset.number_of_samples() == expected
+
+    def test_transformed_dataset_preload(self):
+        dataset = MockDataset(nlives=8)
+        pipe = ByNameFeatureSelector(features=["feature1", "feature2"])
+        pipe = MinMaxScaler(range=(-1, 1))(pipe)
+        target_pipe = ByNameFeatureSelector(features=["RUL"])
+        transformer = Transformer(pipelineX=pipe, pipelineY=target_pipe)
+        transformer.fit(dataset)
+
+        for backend in ["thread", "process"]:
+            transformed_dataset = dataset.map(transformer)
+            transformed_dataset.preload(n_jobs=2, backend=backend, chunksize=3)
+            assert len(transformed_dataset.cache) == 8
+            assert transformed_dataset.cache.misses == 0
+            for i in range(len(dataset)):
+                X, _, _ = transformed_dataset[i]
+                assert X.equals(transformer.transform(dataset[i])[0])
+            assert transformed_dataset.cache.misses == 0
+
+        transformed_dataset = dataset.map(transformer)
+        transformed_dataset.preload(n_jobs=1, max_memory=1)
+        assert len(transformed_dataset.cache) == 1
+
+        transformed_dataset = dataset.map(transformer, cache_size=3)
+        transformed_dataset.preload(n_jobs=2, backend="thread")
+        assert len(transformed_dataset.cache) == 3
+        assert transformed_dataset.cache.evictions == 0
+
+    def test_transformed_dataset_concurrent_preload(self):
+        datasets = [MockDataset(nlives=6), MockDataset(nlives=6)]
+        transformed_datasets = []
+        for dataset, features in zip(datasets, [["feature1"], ["feature2"]]):
+            pipe = ByNameFeatureSelector(features=features)
+            pipe = MinMaxScaler(range=(-1, 1))(pipe)
+            target_pipe = ByNameFeatureSelector(features=["RUL"])
+            transformer = Transformer(pipelineX=pipe, pipelineY=target_pipe)
+            transformer.fit(dataset)
+            transformed_datasets.append(dataset.map(transformer))
+
+        with ThreadPoolExecutor(2) as executor:
+            for future in [
+                executor.submit(t.preload, n_jobs=2, backend="thread")
+                for t in transformed_datasets
+            ]:
+                future.result()
+        for dataset, transformed_dataset in zip(datasets, transformed_datasets):
+            for i in range(len(dataset)):
+                X, _, _ = transformed_dataset.cache.get(i)
+                expected = transformed_dataset.transformer.transform(dataset[i])[0]
+                assert X.equals(expected)
+
+    def test_transformed_dataset_spill_to_disk(self):
+        dataset = MockDataset(nlives=5)
+        pipe = ByNameFeatureSelector(features=["feature1", "feature2"])
+        pipe = MinMaxScaler(range=(-1, 1))(pipe)
+        target_pipe = ByNameFeatureSelector(features=["RUL"])
+        transformer = Transformer(pipelineX=pipe, pipelineY=target_pipe)
+        transformer.fit(dataset)
+
+        transformed_dataset = TransformedDataset(
+            dataset, transformer, cache_size=2, spill_to_disk=True
+        )
+        first_pass = [X for X, y, _ in transformed_dataset]
+        second_pass = [X for X, y, _ in transformed_dataset]
+        assert transformed_dataset.cache.misses == 5
+        assert transformed_dataset.cache.disk_hits == 5
+        for X1, X2 in zip(first_pass, second_pass):
+            assert X1.equals(X2)
 
 
 class TestAnalysis:
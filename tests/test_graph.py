@@ -1,4 +1,7 @@
-from ceruleo.transformation.functional.graph_utils import topological_sort_iterator
+from ceruleo.transformation.functional.graph_utils import (
+    topological_levels, topological_sort_iterator)
+from ceruleo.transformation.functional.pipeline.cache_store import CacheStoreType
+from ceruleo.transformation.functional.pipeline.traversal import CachedGraphTraversal
 from ceruleo.transformation.functional.transformerstep import TransformerStep
 
 
@@ -111,3 +114,32 @@ class TestGraph:
         pipeC = Node(name="C")(pipe)
         pipeD = Node(name="D")(pipe)
         pipe = Node(name="E")([pipeB, pipeC, pipeD])
+
+    def test_levels(self):
+        pipe = Node(name="A")
+        pipeB = Node(name="B")(pipe)
+        pipeC = Node(name="C")(pipe)
+        pipeD = Node(name="D")(pipeC)
+        pipeF = Node(name="F")
+        pipe = Node(name="E")([pipeB, pipeD, pipeF])
+
+        levels = [sorted(n.name for n in level) for level in topological_levels(pipe)]
+        assert levels == [["A", "F"], ["B", "C"], ["D"], ["E"]]
+
+    def test_traversal_index(self):
+        pipe = Node(name="A")
+        pipeB = Node(name="B")(pipe)
+        pipeC = Node(name="C")(pipe)
+        for cache_type in [CacheStoreType.MEMORY, CacheStoreType.SHELVE]:
+            with CachedGraphTraversal([pipe], [1, 2, 3], cache_type=cache_type) as cache:
+                assert cache.get_keys_of(pipe) == [(pipe, None, i) for i in range(3)]
+                for i in range(3):
+                    cache.clean_state_up_to(pipe, i)
+                    cache.store(pipeB, pipe, i, i * 10)
+                    cache.store(pipeC, pipe, i, i * 20)
+                assert cache.get_keys_of(pipe) == []
+                assert len(cache.get_keys_of(pipeB)) == 3
+                assert cache.state_up_to(pipeC, 2) == 40
+                cache.remove_state(pipeB)
+                assert cache.get_keys_of(pipeB) == []
+                assert len(cache.transformed_cache.keys()) == 3
@@ -95,3 +95,35 @@ class TestIterators():
         X, y, sw = next(it)
         assert np.all(X == np.array([[0,1,2,3,4]]).T)
         assert y[0][0] == 4
+
+    def test_get_data(self):
+        features = ['feature1', 'feature2']
+        x = ByNameFeatureSelector(features=features)
+        x = MinMaxScaler(range=(-1, 1))(x)
+        y = ByNameFeatureSelector(features=['RUL'])
+        transformer = Transformer(x, y)
+        ds = MockDataset(5)
+        transformer.fit(ds)
+        transformed_ds = ds.map(transformer)
+
+        for step, horizon, right_closed, padding in [
+            (1, 1, True, False),
+            (3, 2, True, True),
+            (2, 5, False, True),
+            (7, 1, False, False),
+        ]:
+            it = WindowedDatasetIterator(
+                transformed_ds,
+                window_size=6,
+                step=step,
+                horizon=horizon,
+                right_closed=right_closed,
+                padding=padding,
+            )
+            X, y, sw = it.get_data()
+            X_iter, y_iter, sw_iter = it._get_data_iterating()
+            assert X.shape == X_iter.shape
+            assert np.all(X == X_iter)
+            assert np.all(y == y_iter)
+            assert np.all(sw == sw_iter)
+            assert len(it) == X.shape[0]
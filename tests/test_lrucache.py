@@ -1,5 +1,8 @@
 
-from ceruleo.utils.lrucache import LRUDataCache
+import numpy as np
+import pandas as pd
+from ceruleo.utils.lrucache import (CachePolicy, DiskStore, LFUCache,
+                                    LRUCache, LRUDataCache, build_cache)
 
 
 class TestLRUCache():
@@ -32,3 +35,67 @@ class TestLRUCache():
         cache.get('D')
         cache.add('E', 9)
         assert 'B' not in cache.data
+
+    def test_lru_policy(self):
+        cache = LRUCache(3)
+        cache.add('A', 5)
+        cache.add('B', 6)
+        cache.add('C', 7)
+        cache.get('A')
+        cache.add('D', 8)
+        assert 'B' not in cache
+        assert 'A' in cache
+        cache.get('C')
+        cache.add('E', 9)
+        assert 'A' not in cache
+        assert cache.get('C') == 7
+        assert cache.get('B') is None
+        assert cache.hits == 3
+        assert cache.misses == 1
+        assert cache.evictions == 2
+
+    def test_max_bytes(self):
+        cache = LFUCache(max_bytes=3 * 800)
+        for i in range(5):
+            cache.add(i, (np.zeros((10, 10)), np.zeros(0), None))
+            cache.get(i)
+        assert len(cache) == 3
+        assert cache.nbytes == 3 * 800
+        assert cache.evictions == 2
+        cache.add('big', np.zeros(1000))
+        assert len(cache) == 1
+        assert cache.get('big').shape == (1000, )
+
+    def test_two_tier(self):
+        cache = build_cache(CachePolicy.LRU, max_bytes=2 * 800, spill_to_disk=True)
+        elems = {}
+        for i in range(5):
+            X = pd.DataFrame(np.random.rand(10, 10), columns=[f'f{j}' for j in range(10)])
+            elems[i] = (X, np.arange(10), {'life': i})
+            cache.add(i, elems[i])
+        assert len(cache.memory) == 1
+        assert len(cache.disk) == 4
+        X, y, metadata = cache.get(0)
+        assert X.equals(elems[0][0])
+        assert np.all(y == elems[0][1])
+        assert metadata == {'life': 0}
+        assert cache.disk_hits == 1
+        path = cache.disk.path
+        cache.clear()
+        assert not path.exists()
+
+    def test_disk_store_pickled_objects(self, tmp_path):
+        store = DiskStore(tmp_path)
+        X = pd.DataFrame({'a': np.arange(10), 'b': list('abcdefghij')})
+        store.add('mixed', (X, np.arange(10), {'life': 0}))
+        descriptors = store.index['mixed'][1]
+        assert descriptors[0][0] == 'pickle'
+        for descriptor in descriptors:
+            assert not any(isinstance(d, bytes) for d in descriptor)
+            assert all(p.exists() for p in descriptor[1:])
+        X_loaded, y, metadata = store.get('mixed')
+        assert X_loaded.equals(X)
+        assert np.all(y == np.arange(10))
+        assert metadata == {'life': 0}
+        store.close()
+        assert not store.path.exists()
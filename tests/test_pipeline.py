@@ -1,19 +1,68 @@
+import pickle
+import subprocess
+import sys
+import threading
+
 import numpy as np
 import pandas as pd
+import pytest
 from pyexpat import features
 from scipy.stats import entropy
 from ceruleo.dataset.ts_dataset import AbstractTimeSeriesDataset
 from ceruleo.transformation import Concatenate as TransformationConcatenate
 from ceruleo.transformation import Transformer
-from ceruleo.transformation.features.imputers import PerColumnImputer
+from ceruleo.transformation.features.denoising import EWMAFilter
+from ceruleo.transformation.features.extraction import (
+    ExpandingStatistics,
+    OneHotCategorical,
+    RollingStatistics,
+)
+from ceruleo.transformation.features.imputers import (
+    ForwardFillImputer,
+    MeanImputer,
+    PerColumnImputer,
+)
 from ceruleo.transformation.features.outliers import IQROutlierRemover
-from ceruleo.transformation.features.scalers import MinMaxScaler
-from ceruleo.transformation.features.selection import ByNameFeatureSelector
+from ceruleo.iterators.iterators import WindowedDatasetIterator
+from ceruleo.transformation.features.scalers import MinMaxScaler, StandardScaler
+from ceruleo.transformation.features.selection import (
+    ByNameFeatureSelector,
+    NullProportionSelector,
+)
 from ceruleo.transformation.features.split import SplitByCategory
-from ceruleo.transformation.features.transformation import MeanCentering
+from ceruleo.transformation.features.transformation import (
+    Accumulate,
+    Clip,
+    Diff,
+    MeanCentering,
+    Scale,
+    Sqrt,
+    Square,
+)
 from ceruleo.transformation.functional.concatenate import Concatenate
-from ceruleo.transformation.functional.graph_utils import root_nodes
+from ceruleo.transformation.functional.fusion import FusedStep
+from ceruleo.transformation.functional.graph_utils import dfs_iterator, root_nodes
+from ceruleo.transformation.functional.pipeline.cache_store import CacheStoreType
 from ceruleo.transformation.functional.pipeline.pipeline import make_pipeline
+from ceruleo.transformation.functional.pipeline.step_cache import (
+    StepCache,
+    step_state,
+)
+from ceruleo.transformation.functional.transformerstep import TransformerStep
+from ceruleo.transformation.utils import TransformerLambda
+
+
+class CountingStep(TransformerStep):
+    transformed = 0
+    fitted = 0
+
+    def partial_fit(self, X, y=None):
+        CountingStep.fitted += 1
+        return self
+
+    def transform(self, X):
+        CountingStep.transformed += 1
+        return X * 2
 
 
 def gaussian(N: int, mean: float = 50, std: float = 10):
@@ -283,4 +332,460 @@ class TestPipeline:
 
         X, y, sw = test_transformer.transform(dataset[0])
 
-        assert X.shape[1] == 1
\ No newline at end of file
+        assert X.shape[1] == 1
+    def test_parallel(self):
+        dataset = MockDatasetCategorical(N=8)
+
+        def build_transformer(n_jobs: int):
+            pipe = ByNameFeatureSelector(features=["feature1", "feature2"])
+            pipe = MinMaxScaler(range=(-1, 1))(pipe)
+            pipe2 = ByNameFeatureSelector(features=["feature1"])
+            pipe2 = TransformerLambda(lambda X: X * 2)(pipe2)
+            pipe = TransformationConcatenate()([pipe, pipe2])
+            pipe = MeanCentering()(pipe)
+            return Transformer(pipelineX=pipe, n_jobs=n_jobs).fit(dataset)
+
+        serial = build_transformer(1)
+        parallel = build_transformer(2)
+        assert parallel.pipelineX.runner.n_jobs == 2
+        for life in dataset:
+            # The mergeable steps are fitted in shards, summed in another order
+            assert np.allclose(serial.transformX(life), parallel.transformX(life))
+
+    def test_parallel_fit(self):
+        dataset = MockDatasetCategorical(N=9)
+        for life in dataset.lives[::2]:
+            life.loc[life.index[:60], "feature2"] = np.nan
+
+        def build_transformer(n_jobs: int):
+            categories = OneHotCategorical(feature="Categorical")(
+                ByNameFeatureSelector(features=["Categorical"])
+            )
+            pipe = ByNameFeatureSelector(features=["feature1", "feature2"])
+            pipe = NullProportionSelector(max_null_proportion=0.5)(pipe)
+            pipe = IQROutlierRemover(clip=True, prefer_partial_fit=True)(pipe)
+            pipe = MeanImputer()(pipe)
+            pipe = StandardScaler()(pipe)
+            pipe = TransformationConcatenate()([pipe, categories])
+            return Transformer(pipelineX=pipe, n_jobs=n_jobs).fit(dataset)
+
+        serial = build_transformer(1)
+        parallel = build_transformer(3)
+        for life in dataset:
+            X_serial = serial.transformX(life)
+            X_parallel = parallel.transformX(life)
+            assert X_serial.columns.tolist() == X_parallel.columns.tolist()
+            # The merged digests of IQROutlierRemover are approximations
+            assert np.allclose(X_serial, X_parallel, atol=5e-2)
+
+        scaler = parallel.pipelineX.find_node("StandardScaler")
+        assert np.allclose(
+            scaler.mean, serial.pipelineX.find_node("StandardScaler").mean, rtol=1e-2
+        )
+
+    def test_parallel_fit_exact(self):
+        dataset = MockDatasetCategorical(N=8)
+
+        def build_transformer(n_jobs: int):
+            pipe = ByNameFeatureSelector(features=["feature1", "feature2"])
+            pipe = MinMaxScaler(range=(-1, 1))(pipe)
+            return Transformer(pipelineX=pipe, n_jobs=n_jobs).fit(dataset)
+
+        expected = MinMaxScaler(range=(-1, 1))
+        for life in dataset:
+            expected.partial_fit(life[["feature1", "feature2"]])
+
+        serial = build_transformer(1)
+        parallel = build_transformer(2)
+        scaler = parallel.pipelineX.find_node("MinMaxScaler")
+        assert scaler.data_min.equals(expected.data_min)
+        assert scaler.data_max.equals(expected.data_max)
+        for life in dataset:
+            assert parallel.transformX(life).equals(serial.transformX(life))
+
+    def test_set_params_parallel_fit(self):
+        dataset = MockDatasetCategorical(N=6)
+        for life in dataset.lives:
+            life.loc[life.index[:60], "feature2"] = np.nan
+
+        pipe = ByNameFeatureSelector(features=["feature1", "feature2"])
+        pipe = NullProportionSelector(max_null_proportion=0.01)(pipe)
+        transformer = Transformer(pipelineX=pipe, n_jobs=3).fit(dataset)
+        assert transformer.transformX(dataset[0]).columns.tolist() == ["feature1"]
+
+        transformer.set_params(
+            pipeline_X__NullProportionSelector__max_null_proportion=1.0
+        )
+        transformer.fit(dataset)
+        selector = transformer.pipelineX.find_node("NullProportionSelector")
+        assert selector.max_null_proportion == 1.0
+        assert transformer.transformX(dataset[0]).columns.tolist() == [
+            "feature1",
+            "feature2",
+        ]
+
+    def test_set_params_n_jobs(self):
+        dataset = MockDatasetCategorical(N=6)
+        pipe = ByNameFeatureSelector(features=["feature1", "feature2"])
+        pipe = MinMaxScaler(range=(-1, 1))(pipe)
+        transformer = Transformer(pipelineX=pipe).fit(dataset)
+        expected = [transformer.transformX(life) for life in dataset]
+        runner = transformer.pipelineX.runner
+        assert runner._executor is None
+
+        transformer.pipelineX.set_params(n_jobs=2)
+        assert runner.n_jobs == 2
+        transformer.fit(dataset)
+        executor = runner._executor
+        assert executor is not None
+        transformer.pipelineX.transform(dataset)
+        assert runner._executor is executor
+        for life, X in zip(dataset, expected):
+            assert transformer.transformX(life).equals(X)
+
+        copied = pickle.loads(pickle.dumps(transformer.pipelineX))
+        assert copied.runner._executor is None
+        runner.close()
+        assert runner._executor is None
+
+    def test_transformer_set_params(self):
+        dataset = MockDatasetCategorical(N=6)
+        pipe = ByNameFeatureSelector(features=["feature1", "feature2"])
+        pipe = MinMaxScaler(range=(-1, 1))(pipe)
+        target_pipe = ByNameFeatureSelector(features=["RUL"])
+        transformer = Transformer(pipelineX=pipe, pipelineY=target_pipe)
+
+        transformer.set_params(n_jobs=2, fuse_steps=True, array_mode=True)
+        assert transformer.get_params()["n_jobs"] == 2
+        assert transformer.array_mode
+        for pipeline in [transformer.pipelineX, transformer.pipelineY]:
+            assert pipeline.n_jobs == 2
+            assert pipeline.runner.n_jobs == 2
+            assert pipeline.fuse_steps
+            assert pipeline.runner.fuse_steps
+        transformer.fit(dataset)
+        assert isinstance(transformer.transformX(dataset[0]), np.ndarray)
+
+        with pytest.raises(ValueError):
+            transformer.set_params(jobs=2)
+        transformer.pipelineX.runner.close()
+        transformer.pipelineY.runner.close()
+
+    def test_parallel_fit_exits(self):
+        # The numba threads started by the first fit must not be forked
+        code = """
+import numpy as np
+import pandas as pd
+from ceruleo.transformation.features.scalers import RobustMinMaxScaler, StandardScaler
+from ceruleo.transformation.features.selection import ByNameFeatureSelector
+from ceruleo.transformation.functional.pipeline.pipeline import make_pipeline
+
+dataset = [
+    pd.DataFrame({"feature1": np.random.randn(200), "feature2": np.random.randn(200)})
+    for _ in range(6)
+]
+make_pipeline(
+    ByNameFeatureSelector(features=["feature1", "feature2"]),
+    RobustMinMaxScaler(range=(-1, 1)),
+).fit(dataset)
+make_pipeline(
+    ByNameFeatureSelector(features=["feature1", "feature2"]),
+    StandardScaler(),
+    n_jobs=3,
+).fit(dataset)
+"""
+        result = subprocess.run([sys.executable, "-c", code], timeout=300)
+        assert result.returncode == 0
+
+    def test_streaming_fit(self):
+        dataset = MockDatasetCategorical(N=6)
+
+        def build_transformer(streaming: bool):
+            pipe = ByNameFeatureSelector(
+                features=["Categorical", "feature1", "feature2"]
+            )
+            bb = make_pipeline(
+                IQROutlierRemover(lower_quantile=0.05, upper_quantile=0.95, clip=True),
+                MinMaxScaler(range=(-1, 1)),
+            )
+            pipe = SplitByCategory(features="Categorical", pipeline=bb)(pipe)
+            pipe2 = ByNameFeatureSelector(features=["feature1"])
+            pipe2 = MinMaxScaler(range=(0, 1))(pipe2)
+            pipe = TransformationConcatenate()([pipe, pipe2])
+            pipe = MeanCentering()(pipe)
+            return Transformer(pipelineX=pipe).fit(dataset, streaming=streaming)
+
+        transformer = build_transformer(False)
+        streaming_transformer = build_transformer(True)
+        assert (
+            streaming_transformer.pipelineX.column_names.tolist()
+            == transformer.pipelineX.column_names.tolist()
+        )
+        for life in dataset:
+            assert np.allclose(
+                transformer.transformX(life), streaming_transformer.transformX(life)
+            )
+
+    def test_parallel_fit_split_by_category(self):
+        dataset = MockDatasetCategorical(N=6)
+        main_thread = threading.get_ident()
+
+        class RecordingSplit(SplitByCategory):
+            threads = set()
+
+            def partial_fit(self, X, y=None):
+                RecordingSplit.threads.add(threading.get_ident())
+                return super().partial_fit(X, y)
+
+        def build_transformer(n_jobs: int):
+            pipe = ByNameFeatureSelector(
+                features=["Categorical", "feature1", "feature2"]
+            )
+            bb = make_pipeline(MinMaxScaler(range=(-1, 1)))
+            pipe = RecordingSplit(features="Categorical", pipeline=bb)(pipe)
+            # Same level as the split
+            pipe2 = ByNameFeatureSelector(features=["feature1"])
+            pipe2 = MinMaxScaler(range=(0, 1))(pipe2)
+            pipe = TransformationConcatenate()([pipe, pipe2])
+            return Transformer(pipelineX=pipe, n_jobs=n_jobs).fit(dataset)
+
+        serial = build_transformer(1)
+        parallel = build_transformer(2)
+        assert RecordingSplit.threads == {main_thread}
+        for life in dataset:
+            assert parallel.transformX(life).equals(serial.transformX(life))
+        parallel.pipelineX.runner.close()
+
+    def test_arrow_cache_store(self):
+        dataset = MockDatasetCategorical(N=5)
+
+        def build_transformer(cache_type: CacheStoreType):
+            pipe = ByNameFeatureSelector(
+                features=["Categorical", "feature1", "feature2"]
+            )
+            bb = make_pipeline(MinMaxScaler(range=(-1, 1)))
+            pipe = SplitByCategory(features="Categorical", pipeline=bb)(pipe)
+            # The sums of MeanCentering depend on the memory layout of the
+            # frames read from each store, the maximum is exact
+            pipe = MinMaxScaler(range=(0, 1))(pipe)
+            return Transformer(pipelineX=pipe, cache_type=cache_type).fit(dataset)
+
+        transformer = build_transformer(CacheStoreType.MEMORY)
+        for cache_type in [
+            CacheStoreType.ARROW,
+            CacheStoreType.ARROW_LZ4,
+            CacheStoreType.ARROW_ZSTD,
+        ]:
+            arrow_transformer = build_transformer(cache_type)
+            for life in dataset:
+                assert transformer.transformX(life).equals(
+                    arrow_transformer.transformX(life)
+                )
+
+    def test_step_cache(self, tmp_path):
+        dataset = MockDataset1()
+        step_cache = StepCache(tmp_path)
+
+        def build_transformer(range):
+            pipe = ByNameFeatureSelector(features=["a", "b"])
+            pipe = CountingStep()(pipe)
+            pipe = MinMaxScaler(range=range)(pipe)
+            return Transformer(pipelineX=pipe, step_cache=step_cache).fit(dataset)
+
+        transformer = build_transformer((-1, 1))
+        X = [transformer.transformX(life) for life in dataset]
+
+        transformed = CountingStep.transformed
+        cached_transformer = build_transformer((-1, 1))
+        assert CountingStep.transformed == transformed
+        assert step_cache.hits > 0
+        for life, X_life in zip(dataset, X):
+            assert cached_transformer.transformX(life).equals(X_life)
+        assert CountingStep.transformed == transformed
+
+        other_transformer = build_transformer((0, 1))
+        assert CountingStep.transformed == transformed
+        assert other_transformer.transformX(dataset[0]).min().min() == 0
+
+        assert step_cache.nbytes > 0
+        step_cache.max_bytes = step_cache.nbytes // 2
+        build_transformer((0, 2))
+        assert step_cache.nbytes <= step_cache.max_bytes
+
+    def test_step_cache_eviction(self, tmp_path, monkeypatch):
+        step_cache = StepCache(tmp_path, max_bytes=10**9)
+        value = np.zeros(100)
+        for i in range(4):
+            step_cache.store_output(f"step{i}", "life", value)
+        entry_bytes = step_cache.nbytes // 4
+
+        globs = []
+        files = step_cache._files
+        monkeypatch.setattr(step_cache, "_files", lambda: globs.append(1) or files())
+        assert step_cache.get_output("step0", "life") is not None
+        step_cache.max_bytes = 3 * entry_bytes
+        step_cache.store_output("step4", "life", value)
+        assert step_cache.nbytes == 3 * entry_bytes
+        assert step_cache.get_output("step1", "life") is None
+        assert step_cache.get_output("step2", "life") is None
+        for i in [0, 3, 4]:
+            assert step_cache.get_output(f"step{i}", "life") is not None
+        assert len(globs) == 0
+
+    def test_refit(self):
+        dataset = MockDataset1()
+
+        def build_transformer(range):
+            pipe = ByNameFeatureSelector(features=["a", "b"])
+            pipe = CountingStep()(pipe)
+            pipe = MinMaxScaler(range=range)(pipe)
+            pipe = MeanCentering()(pipe)
+            return Transformer(pipelineX=pipe).fit(dataset)
+
+        transformer = build_transformer((-1, 1))
+        assert len(transformer.pipelineX.runner.dirty_nodes()) == 0
+
+        transformer.set_params(pipeline_X__MinMaxScaler__range=(0, 1))
+        dirty = transformer.pipelineX.runner.dirty_nodes()
+        assert sorted(n.name for n in dirty) == ["MeanCentering", "MinMaxScaler"]
+
+        fitted = CountingStep.fitted
+        transformer.refit(dataset)
+        assert CountingStep.fitted == fitted
+        expected = build_transformer((0, 1))
+        for life in dataset:
+            assert np.allclose(transformer.transformX(life), expected.transformX(life))
+
+        transformer.pipelineX.find_node("MinMaxScaler").range = (-2, 2)
+        transformer.refit(dataset)
+        expected = build_transformer((-2, 2))
+        for life in dataset:
+            assert np.allclose(transformer.transformX(life), expected.transformX(life))
+
+    def test_array_mode(self):
+        dataset = MockDatasetCategorical()
+
+        def build_transformer(array_mode):
+            pipe = ByNameFeatureSelector(features=["feature1", "feature2"])
+            pipe = Clip(lower=-50, upper=500)(pipe)
+            pipe = Diff()(pipe)
+            pipe = MinMaxScaler(range=(-1, 1))(pipe)
+            pipe = MeanCentering()(pipe)
+            pipe = Square()(pipe)
+            pipe = StandardScaler()(pipe)
+            return Transformer(
+                pipelineX=pipe,
+                pipelineY=ByNameFeatureSelector(features=["feature1"]),
+                array_mode=array_mode,
+            ).fit(dataset)
+
+        expected = build_transformer(False)
+        transformer = build_transformer(True)
+        for life in dataset:
+            X = transformer.transformX(life)
+            assert isinstance(X, np.ndarray)
+            assert np.allclose(X, expected.transformX(life).values, equal_nan=True)
+
+        iterator = WindowedDatasetIterator(dataset.map(transformer), window_size=2)
+        X, _, _ = next(iter(iterator))
+        assert X.shape == (2, 2)
+
+        # The memos of the array kernels are not part of the state of the steps
+        for node in dfs_iterator(transformer.pipelineX.final_step):
+            assert "_aligned_values" not in step_state(node)
+            assert "_column_indexer" not in step_state(node)
+            assert not any(
+                k.startswith("_aligned") for k in pickle.loads(pickle.dumps(node)).__dict__
+            )
+
+    def test_fuse_steps(self):
+        dataset = MockDatasetCategorical()
+
+        def build_pipeline(fuse_steps):
+            return make_pipeline(
+                ByNameFeatureSelector(features=["feature1", "feature2"]),
+                Clip(lower=-50, upper=500),
+                MinMaxScaler(range=(-1, 1)),
+                Square(),
+                Scale(3),
+                Sqrt(),
+                fuse_steps=fuse_steps,
+            ).fit(dataset)
+
+        expected = build_pipeline(False)
+        pipe = build_pipeline(True)
+        fused = pipe.runner._execution_graph()
+        assert isinstance(fused, FusedStep)
+        assert len(fused.steps) == 5
+        assert isinstance(fused.previous[0], ByNameFeatureSelector)
+        assert fused.inplace
+
+        for life in dataset:
+            original = life.copy()
+            X = pipe.transform(life)
+            assert list(X.columns) == ["feature1", "feature2"]
+            assert np.array_equal(X.values, expected.transform(life).values)
+            assert np.array_equal(
+                pipe.transform_array(life), expected.transform_array(life)
+            )
+            pd.testing.assert_frame_equal(life, original)
+        assert len(list(dfs_iterator(pipe))) == 6
+
+    def test_fuse_steps_edited_in_place(self):
+        dataset = MockDatasetCategorical()
+
+        def build_pipeline(fuse_steps, upper, factor):
+            return make_pipeline(
+                ByNameFeatureSelector(features=["feature1", "feature2"]),
+                Clip(lower=-50, upper=upper),
+                Scale(factor),
+                MeanCentering(),
+                fuse_steps=fuse_steps,
+            ).fit(dataset)
+
+        pipe = build_pipeline(True, 500, 3)
+        pipe.transform(dataset[0])
+
+        pipe.find_node("Clip").upper = 100
+        pipe.find_node("MeanCentering").mean = pipe.find_node("MeanCentering").mean * 0
+        pipe.find_node("Scale").set_params(scale_factor=2)
+        expected = build_pipeline(False, 100, 2)
+        expected.find_node("MeanCentering").mean = pipe.find_node("MeanCentering").mean
+        for life in dataset:
+            assert np.array_equal(
+                pipe.transform(life).values, expected.transform(life).values
+            )
+            assert np.array_equal(
+                pipe.transform_array(life), expected.transform_array(life)
+            )
+
+    def test_online(self):
+        dataset = MockDatasetCategorical()
+        features = ByNameFeatureSelector(features=["feature1", "feature2"])
+        filled = ForwardFillImputer()(features)
+        statistics = ExpandingStatistics(to_compute=["mean", "std", "max"])(filled)
+        rolling = RollingStatistics(window=7, to_compute=["kurtosis", "rms"])(filled)
+        smoothed = StandardScaler()(EWMAFilter(span=5)(Diff()(filled)))
+        counts = MeanCentering()(Accumulate()(filled))
+        pipe = make_pipeline(
+            Concatenate()([statistics, rolling, smoothed, counts])
+        ).fit(dataset)
+
+        life = dataset[4].copy()
+        life.loc[life.index[[0, 10, 11, 30]], "feature2"] = np.nan
+        expected = pipe.transform(life)
+
+        session = pipe.online()
+        other_session = pipe.online()
+        with pytest.warns(UserWarning, match="MeanCentering are not online") as record:
+            chunks = [
+                session.update(life.iloc[start:end])
+                for start, end in [(0, 1), (1, 12), (12, 13), (13, 40), (40, 100)]
+            ]
+        assert len([w for w in record if "not online" in str(w.message)]) == 1
+        X = pd.concat(chunks)
+        pd.testing.assert_frame_equal(X, expected)
+        assert session.n_rows == 100
+
+        X = other_session.update(life)
+        pd.testing.assert_frame_equal(X, expected)
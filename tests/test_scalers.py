@@ -1,9 +1,14 @@
 
 
+import pickle
+
 import numpy as np
 import pandas as pd
 
-from ceruleo.transformation.features.scalers import (RobustMinMaxScaler)
+from ceruleo.transformation.features.scalers import (MinMaxScaler,
+                                                     PerCategoricalMinMaxScaler,
+                                                     RobustMinMaxScaler,
+                                                     StandardScaler)
 from sklearn.preprocessing import RobustScaler
 
 class TestImputers():
@@ -31,3 +36,69 @@ class TestImputers():
 
         sk_scaler.transform(df1)
       
+
+
+class TestPerCategoricalMinMaxScaler():
+
+    def test_transform(self):
+        lives = [
+            pd.DataFrame({
+                'category': np.random.choice(['a', 'b', 'c'], 500),
+                'x': np.random.randn(500) * 5 + 25,
+                'y': np.random.randn(500) * 2,
+            })
+            for _ in range(3)
+        ]
+        for scaler_class, params in [
+            (MinMaxScaler, {'range': (-1, 1)}),
+            (RobustMinMaxScaler, {'range': (0, 1), 'clip': False}),
+        ]:
+            scaler = PerCategoricalMinMaxScaler(
+                categorical_feature='category', scaler=scaler_class, scaler_params=params
+            )
+            for life in lives:
+                scaler.partial_fit(life)
+
+            life = lives[0].copy()
+            life.loc[life.index[:10], 'category'] = 'unknown'
+            life.index = np.repeat(np.arange(250), 2)
+            X = scaler.transform(life)
+            assert X.index.equals(life.index)
+            for category in ['a', 'b', 'unknown']:
+                mask = (life['category'] == category).values
+                category_scaler = scaler.scalers.get(category, scaler.scalers['default'])
+                expected = category_scaler.transform(life[mask].drop(columns=['category']))
+                assert np.allclose(X[mask], expected)
+
+            assert scaler._stacked is not None
+            assert '_stacked' not in scaler.__getstate__()
+            copied = pickle.loads(pickle.dumps(scaler))
+            assert np.allclose(copied.transform(life), X)
+
+
+class TestStandardScaler():
+
+    def test_partial_fit_pooled_moments(self):
+        lives = [
+            pd.DataFrame({
+                'a': np.random.randn(n) * scale + loc,
+                'b': np.random.randn(n) * 2 * scale - loc,
+            })
+            for n, scale, loc in [(20, 1, 0), (500, 3, 10), (60, 0.5, -4)]
+        ]
+        lives[1].loc[:30, 'b'] = np.nan
+        data = pd.concat(lives)
+
+        scaler = StandardScaler()
+        for life in lives:
+            scaler.partial_fit(life)
+        # The moments of the concatenated cycles, not the average of the
+        # moments of each cycle
+        assert np.allclose(scaler.mean, data.mean())
+        assert np.allclose(scaler.std, data.std())
+        assert np.allclose(scaler.transform(data), (data - data.mean()) / data.std(), equal_nan=True)
+
+        merged = StandardScaler().partial_fit(lives[0])
+        merged.merge(StandardScaler().partial_fit(lives[1]).merge(StandardScaler().partial_fit(lives[2])))
+        assert np.allclose(merged.mean, data.mean())
+        assert np.allclose(merged.std, data.std())
@@ -233,3 +233,61 @@ class TestShufflers:
 
         
 
+
+    def test_number_of_valid_samples(self):
+        for shuffler_class in [
+            NotShuffled,
+            AllShuffled,
+            IntraTimeSeriesShuffler,
+            InverseOrder,
+            TimeSeriesOrderIntraSignalShuffling,
+            TimeSeriesOrderShuffling,
+        ]:
+            for step in [1, 2, 3, 5]:
+                for minimum_timestamp in [0, 2, 4]:
+                    x = shuffler_class()
+                    it = MockIterator(step, dataset=MockDatasetMedium())
+                    generated = [e for e in x.iterator(it)]
+                    expected = [
+                        len([e for e in generated if e[0] == i and e[1] >= minimum_timestamp])
+                        for i in range(it.dataset.n_time_series)
+                    ]
+                    assert x.number_of_valid_samples(minimum_timestamp).tolist() == expected
+
+        it = WindowedDatasetIterator(MockDatasetBig(673), window_size=5, step=3)
+        assert len(it) == len([e for e in it.shuffler.iterator(it) if e[1] >= 4])
+        it = WindowedDatasetIterator(MockDatasetBig(673), window_size=5, step=3, padding=True)
+        assert len(it) == len([e for e in it.shuffler.iterator(it)])
+
+        for shuffler_class in [
+            NotShuffled,
+            AllShuffled,
+            IntraTimeSeriesShuffler,
+            InverseOrder,
+            TimeSeriesOrderIntraSignalShuffling,
+            TimeSeriesOrderShuffling,
+        ]:
+            for start_index, end_index in [
+                (2, None),
+                (0, RelativeToEnd(7)),
+                (RelativeToStart(9), RelativeToEnd(3)),
+                (RelativeToEnd(40), None),
+            ]:
+                for last_point in [True, False]:
+                    it = WindowedDatasetIterator(
+                        MockDatasetMedium(),
+                        window_size=5,
+                        step=4,
+                        shuffler=shuffler_class(),
+                        start_index=start_index,
+                        end_index=end_index,
+                        last_point=last_point,
+                    )
+                    generated = [e for e in it.shuffler.iterator(it)]
+                    for i, size in enumerate(it.dataset.sizes):
+                        first = it.start_index.get(size)
+                        end = it.end_index.get(size)
+                        assert all(
+                            first <= e[1] < end for e in generated if e[0] == i
+                        )
+                    assert len(it) == len([e for e in generated if e[1] >= 4])
@@ -1,9 +1,11 @@
 from curses import window
 from typing import List, Optional
 
+import pickle
 import numpy as np
 import pandas as pd
 import pytest
+import pywt
 import scipy.stats
 from ceruleo.dataset.ts_dataset import AbstractTimeSeriesDataset
 from ceruleo.transformation.features.entropy import LocalEntropyMeasures
@@ -16,6 +18,8 @@ from ceruleo.transformation.features.extraction import (
     RollingStatistics,
     SimpleEncodingCategorical,
     SlidingNonOverlappingEMD,
+    SlidingNonOverlappingWaveletDecomposition,
+    wrcoef,
 )
 from ceruleo.transformation.features.outliers import (
     EWMAOutOfRange,
@@ -24,13 +28,15 @@ from ceruleo.transformation.features.outliers import (
     IsolationForestOutlierRemover,
 )
 from ceruleo.transformation.features.resamplers import IntegerIndexResamplerTransformer
+from ceruleo.transformation.features.scalers import RobustStandardScaler
 from ceruleo.transformation.features.selection import (
     ByNameFeatureSelector,
     NullProportionSelector,
 )
+from ceruleo.transformation.features.tdigest import TDigest, merge_columns
 from ceruleo.transformation.features.transformation import Accumulate
 from ceruleo.transformation.functional.pipeline.pipeline import Pipeline
-from ceruleo.transformation.utils import QuantileEstimator
+from ceruleo.transformation.utils import QuantileComputer, QuantileEstimator
 
 
 def manual_expanding(df: pd.DataFrame, min_points: int = 1):
@@ -420,6 +426,30 @@ class TestGenerators:
 
         assert (pandas_t - fixed_t).mean().mean() < 1e-15
 
+    def test_expanding_pandas(self):
+        X = pd.DataFrame(
+            {"a": np.random.rand(200) * 10 + 1000, "b": np.random.rand(200) * 100}
+        )
+        X.iloc[5:15, 0] = np.nan
+        X.iloc[0:20, 1] = 5.0
+        expanding = X.expanding(2)
+        expected = {
+            "kurtosis": expanding.kurt(),
+            "skewness": expanding.skew(),
+            "std": expanding.std(),
+            "mean": expanding.mean(),
+            "energy": X.pow(2).expanding(2).sum(),
+            "std_atan": np.arctan(X).expanding(2).std(),
+        }
+        X_t = ExpandingStatistics(to_compute=list(expected.keys())).transform(X)
+        # Same dtype as RollingStatistics
+        assert (X_t.dtypes == np.float64).all()
+        for stats, values in expected.items():
+            computed = X_t[[f"{c}_{stats}" for c in X.columns]].values
+            assert np.allclose(
+                computed, values.values, rtol=1e-5, atol=1e-6, equal_nan=True
+            ), stats
+
     def test_rolling(self):
         lives = [
             pd.DataFrame(
@@ -463,6 +493,73 @@ class TestGenerators:
         pandas_t = rolling.transform(ds_train[0][["a", "b"]])
         assert sorted(pandas_t.columns) == sorted(['a_mean', 'a_kurtosis', 'b_peak', 'b_impulse'])
 
+    def test_rolling_pandas(self):
+        # pandas loses precision in some windows that are almost constant,
+        # which test_rolling_near_constant checks against a two-pass reference
+        np.random.seed(0)
+        X = pd.DataFrame(
+            {
+                "a": np.random.rand(300) * 100 + 1000,
+                "b": np.random.rand(300) * 100 * np.random.rand(300) ** 2,
+            }
+        )
+        X.iloc[10:25, 0] = np.nan
+        X.iloc[100:140, 1] = 5.0
+        window, min_points = 15, 2
+        rolling = X.rolling(window, min_points)
+        abs_mean = X.abs().rolling(window, min_points).mean()
+        peak = rolling.max() - rolling.min()
+        rms = X.pow(2).rolling(window, min_points).mean().pow(0.5)
+        expected = {
+            "mean": rolling.mean(),
+            "kurtosis": rolling.kurt(),
+            "skewness": rolling.skew(),
+            "max": rolling.max(),
+            "min": rolling.min(),
+            "std": rolling.std(),
+            "peak": peak,
+            "impulse": peak / abs_mean,
+            "clearance": peak
+            / X.abs().pow(0.5).rolling(window, min_points).mean().pow(2),
+            "rms": rms,
+            "shape": rms / abs_mean,
+            "crest": peak / rms,
+            "deviance": (X - rolling.mean()) / rolling.std(),
+            "std_atan": np.arctan(X).rolling(window, min_points).std(),
+            "std_asinh": np.arcsinh(X).rolling(window, min_points).std(),
+            "energy": X.pow(2).rolling(window, min_points).sum(),
+        }
+        X_t = RollingStatistics(
+            window=window, min_points=min_points, to_compute=list(expected.keys())
+        ).transform(X)
+        for stats, values in expected.items():
+            computed = X_t[[f"{c}_{stats}" for c in X.columns]].values
+            assert np.allclose(
+                computed, values.values, rtol=1e-6, atol=1e-8, equal_nan=True
+            ), stats
+
+    def test_rolling_near_constant(self):
+        x = np.random.rand(300) * 100 * np.random.rand(300) ** 2
+        x[100:140] = 5.0
+        x[99] = 5.0 + 1e-2
+        window = 15
+        X_t = RollingStatistics(
+            window=window, min_points=2, to_compute=["skewness", "kurtosis", "deviance"]
+        ).transform(pd.DataFrame({"b": x}))
+        for i in range(window - 1, 140):
+            w = x[i - window + 1 : i + 1]
+            n = w.shape[0]
+            d = w - w.mean()
+            B, C, D = (d**2).mean(), (d**3).mean(), (d**4).mean()
+            if B == 0:
+                assert X_t["b_kurtosis"].iloc[i] == -3
+                assert np.isnan(X_t["b_deviance"].iloc[i])
+                continue
+            skew = np.sqrt(n * (n - 1)) * C / ((n - 2) * B * np.sqrt(B))
+            kurt = ((n * n - 1) * D / (B * B) - 3 * (n - 1) ** 2) / ((n - 2) * (n - 3))
+            assert np.isclose(X_t["b_skewness"].iloc[i], skew, rtol=1e-9)
+            assert np.isclose(X_t["b_kurtosis"].iloc[i], kurt, rtol=1e-9)
+
     def test_EWMAOutOfRange(self):
         a = np.random.randn(500) * 0.5 + 2
         b = np.random.randn(500) * 0.5 + 5
@@ -669,6 +766,114 @@ class TestQuantileEstimator:
 
         assert q.estimate_quantile(0.5, "A") - 5 < 0.1
 
+    def test_pool(self):
+        lives = [
+            pd.DataFrame(np.random.randn(5000, 5), columns=list("abcde"))
+            for _ in range(4)
+        ]
+        serial = QuantileEstimator(tdigest_size=100)
+        for life in lives:
+            serial.update(life)
+        for backend in ["thread", "process"]:
+            q = QuantileEstimator(tdigest_size=100, max_workers=2, backend=backend)
+            for life in lives[:2]:
+                q.update(life)
+            q = pickle.loads(pickle.dumps(q))
+            for life in lives[2:]:
+                q.update(life)
+            s = q.quantile(0.5)
+            assert s.index.tolist() == list("abcde")
+            assert np.allclose(s, serial.quantile(0.5))
+            q.close()
+            assert np.allclose(q.quantile(0.9), serial.quantile(0.9))
+
+
+class TestQuantileComputer:
+    def test_exact(self):
+        lives = [
+            pd.DataFrame(
+                {
+                    "A": np.random.randn(3000) * 10,
+                    "B": np.random.randint(0, 4, 3000).astype(float),
+                }
+            )
+            for _ in range(5)
+        ]
+        lives[1].loc[:50, "A"] = np.nan
+        data = pd.concat(lives).astype(np.float32).astype(np.float64)
+
+        q = QuantileComputer(quantiles=[0.5], max_values_in_memory=100, n_bins=8)
+        for life in lives:
+            q.update(life)
+        for quantile in [0, 0.1, 0.5, 0.75, 1]:
+            assert np.allclose(q.quantile(quantile), data.quantile(quantile))
+
+        copy = pickle.loads(pickle.dumps(q))
+        q.close()
+        assert np.allclose(copy.quantile(0.5), data.quantile(0.5))
+        with pytest.raises(ValueError):
+            copy.update(lives[0])
+
+        scaler = RobustStandardScaler()
+        for life in lives:
+            scaler.partial_fit(life)
+        expected = (data - data.median()) / (data.quantile(0.75) - data.quantile(0.25))
+        assert np.allclose(
+            scaler.transform(lives[0]), expected.iloc[:3000], equal_nan=True
+        )
+        assert scaler.quantile_estimator._path is None
+        assert np.allclose(
+            scaler.transform(lives[1]), expected.iloc[3000:6000], equal_nan=True
+        )
+        with pytest.raises(ValueError):
+            scaler.partial_fit(lives[0])
+
+    def test_infinite_values(self):
+        lives = [
+            pd.DataFrame({"A": np.random.randn(1000) * 10}) for _ in range(3)
+        ]
+        lives[0].loc[:20, "A"] = np.inf
+        lives[1].loc[:5, "A"] = -np.inf
+        lives[2].loc[:3, "A"] = np.nan
+        data = pd.concat(lives).astype(np.float32).astype(np.float64)
+
+        q = QuantileComputer(max_values_in_memory=100, n_bins=8)
+        for life in lives:
+            q.update(life)
+        for quantile in [0.01, 0.1, 0.5, 0.9, 0.99]:
+            assert np.allclose(q.quantile(quantile), data.quantile(quantile))
+        assert q.quantile(0, "A") == -np.inf
+        assert q.quantile(1, "A") == np.inf
+        q.close()
+
+
+class TestTDigest:
+    def test_tdigest(self):
+        X = np.random.randn(20000, 3) * 10
+        X[::5, 1] = np.nan
+        digests = [TDigest(100) for _ in range(3)]
+        for chunk in np.array_split(X, 4):
+            digests = merge_columns(digests, chunk)
+
+        for j, digest in enumerate(digests):
+            values = X[:, j][~np.isnan(X[:, j])]
+            assert digest.count == values.shape[0]
+            assert digest.weights.sum() == values.shape[0]
+            assert len(digest.means) <= 100
+            assert np.all(np.diff(digest.means) >= 0)
+            for q in [0.1, 0.5, 0.9]:
+                assert np.abs(digest.estimate_quantile(q) - np.quantile(values, q)) < 0.2
+
+            single = TDigest(100)
+            for chunk in np.array_split(X[:, j], 4):
+                single = single.merge_unsorted(chunk)
+            assert np.array_equal(single.means, digest.means)
+
+        merged = TDigest(100).merge(digests)
+        assert merged.count == sum(d.count for d in digests)
+        assert merged.min == np.nanmin(X)
+        assert merged.max == np.nanmax(X)
+
 
 class TestEMD:
     def test_emd(self):
@@ -678,6 +883,64 @@ class TestEMD:
         assert r.shape[0] == A.shape[0]
         assert r.shape[1] == A.shape[1] * 5
 
+        parallel = SlidingNonOverlappingEMD(window_size=300, max_imfs=5, n_jobs=4)
+        assert np.array_equal(parallel.transform(A).values, r.values)
+
+    def test_emd_memo(self):
+        A = pd.DataFrame({"A": np.random.randn(2000), "B": np.random.randn(2000)})
+        expected = EMD(n=3).transform(A)
+        q = EMD(n=3, n_jobs=2)
+        r = q.transform(A)
+        assert list(r.columns) == ["A_0", "A_1", "A_2", "B_0", "B_1", "B_2"]
+        assert np.array_equal(r.values, expected.values, equal_nan=True)
+
+        r = q.transform(A)
+        assert np.array_equal(r.values, expected.values, equal_nan=True)
+        info = q.sift_info()
+        assert info.loc["A", "calls"] == 2
+        assert info.loc["A", "hits"] == 1
+        assert info["failures"].sum() == 0
+
+        restored = pickle.loads(pickle.dumps(q))
+        assert "_sift_cache" not in restored.__getstate__()
+        assert restored.sift_info().empty
+        assert np.array_equal(restored.transform(A).values, r.values, equal_nan=True)
+        q.close()
+
+        q = EMD(n=3, n_jobs=2, backend="process")
+        r = q.transform(A)
+        executor = q._executor
+        B = A * 2
+        assert np.array_equal(
+            q.transform(B).values, EMD(n=3).transform(B).values, equal_nan=True
+        )
+        assert q._executor is executor
+        q.close()
+        assert q._executor is None
+        assert np.array_equal(r.values, expected.values, equal_nan=True)
+
+    def test_wavelet(self):
+        A = pd.DataFrame({"A": np.random.randn(1030), "B": np.random.randn(1030)})
+        keep = ["A3", "D3", "D1"]
+        q = SlidingNonOverlappingWaveletDecomposition(
+            window_size=100, level=3, wavelet="db4", keep=keep
+        )
+        r = q.transform(A)
+        assert r.shape == (1030, 6)
+        assert r.dtypes.unique().tolist() == [np.float32]
+
+        for c in A.columns:
+            for start in [0, 500, 1000]:
+                values = A[c].values[start : start + 100]
+                coeffs = pywt.wavedec(values, "db4", level=3)
+                for name in keep:
+                    expected = wrcoef(values, name[0].lower(), coeffs, "db4", int(name[1]))
+                    assert np.allclose(
+                        r[f"wavelet_{name}_{c}"].values[start : start + 100],
+                        expected,
+                        atol=1e-5,
+                    )
+
 
 class TestResamplers:
     def test_resampler(self):